@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from program3.core import Core
+from program3.helpers.events import EventSink
+from program3.helpers.workload import make_workload, write_workload
+
+#  Default benchmark cases, each a workload model from helpers.workload and
+#  its options. contention is the share of requests going to a hot set of 5%
+#  of the resources, length the length of the wait chains built.
+CASES = [
+    {"name": "uniform", "model": "uniform", "processes": 200, "resources": 200, "steps": 20000, "options": {}},
+    {"name": "contended", "model": "hotspot", "processes": 200, "resources": 200, "steps": 20000,
+     "options": {"contention": 0.8}},
+    {"name": "wide", "model": "hotspot", "processes": 5000, "resources": 2000, "steps": 20000,
+     "options": {"contention": 0.2}},
+    {"name": "chain", "model": "chain", "processes": 5000, "resources": 5000, "steps": 20000,
+     "options": {"length": 4000}},
+]
+#  Number of steps at which full detection is timed.
+FULL_DETECTION_SAMPLES = 1000
+#  Steps parsed per timed batch.
+PARSE_BATCH = 1000
+#  Times each path is run; throughput is the median of the runs.
+REPEAT = 5
+#  Slowdown against the baseline that counts as a regression.
+THRESHOLD = 0.2
+
+
+def write_case(fp, case, seed=0):
+    """
+    Write the synthetic trace of a case from its workload model.
+    :param fp: string file path to write.
+    :param case: case dict.
+    :param seed: random seed.
+    :return: number of steps written.
+    """
+    options = dict(case["options"])
+    if "length" in options:
+        #  A round of the chain model takes about 4 steps per process in it, so
+        #  shorten the chains until at least one round fits in the steps.
+        options["length"] = max(1, min(options["length"], case["steps"] // 4))
+    workload = make_workload(case["model"], case["processes"], case["resources"], seed, **options)
+    return write_workload(fp, workload, case["steps"])
+
+
+def percentiles(samples):
+    """
+    :param samples: list of latencies in nanoseconds.
+    :return: dict of p50, p90, p99 and max in microseconds.
+    """
+    if not samples:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    samples = sorted(samples)
+    last = len(samples) - 1
+    return {"p50": samples[last * 50 // 100] / 1000.0,
+            "p90": samples[last * 90 // 100] / 1000.0,
+            "p99": samples[last * 99 // 100] / 1000.0,
+            "max": samples[last] / 1000.0}
+
+
+def timed(name, count, run, repeat=REPEAT):
+    """
+    Time one hot path repeat times for latency and throughput, then once
+    more under tracemalloc for peak memory. Throughput only counts the timed
+    calls and is taken from the median run, so one noisy run does not show
+    up as a regression; best_per_sec is the fastest run. The latency
+    percentiles pool the samples of every run.
+    :param name: name of the path.
+    :param count: number of items per run, for items/sec.
+    :param run: function taking a list to append latencies to, in ns.
+    :param repeat: number of timed runs.
+    :return: result dict.
+    """
+    samples = []
+    runs = []
+    for i in range(repeat):
+        run_samples = []
+        run(run_samples)
+        runs.append(sum(run_samples) / 1e9)
+        samples.extend(run_samples)
+    seconds = statistics.median(runs)
+    tracemalloc.start()
+    run([])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {"path": name,
+              "seconds": seconds,
+              "per_sec": count / seconds if seconds > 0 else 0.0,
+              "best_per_sec": count / min(runs) if min(runs) > 0 else 0.0,
+              "repeat": repeat,
+              "peak_bytes": peak}
+    result.update(percentiles(samples))
+    return result
+
+
+def bench_case(case, fp, repeat=REPEAT):
+    """
+    Benchmark parsing, stepping and deadlock detection on one trace. Parse
+    latencies are per batch of PARSE_BATCH steps, the others per call.
+    :param case: case dict.
+    :param fp: string file path to the case's trace.
+    :param repeat: number of timed runs of each path.
+    :return: list of result dicts.
+    """
+    clock = time.perf_counter_ns
+    steps = case["steps"]
+
+    def parse(samples):
+        logic = Core()
+        logic.set_event_sink(EventSink())
+        start = clock()
+        for read in logic.load_file(fp, PARSE_BATCH):
+            now = clock()
+            samples.append(now - start)
+            start = now
+        samples.append(clock() - start)
+
+    loaded = Core()
+    loaded.set_event_sink(EventSink())
+    loaded.read_file(fp)
+    trace = loaded.get_steps()
+
+    def fresh():
+        logic = Core()
+        logic.set_event_sink(EventSink())
+        logic.processes = loaded.get_processes()
+        logic.resources = loaded.get_resources()
+        logic.steps = trace
+        logic.init_state()
+        return logic
+
+    def step(samples):
+        logic = fresh()
+        for i in range(len(trace)):
+            start = clock()
+            logic.step_forward()
+            samples.append(clock() - start)
+
+    def detect(samples, incremental, every):
+        logic = fresh()
+        detection = logic.deadlock_detection_incremental if incremental else logic.deadlock_detection
+        for i in range(len(trace)):
+            logic.step_forward()
+            if i % every == 0:
+                start = clock()
+                detection()
+                samples.append(clock() - start)
+
+    #  Full detection walks the whole graph, so it is only timed on every
+    #  every-th step to keep the run short.
+    every = max(1, steps // FULL_DETECTION_SAMPLES)
+    results = [timed("parse", steps, parse, repeat),
+               timed("step", steps, step, repeat),
+               timed("detect_incremental", steps, lambda s: detect(s, True, 1), repeat),
+               timed("detect_full", (steps + every - 1) // every, lambda s: detect(s, False, every), repeat)]
+    for result in results:
+        result["case"] = case["name"]
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Find paths that got slower than the baseline run, by their median
+    throughput.
+    :param results: list of result dicts from this run.
+    :param baseline: list of result dicts from the baseline run.
+    :param threshold: allowed slowdown, as a fraction of the baseline.
+    :return: list of (case, path, baseline per_sec, per_sec) regressions.
+    """
+    before = {(r["case"], r["path"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = before.get((result["case"], result["path"]))
+        if old is not None and result["per_sec"] < old["per_sec"] * (1 - threshold):
+            regressions.append((result["case"], result["path"], old["per_sec"], result["per_sec"]))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.bench [--output FILE] [--baseline FILE]
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status, 1 if a regression was found.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the core parse, step and detection paths.")
+    parser.add_argument("--output", default="bench_results.json", help="file to save the results to")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown counted as a regression, default 0.2 (20%%)")
+    parser.add_argument("--case", action="append", help="run only the named cases")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the step count of every case")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the traces")
+    parser.add_argument("--repeat", type=int, default=REPEAT,
+                        help="timed runs of each path, throughput is their median")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    cases = [dict(c) for c in CASES if not args.case or c["name"] in args.case]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for case in cases:
+            case["steps"] = int(case["steps"] * args.scale)
+            fp = os.path.join(tmp, case["name"] + ".data")
+            write_case(fp, case, args.seed)
+            case_results = bench_case(case, fp, args.repeat)
+            for r in case_results:
+                print("%-10s %-19s %12.0f /s  p50 %8.2f us  p99 %9.2f us  peak %7.1f MB" %
+                      (r["case"], r["path"], r["per_sec"], r["p50"], r["p99"], r["peak_bytes"] / 1e6))
+            results.extend(case_results)
+
+    with open(args.output, 'w') as f:
+        json.dump({"python": platform.python_version(), "seed": args.seed, "scale": args.scale,
+                   "repeat": args.repeat, "cases": cases, "results": results}, f, indent=2)
+    print("Saved results to %s." % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for case, path, old, new in regressions:
+            print("REGRESSION %s %s: %.0f/s -> %.0f/s (%.0f%% slower)" %
+                  (case, path, old, new, 100 * (1 - new / old)))
+        if regressions:
+            return 1
+        print("No regressions against %s." % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import argparse
+import sys
+import time
+
+from program3.helpers.binarytrace import convert
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.convert TRACE.data TRACE.rmst
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Convert a text trace to the binary trace format.")
+    parser.add_argument("source", help="text .data trace to read")
+    parser.add_argument("target", help="binary trace to write")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        count = convert(args.source, args.target)
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print("Wrote %d steps to %s in %.3f s." % (count, args.target, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
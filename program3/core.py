@@ -1,5 +1,17 @@
-import numpy as np
+import time
+from array import array
+from itertools import islice
+from program3.helpers.binarytrace import BinaryTrace
+from program3.helpers.edges import SparseEdges
+from program3.helpers.events import BLOCKED, DEFERRED, FREED, GRANTED, HANDOFF, PrintSink
 from program3.helpers.graph import Graph
+from program3.helpers.intgraph import IntGraph
+from program3.helpers.scheduler import FifoScheduler
+from program3.helpers.trace import iter_steps, read_header
+
+
+#  Deadlock detection engines selectable with Core.set_detection.
+DETECTIONS = ("graph", "matrix", "scc")
 
 
 class Core(object):
@@ -16,17 +28,52 @@ class Core(object):
         self.steps = []
         #  Marks if resource is available or not.
         self.available = []
-        #  Adjacency Matrices for hold and request edges.
+        #  Units of each resource and maximum claims by process, from the trace header.
+        self.units = []
+        self.claims = {}
+        #  Process priorities from the trace header for the grant scheduler, or None.
+        self.priorities = None
+        #  Banker's algorithm avoidance: requests are only granted if the state stays safe.
+        self.avoidance = False
+        self.banker = None
+        #  Resources with requests deferred as unsafe while units were free.
+        self.deferred = set()
+        #  Sparse hold and request edges, indexable like adjacency matrices.
         self.hold_edges = []
         self.request_edges = []
         #  Tracks where we are in the state of the system.
         self.state_num = 0
         #  Wait-for graph that we perform DFS for detecting deadlock cycles.
-        self.graph = Graph()
+        self.graph = IntGraph()
         #  Connected vertices holding resource.
         self.connected_v = []
+        #  Wait queues deciding who gets a released resource.
+        self.scheduler = FifoScheduler()
         #  State stringified.
         self.state_string = [" "] * 2
+        #  Number of distinct wait-for edges in the graph.
+        self.wait_edges = 0
+        #  Visit marks for searches over the wait-for graph, indexed by process.
+        self.visit_mark = array('L')
+        self.visit_parent = array('l')
+        self.visit_epoch = 0
+        #  Processes around the last detected cycle, in wait-for order.
+        self.deadlock_cycle = None
+        #  Deadlocked components and the processes blocked behind them, from find_deadlocks.
+        self.deadlock_components = []
+        self.deadlock_blocked = []
+        #  Deadlock detection engine used by detect: "graph" or "matrix".
+        self.detection = "graph"
+        #  Incremental deadlock detector state, kept between steps.
+        self.reset_incremental_detection()
+        #  Receives step outcomes, wait-for edge changes and deadlock verdicts.
+        self.events = PrintSink()
+        #  Optional helpers.instrument.Instrumentation, None when disabled.
+        self.instrument = None
+        #  Saved states by state number, taken every checkpoint_interval steps.
+        #  Off unless enabled, since each one is a full copy of the state.
+        self.checkpoint_interval = 0
+        self.checkpoints = {}
 
     def get_processes(self):
         return self.processes
@@ -43,6 +90,23 @@ class Core(object):
     def get_connected_v(self):
         return self.connected_v
 
+    def get_units(self):
+        return self.units
+
+    def get_claims(self):
+        return self.claims
+
+    def get_banker(self):
+        return self.banker
+
+    def set_avoidance(self, enabled):
+        """
+        Turn Banker's algorithm deadlock avoidance on or off. Needs a claim line
+        for every process that requests anything. Call before init_state.
+        :param enabled: True to defer requests that would leave an unsafe state.
+        """
+        self.avoidance = enabled
+
     def get_hold_edges(self):
         return self.hold_edges
 
@@ -53,58 +117,247 @@ class Core(object):
         return self.state_num
 
     def get_graph(self):
-        return self.graph
+        """
+        :return: the wait-for graph behind the Graph API.
+        """
+        return Graph(self.graph)
 
     def get_state_string(self):
         return self.state_string
 
+    def get_deadlock_cycle(self):
+        return self.deadlock_cycle
+
+    def get_deadlock_components(self):
+        return self.deadlock_components
+
+    def get_deadlock_blocked(self):
+        return self.deadlock_blocked
+
+    def get_wait_edge_count(self):
+        return self.wait_edges
+
+    def get_detection(self):
+        return self.detection
+
+    def set_detection(self, detection):
+        """
+        Choose the deadlock detection engine used by detect. "graph" looks for
+        cycles in the wait-for graph, which is exact for single-unit resources.
+        "matrix" runs the multi-instance detection algorithm over the
+        Available, Allocation and Request matrices, which is exact for any
+        number of units. "scc" finds every deadlocked component of the
+        wait-for graph and the processes blocked behind them in one pass.
+        :param detection: "graph", "matrix" or "scc".
+        """
+        if detection not in DETECTIONS:
+            raise ValueError("Unknown deadlock detection: %s" % detection)
+        if detection != self.detection:
+            #  The other engines overwrite the reported cycle, so the next graph
+            #  detect has to work out the deadlocked set again.
+            self.deadlock_result_stale = True
+        self.detection = detection
+
+    def get_scheduler(self):
+        return self.scheduler
+
+    def set_scheduler(self, scheduler):
+        """
+        Select the grant scheduling policy. Call before init_state, requests
+        already queued are not carried over.
+        :param scheduler: GrantScheduler instance.
+        """
+        self.scheduler = scheduler
+        self.scheduler.set_priorities(self.priorities)
+
+    def get_scheduler_stats(self):
+        return self.scheduler.get_stats(self.state_num)
+
+    def get_event_sink(self):
+        return self.events
+
+    def set_event_sink(self, events):
+        """
+        Choose where step outcomes, wait-for edge changes and deadlock verdicts
+        go, e.g. helpers.events.EventSink() for quiet runs.
+        :param events: helpers.events.EventSink.
+        """
+        self.events = events
+
+    def get_instrumentation(self):
+        return self.instrument
+
+    def set_instrumentation(self, instrument):
+        """
+        Attach counters and timers to the parse, step and detection paths.
+        :param instrument: helpers.instrument.Instrumentation, or None to disable.
+        """
+        self.instrument = instrument
+
+    def set_checkpoint_interval(self, interval):
+        """
+        Set how many steps apart state checkpoints are taken. Closer checkpoints
+        make seeking faster and use more memory. 0, the default, keeps only the
+        initial state, so seeking back replays from the start.
+        :param interval: number of steps between checkpoints.
+        """
+        self.checkpoint_interval = interval
+        self.checkpoints = {n: c for n, c in self.checkpoints.items()
+                            if n == 0 or (interval and n % interval == 0)}
+
     def read_file(self, fp):
         """
         Read in file, set number of processes, number of resources,
         and each step of the simulation state.
         :param fp: string file path to the file being parsed for data.
+        :raises TraceFormatError: on a malformed line, with its line number.
         """
         try:
-            self.steps = []
-            f = open(fp, 'r')
-            file_arr = f.read().splitlines()
-            #  Get number of processes.
-            self.processes = int(file_arr.pop(0).split(' ')[0])
-            #  Get number of resources.
-            self.resources = int(file_arr.pop(0).split(' ')[0])
-            print("\n%d processes and %d resources." % (self.processes, self.resources))
-            #  Load each step.
-            for line in file_arr:
-                line_arr = line.split(' ')
-                #  Get process num.
-                p = int(line_arr[0].strip('p'))
-                #  Get request/release.
-                if line_arr[1] == 'requests':
-                    re = 1
-                else:
-                    re = 0
-                #  Get resource num.
-                r = int(line_arr[2].strip('r'))
-                #  Store as tuple in our steps.
-                self.steps.append((p, re, r))
-            print("%d total steps in simulation.\n" % len(self.steps))
-            self.state_string[0] = str(self.processes) + " processes and " + str(self.resources) + " resources. "
-            self.state_string[1] = str(len(self.steps)) + " total steps in simulation."
+            for read in self.load_file(fp):
+                pass
         except IOError:
-            print("Cannot find the file at", fp)
+            self.events.load_failed(fp)
+
+    def load_file(self, fp, batch=1 << 14):
+        """
+        Read in a file a batch of steps at a time, for loading in the
+        background. The header is taken first, then steps are appended to the
+        loaded steps as they are parsed, so the part already read can be
+        stepped through while the rest is still loading.
+        :param fp: string file path to the file being parsed for data.
+        :param batch: number of steps parsed between yields.
+        :return: generator yielding the number of bytes read so far, give or
+        take read-ahead, first right after the header.
+        :raises TraceFormatError: on a malformed line, with its line number.
+        """
+        self.close_steps()
+        with open(fp, 'r') as f:
+            #  Get number of processes and resources.
+            header = read_header(f, fp)
+            self.set_header(header)
+            yield f.buffer.tell()
+            #  Load each step.
+            steps = iter_steps(f, fp, line_num=header.lines, processes=header.processes,
+                               resources=header.resources)
+            if self.instrument is not None:
+                steps = self.instrument.timed_iter("parse", steps)
+            while True:
+                loaded = len(self.steps)
+                #  Steps before a malformed line stay loaded.
+                self.steps.extend(islice(steps, batch))
+                if len(self.steps) == loaded:
+                    break
+                yield f.buffer.tell()
+        self.events.loaded(self.processes, self.resources, len(self.steps))
+        self.state_string[0] = str(self.processes) + " processes and " + str(self.resources) + " resources. "
+        self.state_string[1] = str(len(self.steps)) + " total steps in simulation."
+
+    def load_binary(self, fp):
+        """
+        Load a binary trace written by helpers.binarytrace.convert. The file is
+        memory-mapped and steps are decoded only as they are replayed, so
+        loading takes the same time however long the trace is.
+        :param fp: string file path to the binary trace.
+        """
+        self.close_steps()
+        self.steps = BinaryTrace(fp)
+        self.processes = self.steps.processes
+        self.resources = self.steps.resources
+        self.units = [1] * self.resources
+        self.claims = {}
+        self.priorities = None
+        self.events.loaded(self.processes, self.resources, len(self.steps))
+        self.state_string[0] = str(self.processes) + " processes and " + str(self.resources) + " resources. "
+        self.state_string[1] = str(len(self.steps)) + " total steps in simulation."
+
+    def analyze(self):
+        """
+        Analyze the whole loaded trace at once with the vectorized engine,
+        without stepping. Results match replaying every step with the FIFO
+        grant policy. NumPy is only imported when this is called.
+        :return: helpers.vectorized.ReplayAnalysis.
+        """
+        if not isinstance(self.scheduler, FifoScheduler):
+            raise ValueError("Vectorized analysis needs the fifo grant policy.")
+        if self.avoidance or any(n != 1 for n in self.units):
+            raise ValueError("Vectorized analysis needs single-unit resources without avoidance.")
+        from program3.helpers.vectorized import analyze, trace_arrays
+        p, op, r = trace_arrays(self.steps)
+        return analyze(p, op, r, self.resources)
+
+    def close_steps(self):
+        """
+        Release a memory-mapped trace, if one is loaded.
+        """
+        if isinstance(self.steps, BinaryTrace):
+            self.steps.close()
+        self.steps = []
+
+    def stream_file(self, fp, chunk_size=1 << 20):
+        """
+        Run a trace file straight from disk. Steps are parsed lazily in buffered
+        chunks and fed into step_forward without being stored, so memory use
+        stays constant however long the trace is. Initializes the state.
+        :param fp: string file path to the trace.
+        :param chunk_size: approximate number of bytes read per batch.
+        :return: generator yielding the state number after each step.
+        :raises TraceFormatError: on a malformed line, with its line number.
+        """
+        with open(fp, 'r') as f:
+            self.close_steps()
+            header = read_header(f, fp)
+            self.set_header(header)
+            self.reset()
+            self.init_state()
+            self.events.loaded(self.processes, self.resources, None)
+            steps = iter_steps(f, fp, chunk_size, header.lines, header.processes, header.resources)
+            if self.instrument is not None:
+                steps = self.instrument.timed_iter("parse", steps)
+            for step in steps:
+                self.step_forward(step)
+                yield self.state_num
+
+    def set_header(self, header):
+        """
+        Take the counts, units, claims and priorities of a trace header.
+        :param header: helpers.trace.TraceHeader.
+        """
+        self.processes = header.processes
+        self.resources = header.resources
+        self.units = header.units
+        self.claims = header.claims
+        self.priorities = header.priorities
+        self.scheduler.set_priorities(self.priorities)
 
     def init_state(self):
         """
         Initialize state of system.
         """
+        #  Resources have one unit each unless the trace header says otherwise.
+        if len(self.units) != self.resources:
+            self.units = [1] * self.resources
         #  Number of available resources of each type.
-        self.available = [1] * self.resources
+        self.available = list(self.units)
+        self.banker = None
+        if self.avoidance:
+            from program3.helpers.banker import Banker
+            self.banker = Banker(self.units, self.claims, self.processes)
+        self.deferred = set()
         #  Processes owning a resource currently.
         self.connected_v = [None] * self.resources
         #  Edges representing process holding resource.
-        self.hold_edges = [[0 for i in range(self.processes)] for j in range(self.resources)]
+        self.hold_edges = SparseEdges(self.resources, self.processes)
         #  Edges representing process requesting resource.
-        self.request_edges = [[0 for i in range(self.processes)] for j in range(self.resources)]
+        self.request_edges = SparseEdges(self.resources, self.processes)
+        #  Empty wait queues.
+        self.scheduler.reset()
+        #  Start over with only the initial state saved.
+        self.checkpoints = {}
+        self.checkpoints[self.state_num] = self.snapshot()
+        #  Preallocate visit marks for the deadlock searches.
+        self.visit_mark = array('L', [0]) * self.processes
+        self.visit_parent = array('l', [-1]) * self.processes
+        self.visit_epoch = 0
 
     def reset(self):
         """
@@ -112,39 +365,368 @@ class Core(object):
         """
         #  Marks if resource is available or not.
         self.available = []
-        #  Adjacency Matrices for hold and request edges.
+        #  Sparse hold and request edges, indexable like adjacency matrices.
         self.hold_edges = []
         self.request_edges = []
         #  Tracks where we are in the state of the system.
         self.state_num = 0
         #  Wait-for graph that we perform DFS for detecting deadlock cycles.
-        self.graph = Graph()
+        self.graph = IntGraph()
+        self.wait_edges = 0
         #  Connected vertices holding resource.
         self.connected_v = []
         #  State stringified.
         self.state_string = [" "] * 2
+        #  Processes around the last detected cycle.
+        self.deadlock_cycle = None
+        self.deadlock_components = []
+        self.deadlock_blocked = []
+        #  Incremental deadlock detector state.
+        self.reset_incremental_detection()
+
+    def reset_incremental_detection(self):
+        """
+        Reset the state the incremental deadlock detector keeps between steps.
+        """
+        #  True if the wait-for graph is known to contain a cycle.
+        self.cycle_known = False
+        #  Edges (src, dest) of one cycle witnessing the deadlock.
+        self.cycle_edges = set()
+        #  A witness edge was removed, so the whole graph has to be rechecked.
+        self.cycle_recheck = False
+        #  Last result handed out and whether the graph changed since.
+        self.deadlock_result = (False, None)
+        self.deadlock_result_stale = False
+
+    def add_wait_edge(self, src, dest, count=1):
+        """
+        Add wait-for edges from process src to process dest. Parallel waits
+        between the same pair are counted in the edge weight.
+        :param src: process that waits.
+        :param dest: process holding the resource.
+        :param count: number of waits to add.
+        """
+        #  Grow the visit marks for process numbers beyond the header count.
+        if max(src, dest) >= len(self.visit_mark):
+            extra = max(src, dest) + 1 - len(self.visit_mark)
+            self.visit_mark.extend(array('L', [0]) * extra)
+            self.visit_parent.extend(array('l', [-1]) * extra)
+        if not self.graph.add(src, dest, count):
+            self.wait_edges += 1
+            self.events.wait_edge(self.state_num + 1, src, dest, True)
+            self.wait_edge_added(src, dest)
+
+    def remove_wait_edge(self, src, dest, count=1):
+        """
+        Remove wait-for edges from process src to process dest. The edge only
+        leaves the graph once its weight drops to zero.
+        :param src: process that waited.
+        :param dest: process that held the resource.
+        :param count: number of waits to remove.
+        """
+        weight = self.graph.remove(src, dest, count)
+        if weight and weight <= count:
+            self.wait_edges -= 1
+            self.events.wait_edge(self.state_num + 1, src, dest, False)
+            self.wait_edge_removed(src, dest)
+
+    def wait_edge_added(self, src, dest):
+        """
+        Update the incremental detector for a new edge src -> dest. A new cycle
+        can only go through this edge, so only the part of the graph reachable
+        from dest is searched for a path back to src.
+        :param src: source process of the new edge.
+        :param dest: destination process of the new edge.
+        """
+        self.deadlock_result_stale = True
+        if self.cycle_known or self.cycle_recheck:
+            return
+        if self.detection != "graph":
+            #  Not searched while another engine is in use. set_detection marks
+            #  the result stale, and the recheck finds the verdict again.
+            self.cycle_recheck = True
+            return
+        path = self.find_wait_path(dest, src)
+        if path is not None:
+            self.cycle_known = True
+            self.cycle_edges = set(zip(path, path[1:] + [dest]))
+
+    def wait_edge_removed(self, src, dest):
+        """
+        Update the incremental detector for a removed edge src -> dest. Removing
+        an edge cannot create a cycle, so only losing an edge of the witness
+        cycle makes the verdict uncertain.
+        :param src: source process of the removed edge.
+        :param dest: destination process of the removed edge.
+        """
+        self.deadlock_result_stale = True
+        if self.cycle_known and (src, dest) in self.cycle_edges:
+            self.cycle_known = False
+            self.cycle_edges = set()
+            self.cycle_recheck = True
+
+    def prepare_visit(self):
+        """
+        Start a new search over the wait-for graph. Visit marks live in a
+        preallocated array indexed by process number and are tagged with an
+        epoch, so nothing has to be cleared or hashed between searches.
+        :return: (grey, black) marks for vertices on the current path and
+        vertices that are finished in this search.
+        """
+        if self.visit_epoch >= 0xfffffff0:
+            self.visit_mark = array('L', [0]) * len(self.visit_mark)
+            self.visit_epoch = 0
+        self.visit_epoch += 2
+        return self.visit_epoch - 1, self.visit_epoch
+
+    def find_wait_path(self, start, target):
+        """
+        Search the wait-for graph for a path from start to target, visiting only
+        vertices reachable from start.
+        :param start: process key the search starts from.
+        :param target: process key being searched for.
+        :return: list of process keys from start to target, or None.
+        """
+        if start == target:
+            return [start]
+        seen = self.prepare_visit()[1]
+        mark = self.visit_mark
+        parent = self.visit_parent
+        out = self.graph.out
+        mark[start] = seen
+        stack = [start]
+        while stack:
+            v = stack.pop()
+            for key in out[v]:
+                if mark[key] == seen:
+                    continue
+                mark[key] = seen
+                parent[key] = v
+                if key == target:
+                    path = [key]
+                    while path[-1] != start:
+                        path.append(parent[path[-1]])
+                    path.reverse()
+                    return path
+                stack.append(key)
+        return None
+
+    def find_cycle(self):
+        """
+        Explicit-stack DFS for a cycle in the wait-for graph. Visits vertices in
+        the same order as deadlock_detection_recur, but works for wait chains of
+        any depth.
+        :return: (path, cycle) where path is the DFS path from its root to the
+        vertex closing the cycle and cycle lists the processes around the cycle
+        in wait-for order, or (None, None) if there is no cycle.
+        """
+        grey, black = self.prepare_visit()
+        mark = self.visit_mark
+        out = self.graph.out
+        for root in self.graph:
+            if mark[root] == black:
+                continue
+            path = [root]
+            mark[root] = grey
+            stack = [iter(out[root])]
+            while stack:
+                key = next(stack[-1], None)
+                if key is None:
+                    stack.pop()
+                    mark[path.pop()] = black
+                    continue
+                if mark[key] == grey:
+                    return path, path[path.index(key):]
+                if mark[key] != black:
+                    mark[key] = grey
+                    path.append(key)
+                    stack.append(iter(out[key]))
+        return None, None
+
+    def detect(self):
+        """
+        Check the current state for deadlock with the selected engine.
+        :return: True if there is a deadlock, and the deadlocked processes.
+        """
+        if self.detection == "matrix":
+            return self.deadlock_detection_matrix()
+        if self.detection == "scc":
+            return self.deadlock_detection_scc()
+        return self.deadlock_detection_incremental()
+
+    def find_deadlocks(self):
+        """
+        Find every deadlock of the wait-for graph in one linear pass with an
+        explicit-stack version of Tarjan's strongly connected components
+        algorithm. A component is deadlocked if it contains a cycle. Tarjan
+        finishes components in reverse topological order, so when a component
+        is finished everything it waits for is already known to be doomed or
+        not, and processes that only wait on a deadlock are marked on the way.
+        :return: (components, blocked) where components is a list of sorted
+        lists of processes on cycles and blocked is a sorted list of processes
+        waiting on a deadlock without being on a cycle themselves.
+        """
+        index = {}
+        low = {}
+        doomed = {}
+        on_stack = set()
+        stack = []
+        components = []
+        blocked = []
+        counter = 0
+        out = self.graph.out
+        for root in self.graph:
+            if root in index:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            path = [(root, iter(out[root]))]
+            while path:
+                v, neighbors = path[-1]
+                key = next(neighbors, None)
+                if key is not None:
+                    if key not in index:
+                        index[key] = low[key] = counter
+                        counter += 1
+                        stack.append(key)
+                        on_stack.add(key)
+                        path.append((key, iter(out[key])))
+                    elif key in on_stack and index[key] < low[v]:
+                        low[v] = index[key]
+                    continue
+                path.pop()
+                key = v
+                if path and low[key] < low[path[-1][0]]:
+                    low[path[-1][0]] = low[key]
+                if low[key] != index[key]:
+                    continue
+                #  key is the root of a finished component.
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    members.append(member)
+                    if member == key:
+                        break
+                cyclic = len(members) > 1 or v in out[v]
+                waits_on_doomed = cyclic or any(doomed.get(d, False) for m in members for d in out[m])
+                for member in members:
+                    doomed[member] = waits_on_doomed
+                if cyclic:
+                    components.append(sorted(members))
+                elif waits_on_doomed:
+                    blocked.extend(members)
+        components.sort()
+        blocked.sort()
+        return components, blocked
+
+    def deadlock_detection_scc(self):
+        """
+        Detect every deadlock at once with find_deadlocks. The components and
+        blocked processes are kept for get_deadlock_components and
+        get_deadlock_blocked.
+        :return: True if there is a deadlock, and all processes on a deadlocked
+        cycle, sorted.
+        """
+        if self.instrument is not None:
+            start = time.perf_counter_ns()
+        self.deadlock_components, self.deadlock_blocked = self.find_deadlocks()
+        self.deadlock_cycle = None
+        if self.deadlock_components:
+            result = True, sorted(p for component in self.deadlock_components for p in component)
+        else:
+            result = False, None
+        self.events.deadlock(self.state_num, result[0], None, result[1])
+        if self.instrument is not None:
+            self.instrument.record("detect_scc", time.perf_counter_ns() - start)
+            if result[0]:
+                self.instrument.count("deadlocked_checks")
+        return result
+
+    def deadlock_detection_matrix(self):
+        """
+        Multi-instance deadlock detection over the Available, Allocation and
+        Request matrices, vectorized with NumPy, which is only imported when
+        this is called. Unlike a wait-for cycle, the result is exact when
+        resources have several units. The set includes processes blocked
+        behind the deadlock, as they can never finish either.
+        :return: True if there is a deadlock, and the sorted deadlocked processes.
+        """
+        if self.instrument is not None:
+            start = time.perf_counter_ns()
+        from program3.helpers.detection import detect
+        deadlocked = detect(self.units, self.hold_edges, self.request_edges)
+        #  No single cycle is reported.
+        self.deadlock_cycle = None
+        if deadlocked:
+            result = True, deadlocked
+        else:
+            result = False, None
+        self.events.deadlock(self.state_num, result[0], None, result[1])
+        if self.instrument is not None:
+            self.instrument.record("detect_matrix", time.perf_counter_ns() - start)
+            if deadlocked:
+                self.instrument.count("deadlocked_checks")
+        return result
+
+    def deadlock_detection_incremental(self):
+        """
+        Incremental version of deadlock_detection. The verdict is maintained as
+        wait-for edges are added and removed, so steps that leave the graph
+        untouched cost nothing and a new edge only costs a search of the
+        vertices reachable from it. The deadlocked set is recomputed with
+        deadlock_detection only when deadlocked and the graph has changed.
+        :return: True if there is a deadlock, and the deadlocked processes.
+        """
+        if self.instrument is not None:
+            start = time.perf_counter_ns()
+        if self.cycle_recheck:
+            self.cycle_recheck = False
+            cycle = self.find_cycle()[1]
+            if cycle is not None:
+                self.cycle_known = True
+                self.cycle_edges = set(zip(cycle, cycle[1:] + cycle[:1]))
+        if not self.cycle_known:
+            self.deadlock_cycle = None
+            self.deadlock_result = (False, None)
+            self.deadlock_result_stale = False
+            self.events.deadlock(self.state_num, False, None)
+        elif self.deadlock_result_stale or not self.deadlock_result[0]:
+            self.deadlock_result = self.deadlock_detection()
+            self.deadlock_result_stale = False
+        else:
+            self.events.deadlock(self.state_num, True, self.deadlock_cycle)
+        if self.instrument is not None:
+            self.instrument.record("detect_incremental", time.perf_counter_ns() - start)
+        return self.deadlock_result
 
     def deadlock_detection(self):
         """
         Detects if there is a cycle in the wait-for graph.
-        :return: True if there is a deadlock.
-        """
-        recstack = set()
-        visited = set()
-        for node in self.graph:
-            if node not in visited:
-                if self.deadlock_detection_recur(node, visited, recstack):
-                    deadlocked_processes = []
-                    for item in recstack:
-                        deadlocked_processes.append(item.get_key())
-                    print("Deadlock!")
-                    return True, deadlocked_processes
-        print("No deadlock!")
-        return False, None
+        :return: True if there is a deadlock, and the processes on the DFS path
+        that closed the cycle, from its root.
+        """
+        if self.instrument is not None:
+            start = time.perf_counter_ns()
+        path, cycle = self.find_cycle()
+        self.deadlock_cycle = cycle
+        if cycle is not None:
+            result = True, path
+        else:
+            result = False, None
+        self.events.deadlock(self.state_num, cycle is not None, cycle)
+        if self.instrument is not None:
+            self.instrument.record("detect_full", time.perf_counter_ns() - start)
+            if cycle is not None:
+                self.instrument.count("deadlocked_checks")
+        return result
 
     def deadlock_detection_recur(self, v, visited, recstack):
         """
-        DFS algorithm for detecting cycles in the wait-for graph.
+        Recursive DFS algorithm for detecting cycles in the wait-for graph.
+        Limited by the recursion limit; deadlock_detection uses find_cycle.
         :param v: current vertex.
         :param visited: set of already visited vertices.
         :param recstack: recursive stack of vertices being visited.
@@ -161,66 +743,299 @@ class Core(object):
         visited.add(v)
         return False
 
-    def step_forward(self):
+    def step_forward(self, step=None):
         """
         Step forward the state.
+        :param step: (process, request/release, resource) tuple to apply instead
+        of the next entry of the loaded steps, used when streaming a trace.
         :return:
         """
-        if self.state_num < len(self.steps):
-            print("\nStepping forward to state %d." % int(self.state_num + 1))
+        if step is None and self.state_num < len(self.steps):
+            step = self.steps[self.state_num]
+        if step is not None:
+            if self.instrument is not None:
+                start = time.perf_counter_ns()
             self.state_string[0] = "Stepping forward to state " + str(self.state_num + 1) + "."
             #  Get process and resource involved.
-            process = self.steps[self.state_num][0]
-            resource = self.steps[self.state_num][2]
+            process, re, resource = step
+            #  Resources with several units, and all of them under avoidance.
+            if self.banker is not None or self.units[resource] != 1:
+                if re:
+                    kind, other = self.request_unit(process, resource)
+                else:
+                    kind, other = self.release_unit(process, resource)
             #  Is this a request?
-            if self.steps[self.state_num][1]:
-                print("Process %d requests resource %d." % (process, resource))
+            elif re:
                 self.state_string[1] = "Process " + str(process) + " requests resource " + str(resource) + "."
                 #  Is the resource not being used by a process?
                 if self.available[resource] > 0:
-                    #  Mark in hold matrix the relationship between resource and process.
-                    self.hold_edges[resource][process] += 1
+                    #  Mark the hold edge between resource and process.
+                    self.hold_edges.add(resource, process)
                     #  Make resource unavailabe.
                     self.available[resource] -= 1
                     #  Store the process ID that holds the resource.
                     self.connected_v[resource] = process
+                    kind = GRANTED
+                    other = None
                 else:
-                    #  Mark in request matrix the relationship between resource and process.
-                    self.request_edges[resource][process] += 1
+                    #  Mark the request edge between resource and process.
+                    self.request_edges.add(resource, process)
+                    #  Queue the request until the resource is released.
+                    self.scheduler.enqueue(resource, process, self.state_num)
                     #  Add our process to the graph and make a directed edge.
-                    if process not in self.graph:
-                        self.graph.add_vertex(process)
-                    if self.connected_v[resource] not in self.graph:
-                        self.graph.add_vertex(self.connected_v[resource])
-                    if not self.graph.does_edge_exist(process, self.connected_v[resource]):
-                        self.graph.add_edge(process, self.connected_v[resource])
-                    print("p{:d} --> p{:d}".format(process, self.connected_v[resource]))
+                    self.add_wait_edge(process, self.connected_v[resource])
+                    kind = BLOCKED
+                    other = self.connected_v[resource]
             else:
-                print("Process %d releases resource %d." % (process, resource))
                 self.state_string[0] = "Process " + str(process) + " releases resource " + str(resource) + "."
-                #  Remove connection in hold matrix.
-                self.hold_edges[resource][process] -= 1
-                #  Does another process want this resource?
-                if np.count_nonzero(self.request_edges[resource]) > 0:
-                    #  Get next process that wants the resource.
-                    new_process = self.request_edges[resource].index(1)
-                    #  Mark in hold matrix the relationship between resource and process.
-                    self.hold_edges[resource][new_process] += 1
+                #  Remove the hold edge.
+                self.hold_edges.remove(resource, process)
+                #  Get next process that wants the resource, if any.
+                new_process = self.scheduler.grant(resource, self.state_num)
+                if new_process is not None:
+                    old_process = self.connected_v[resource]
+                    #  Mark the hold edge between resource and new process.
+                    self.hold_edges.add(resource, new_process)
                     #  Store the process ID that holds the resource.
                     self.connected_v[resource] = new_process
-                    #  Remove connection in request matrix.
-                    self.request_edges[resource][new_process] -= 1
-                    #  Delete edge if it exists.
-                    if self.graph.does_edge_exist(new_process, self.connected_v[resource]):
-                        self.graph.delete_edge(new_process, self.connected_v[resource])
-                    print("Process %d now has resource %d." % (new_process, resource))
+                    #  Remove the request edge.
+                    self.request_edges.remove(resource, new_process)
+                    #  The new holder no longer waits for the old one.
+                    self.remove_wait_edge(new_process, old_process)
+                    self.events.grant(self.state_num + 1, new_process, resource)
+                    #  Remaining waiters now wait for the new holder.
+                    for waiter, count in list(self.request_edges.processes_of(resource).items()):
+                        self.remove_wait_edge(waiter, old_process, count)
+                        self.add_wait_edge(waiter, new_process, count)
                     self.state_string[1] = "Process " + str(new_process) + " now has resource " + str(resource) + "."
+                    kind = HANDOFF
+                    other = new_process
                 else:
-                    print("Resource %d is now available." % resource)
                     self.state_string[1] = "Resource " + str(resource) + " is now available."
                     #  Mark resource as unowned by a process.
                     self.available[resource] += 1
                     #  Empty process that owned the resource previously.
                     self.connected_v[resource] = None
+                    kind = FREED
+                    other = None
             #  Advance the state.
             self.state_num += 1
+            self.events.step(self.state_num, process, re, resource, kind, other)
+            if self.instrument is not None:
+                self.instrument.record_step(kind, time.perf_counter_ns() - start, self)
+            #  Save a checkpoint to seek back to.
+            if self.checkpoint_interval and self.state_num % self.checkpoint_interval == 0 \
+                    and self.state_num not in self.checkpoints and self.state_num <= len(self.steps):
+                self.checkpoints[self.state_num] = self.snapshot()
+
+    def holders(self, resource):
+        """
+        :param resource: resource number.
+        :return: list of processes holding units of the resource.
+        """
+        return [p for p, n in self.hold_edges.processes_of(resource).items() if n > 0]
+
+    def grant_unit(self, resource, process):
+        """
+        Give one unit of a resource to a process. Requests waiting for the
+        resource wait for every other holder, so they gain an edge to a new
+        holder. A process never waits for its own units.
+        :param resource: resource number.
+        :param process: process number.
+        """
+        new_holder = self.hold_edges.count(resource, process) == 0
+        self.hold_edges.add(resource, process)
+        self.available[resource] -= 1
+        self.connected_v[resource] = process
+        if self.banker is not None:
+            self.banker.allocate(process, resource)
+        if new_holder:
+            for waiter, count in list(self.request_edges.processes_of(resource).items()):
+                if waiter != process:
+                    self.add_wait_edge(waiter, process, count)
+
+    def grant_waiting(self, resource):
+        """
+        Hand free units of a resource to its waiters in scheduler order, stopping
+        at the first waiter whose grant would be unsafe under avoidance.
+        :param resource: resource number.
+        :return: list of processes granted a unit.
+        """
+        granted = []
+        while self.available[resource] > 0:
+            waiter = self.scheduler.peek(resource)
+            if waiter is None:
+                break
+            if self.banker is not None and not self.banker.grant_is_safe(waiter, resource):
+                break
+            self.scheduler.grant(resource, self.state_num)
+            self.request_edges.remove(resource, waiter)
+            for holder in self.holders(resource):
+                if holder != waiter:
+                    self.remove_wait_edge(waiter, holder)
+            self.grant_unit(resource, waiter)
+            self.events.grant(self.state_num + 1, waiter, resource)
+            granted.append(waiter)
+        if self.available[resource] > 0 and self.scheduler.waiters(resource):
+            self.deferred.add(resource)
+        else:
+            self.deferred.discard(resource)
+        return granted
+
+    def request_unit(self, process, resource):
+        """
+        Request one unit of a multi-unit resource, or of any resource under
+        avoidance. A waiting request waits for every other holder of the resource.
+        :param process: process number.
+        :param resource: resource number.
+        :return: (step outcome, process waited for or None).
+        """
+        self.state_string[1] = "Process " + str(process) + " requests resource " + str(resource) + "."
+        if self.banker is not None and \
+                self.banker.exceeds_claim(process, resource, self.request_edges.count(resource, process)):
+            raise ValueError("Process %d requests more of resource %d than it claimed." % (process, resource))
+        if self.available[resource] > 0 and not self.scheduler.waiters(resource) and \
+                (self.banker is None or self.banker.grant_is_safe(process, resource)):
+            self.grant_unit(resource, process)
+            return GRANTED, None
+        self.request_edges.add(resource, process)
+        self.scheduler.enqueue(resource, process, self.state_num)
+        for holder in self.holders(resource):
+            if holder != process:
+                self.add_wait_edge(process, holder)
+        if self.available[resource] > 0:
+            #  Units are free, but granting one now could lead to deadlock.
+            self.deferred.add(resource)
+            return DEFERRED, None
+        return BLOCKED, self.connected_v[resource]
+
+    def release_unit(self, process, resource):
+        """
+        Release one unit of a multi-unit resource, or of any resource under
+        avoidance, and grant free units to waiters that can safely have them.
+        :param process: process number.
+        :param resource: resource number.
+        :return: (step outcome, first process granted a unit or None).
+        """
+        self.state_string[0] = "Process " + str(process) + " releases resource " + str(resource) + "."
+        if self.hold_edges.count(resource, process) <= 0:
+            self.state_string[1] = "Process " + str(process) + " holds no unit of resource " + str(resource) + "."
+            return FREED, None
+        self.hold_edges.remove(resource, process)
+        self.available[resource] += 1
+        if self.banker is not None:
+            self.banker.release(process, resource)
+        if self.hold_edges.count(resource, process) == 0:
+            #  Waiters stop waiting for a process that no longer holds a unit.
+            for waiter, count in list(self.request_edges.processes_of(resource).items()):
+                if waiter != process:
+                    self.remove_wait_edge(waiter, process, count)
+            if self.connected_v[resource] == process:
+                holders = self.holders(resource)
+                self.connected_v[resource] = holders[0] if holders else None
+        granted = self.grant_waiting(resource)
+        if self.banker is not None:
+            #  The returned unit may make deferred requests for other resources safe.
+            for other in sorted(self.deferred - {resource}):
+                self.grant_waiting(other)
+        if granted:
+            self.state_string[1] = "Process " + str(granted[0]) + " now has resource " + str(resource) + "."
+            return HANDOFF, granted[0]
+        self.state_string[1] = "Resource " + str(resource) + " is now available."
+        return FREED, None
+
+    def withdraw(self, process, resource):
+        """
+        Give up one waiting request, as when a wait times out. This is not a
+        step of the trace, so the state number stays the same. Waiters behind
+        the request may be granted units that were kept back for it.
+        :param process: process number.
+        :param resource: resource number.
+        :return: True if the process was waiting for the resource.
+        """
+        if self.request_edges.count(resource, process) <= 0 or not self.scheduler.withdraw(resource, process):
+            return False
+        self.request_edges.remove(resource, process)
+        for holder in self.holders(resource):
+            if holder != process:
+                self.remove_wait_edge(process, holder)
+        self.state_string[1] = "Process " + str(process) + " stops waiting for resource " + str(resource) + "."
+        if self.available[resource] > 0:
+            self.grant_waiting(resource)
+        return True
+
+    def step_backward(self):
+        """
+        Step back to the previous state by restoring the nearest checkpoint at
+        or before it and replaying the steps after it.
+        """
+        if self.state_num > 0:
+            self.seek(self.state_num - 1)
+
+    def seek(self, state_num):
+        """
+        Move to any state of the loaded trace. Restores the nearest checkpoint
+        at or before state_num and replays only the remaining steps, so the
+        cost is at most checkpoint_interval steps.
+        :param state_num: state number to move to.
+        """
+        if not 0 <= state_num <= len(self.steps):
+            raise ValueError("State %d is outside the trace." % state_num)
+        if state_num < self.state_num or state_num - self.state_num > self.checkpoint_interval:
+            nearest = max(n for n in self.checkpoints if n <= state_num)
+            if state_num < self.state_num or nearest > self.state_num:
+                self.restore(self.checkpoints[nearest])
+        while self.state_num < state_num:
+            self.step_forward()
+
+    def snapshot(self):
+        """
+        Capture the simulation state.
+        :return: snapshot for restore.
+        """
+        return {"state_num": self.state_num,
+                "available": list(self.available),
+                "deferred": set(self.deferred),
+                "connected_v": list(self.connected_v),
+                "hold_edges": self.hold_edges.copy(),
+                "request_edges": self.request_edges.copy(),
+                "scheduler": self.scheduler.copy(),
+                "graph": self.graph.copy(),
+                "wait_edges": self.wait_edges,
+                "state_string": list(self.state_string),
+                "deadlock_cycle": self.deadlock_cycle,
+                "cycle_known": self.cycle_known,
+                "cycle_edges": set(self.cycle_edges),
+                "cycle_recheck": self.cycle_recheck,
+                "deadlock_result": self.deadlock_result,
+                "deadlock_result_stale": self.deadlock_result_stale}
+
+    def restore(self, snap):
+        """
+        Return to a state captured by snapshot. The snapshot is left untouched
+        so it can be restored again.
+        :param snap: snapshot from snapshot().
+        """
+        self.state_num = snap["state_num"]
+        self.available = list(snap["available"])
+        self.deferred = set(snap["deferred"])
+        self.connected_v = list(snap["connected_v"])
+        self.hold_edges = snap["hold_edges"].copy()
+        self.request_edges = snap["request_edges"].copy()
+        if self.banker is not None:
+            #  The Banker's matrices follow from the claims and the hold edges.
+            from program3.helpers.banker import Banker
+            self.banker = Banker(self.units, self.claims, self.processes)
+            for resource, row in self.hold_edges.by_resource.items():
+                for process, count in row.items():
+                    self.banker.allocate(process, resource, count)
+        self.scheduler = snap["scheduler"].copy()
+        self.graph = snap["graph"].copy()
+        self.wait_edges = snap["wait_edges"]
+        self.state_string = list(snap["state_string"])
+        self.deadlock_cycle = snap["deadlock_cycle"]
+        self.cycle_known = snap["cycle_known"]
+        self.cycle_edges = set(snap["cycle_edges"])
+        self.cycle_recheck = snap["cycle_recheck"]
+        self.deadlock_result = snap["deadlock_result"]
+        self.deadlock_result_stale = snap["deadlock_result_stale"]
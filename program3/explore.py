@@ -0,0 +1,234 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from program3.helpers.interleave import Interleaving, format_deadlock
+from program3.helpers.scheduler import SCHEDULERS
+from program3.helpers.script import read_script
+from program3.helpers.statespace import DEADLOCK, DIGEST_SIZE, StateSpace
+from program3.helpers.trace import write_trace
+
+#  Searches of a worker process, by their settings, so a script is only read
+#  once per worker. Workers only live for one explore call, so the visited
+#  tables these use never outlast it.
+SEARCHES = {}
+
+#  Visited table buffer and stop flag shared by the workers, set by init_worker.
+SHARED = {"buffer": None, "stop": None}
+
+#  Statistics added up over workers.
+COUNTS = ("states", "transitions", "revisits", "pruned", "terminal", "visited")
+
+
+def init_worker(buffer, stop):
+    """
+    Set up a worker process.
+    :param buffer: multiprocessing.RawArray of the visited table.
+    :param stop: multiprocessing.RawValue set once the search can end.
+    """
+    SHARED["buffer"] = buffer
+    SHARED["stop"] = stop
+
+
+def get_search(fp, policy, avoidance, reduction, max_states):
+    key = (fp, policy, avoidance, reduction, max_states)
+    if key not in SEARCHES:
+        header, scripts = read_script(fp)
+        SEARCHES[key] = StateSpace(header, scripts, policy, avoidance, reduction, max_states,
+                                   SHARED["buffer"], SHARED["stop"])
+    return SEARCHES[key]
+
+
+def search_part(fp, prefix, policy="fifo", avoidance=False, reduction=True, max_states=1 << 22, find_all=False):
+    """
+    Explore every state reachable after a prefix, in a worker.
+    :param fp: string file path to the script.
+    :param prefix: list of processes leading to the part of the frontier.
+    :return: (list of (outcome, key, path), dict of the worker's statistics so
+    far, with its process id).
+    """
+    search = get_search(fp, policy, avoidance, reduction, max_states)
+    findings = search.search(prefix, find_all)
+    stats = search.get_stats()
+    stats["pid"] = os.getpid()
+    return [(f.outcome, f.key, f.path) for f in findings], stats
+
+
+def explore(fp, workers=None, policy="fifo", avoidance=False, reduction=True, max_states=1 << 22,
+            find_all=False, frontier=None):
+    """
+    Explore every interleaving of a script's processes for deadlocks.
+    With more than one worker the states are first explored breadth first
+    until there are enough of them to hand out, then the workers search
+    below the ones they are given, sharing one visited table in shared
+    memory. Which deadlock is reported first then depends on which worker
+    gets to one first; whether there is one does not.
+    :param fp: string file path to the script.
+    :param workers: number of worker processes, defaults to the CPU count.
+    :param policy: name of the grant scheduling policy.
+    :param avoidance: defer requests the Banker's algorithm finds unsafe.
+    :param reduction: use partial-order reduction.
+    :param max_states: slots of the visited table, DIGEST_SIZE bytes each.
+    :param find_all: keep going after a deadlock, to list every one.
+    :param frontier: states to hand out, default 8 per worker.
+    :return: report dict.
+    """
+    header, scripts = read_script(fp)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    stats = dict.fromkeys(COUNTS, 0)
+    saturated = False
+    found = []
+    if workers == 1:
+        search = StateSpace(header, scripts, policy, avoidance, reduction, max_states)
+        found.extend((f.outcome, f.key, f.path) for f in search.search([], find_all))
+        part = search.get_stats()
+        for name in COUNTS:
+            stats[name] = part[name]
+        saturated = part["saturated"]
+    else:
+        buffer = multiprocessing.RawArray('B', max_states * DIGEST_SIZE)
+        stop = multiprocessing.RawValue('b', 0)
+        search = StateSpace(header, scripts, policy, avoidance, reduction, max_states, buffer)
+        paths, findings = search.frontier(frontier or 8 * workers, find_all)
+        found.extend((f.outcome, f.key, f.path) for f in findings)
+        for name, value in search.get_stats().items():
+            if name in COUNTS:
+                stats[name] += value
+        latest = {}
+        if paths and (find_all or not found):
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(buffer, stop))
+            try:
+                running = {pool.submit(search_part, fp, path, policy, avoidance, reduction, max_states, find_all)
+                           for path in paths}
+                while running:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        outcomes, part = future.result()
+                        found.extend(outcomes)
+                        #  Statistics are running totals of the worker that sent them.
+                        latest[part.pop("pid")] = part
+                    if found and not find_all:
+                        stop.value = 1
+                        break
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+        for part in latest.values():
+            for name in COUNTS:
+                stats[name] += part[name]
+            saturated = saturated or part["saturated"]
+        saturated = saturated or search.visited.saturated
+    seconds = time.perf_counter() - start
+    found.sort(key=lambda f: (f[0] != DEADLOCK, len(f[2])))
+    cycles = {}
+    for outcome, key, path in found:
+        if outcome == DEADLOCK and key not in cycles:
+            cycles[key] = path
+    report = {"file": fp,
+              "processes": header.processes,
+              "resources": header.resources,
+              "deadlock_free": not found,
+              "complete": find_all or not found,
+              "saturated": saturated,
+              "reduction": reduction and not avoidance,
+              "cycles": [{"cycle": format_deadlock(key), "key": key, "steps": len(path), "path": path}
+                         for key, path in cycles.items()],
+              "stuck": [path for outcome, key, path in found if outcome != DEADLOCK][:1],
+              "seconds": seconds,
+              "workers": workers}
+    report.update(stats)
+    report["states_per_sec"] = stats["states"] / seconds if seconds > 0 else 0.0
+    return report
+
+
+def write_counterexample(fp, path, target, policy="fifo", avoidance=False):
+    """
+    Write the steps of a schedule as a trace, which replays to the same
+    state with the same policy and avoidance setting.
+    :param fp: string file path to the script.
+    :param path: list of processes, in the order they took their actions.
+    :param target: string file path of the trace to write.
+    :return: number of steps written.
+    """
+    header, scripts = read_script(fp)
+    interleaving = Interleaving(header, scripts, policy, avoidance)
+    interleaving.set_record(True)
+    for process in path:
+        interleaving.step(process)
+    return write_trace(target, header, interleaving.get_trace())
+
+
+def print_report(report):
+    """
+    Print an exploration for people.
+    :param report: dict returned by explore.
+    """
+    if report["deadlock_free"]:
+        print("%s: no interleaving deadlocks." % report["file"])
+    elif not report["cycles"]:
+        print("%s: no deadlock cycle found." % report["file"])
+    else:
+        print("%s: %d deadlock%s found%s." % (report["file"], len(report["cycles"]),
+                                              "" if len(report["cycles"]) == 1 else "s",
+                                              "" if report["complete"] else ", search stopped at the first"))
+    for cycle in report["cycles"]:
+        print("  %s  after %d actions" % (cycle["cycle"], cycle["steps"]))
+    if report["stuck"]:
+        print("  Processes can wait forever without a deadlock cycle, after %d actions." % len(report["stuck"][0]))
+    print("  %d states, %d transitions, %d revisits, %d pruned by reduction, %d end states." %
+          (report["states"], report["transitions"], report["revisits"], report["pruned"], report["terminal"]))
+    if report["saturated"]:
+        print("  The visited set filled up, so some states were explored more than once.")
+    print("  %.3f s, %.0f states/sec on %d worker%s." %
+          (report["seconds"], report["states_per_sec"], report["workers"], "" if report["workers"] == 1 else "s"))
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.explore SCRIPT
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status, 1 if an interleaving deadlocks.
+    """
+    parser = argparse.ArgumentParser(description="Check every interleaving of process scripts for deadlock.")
+    parser.add_argument("script", help="script file, as for program3.simulate")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default CPU count")
+    parser.add_argument("--frontier", type=int, help="states to hand out to workers, default 8 per worker")
+    parser.add_argument("--max-states", type=int, default=1 << 22,
+                        help="slots of the visited table, %d bytes each" % DIGEST_SIZE)
+    parser.add_argument("--no-reduction", action="store_true", help="try every order of independent actions")
+    parser.add_argument("--all", action="store_true", help="keep going after a deadlock, to list every one")
+    parser.add_argument("--policy", default="fifo", choices=sorted(SCHEDULERS),
+                        help="grant scheduling policy; priority and aging use the priorities header line")
+    parser.add_argument("--avoid", action="store_true",
+                        help="avoid deadlock with the Banker's algorithm, needs claim lines in the script")
+    parser.add_argument("--counterexample", metavar="FILE",
+                        help="write the shortest schedule found to reach a deadlock as a trace")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+    if args.max_states < 1:
+        parser.error("--max-states must be at least 1")
+
+    try:
+        report = explore(args.script, args.workers, args.policy, args.avoid, not args.no_reduction,
+                         args.max_states, args.all, args.frontier)
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+    path = report["cycles"][0]["path"] if report["cycles"] else (report["stuck"] or [None])[0]
+    if args.counterexample and path is not None:
+        count = write_counterexample(args.script, path, args.counterexample, args.policy, args.avoid)
+        if not args.json:
+            print("Wrote %d steps to %s." % (count, args.counterexample))
+    return 0 if report["deadlock_free"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
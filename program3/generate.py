@@ -0,0 +1,55 @@
+import argparse
+import sys
+import time
+
+from program3.helpers.workload import WORKLOADS, make_workload, write_workload
+
+#  Options that only some models take.
+MODEL_OPTIONS = {"skew": "zipf", "contention": "hotspot", "length": "chain", "close": "chain"}
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.generate TRACE.data --model MODEL
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Write a synthetic trace from a seeded workload model.")
+    parser.add_argument("target", help="text .data trace to write, - for standard output")
+    parser.add_argument("--model", default="uniform", choices=sorted(WORKLOADS),
+                        help="uniform requests, zipf resource popularity, hotspot (a hot 5%% of the "
+                             "resources), ordered (lock ordering, deadlock-free) or chain (long "
+                             "adversarial wait chains)")
+    parser.add_argument("--processes", type=int, default=100, help="number of processes")
+    parser.add_argument("--resources", type=int, default=100, help="number of resources")
+    parser.add_argument("--steps", type=int, default=100000, help="number of steps")
+    parser.add_argument("--seed", type=int, default=0, help="random seed; the same seed writes the same trace")
+    parser.add_argument("--release", type=float, default=0.5,
+                        help="chance that a process holding resources releases one")
+    parser.add_argument("--skew", type=float, help="zipf: exponent of the popularity curve")
+    parser.add_argument("--contention", type=float,
+                        help="hotspot: share of requests that go to the hot resources")
+    parser.add_argument("--length", type=int, help="chain: processes in each chain")
+    parser.add_argument("--close", type=float, help="chain: chance that a chain closes into a deadlock")
+    args = parser.parse_args(argv)
+
+    options = {"release": args.release}
+    for name, model in sorted(MODEL_OPTIONS.items()):
+        if getattr(args, name) is not None:
+            if model != args.model:
+                parser.error("--%s only applies to the %s model" % (name, model))
+            options[name] = getattr(args, name)
+    start = time.perf_counter()
+    try:
+        workload = make_workload(args.model, args.processes, args.resources, args.seed, **options)
+        count = write_workload(args.target, workload, args.steps)
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.target != "-":
+        print("Wrote %d steps to %s in %.3f s." % (count, args.target, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import time
+START_TIME = time.perf_counter()
+
+import argparse
+import json
+import os
+import sys
+
+from program3.core import DETECTIONS, Core
+from program3.helpers.binarytrace import is_binary_trace
+from program3.helpers.events import EventSink, JsonLinesSink, PrintSink
+from program3.helpers.scheduler import SCHEDULERS, make_scheduler
+
+#  Time spent importing this module and its dependencies.
+STARTUP_TIME = time.perf_counter() - START_TIME
+
+
+def replay(logic, fp):
+    """
+    Replay a text or binary trace file through the core logic.
+    :param logic: Core to run.
+    :param fp: string file path to the trace.
+    :return: generator yielding the state number after each step.
+    """
+    if not is_binary_trace(fp):
+        #  Stream the trace so memory does not grow with its length.
+        for state_num in logic.stream_file(fp):
+            yield state_num
+        return
+    #  Binary traces are memory-mapped, nothing is parsed up front.
+    logic.load_binary(fp)
+    try:
+        logic.init_state()
+        total = len(logic.get_steps())
+        while logic.get_state_num() < total:
+            logic.step_forward()
+            yield logic.get_state_num()
+    finally:
+        logic.close_steps()
+
+
+def run_trace(fp, policy="fifo", instrument=None, events=None, avoidance=False, detection="graph"):
+    """
+    Run the core logic over a whole trace file without any GUI.
+    :param fp: string file path to the trace.
+    :param policy: name of the grant scheduling policy.
+    :param instrument: optional helpers.instrument.Instrumentation to fill.
+    :param events: optional helpers.events.EventSink, quiet by default.
+    :param avoidance: defer requests the Banker's algorithm finds unsafe.
+    :param detection: deadlock detection engine, "graph" or "matrix".
+    :return: dict summarizing the run.
+    """
+    if not os.path.isfile(fp):
+        raise IOError("Cannot find the file at " + fp)
+    logic = Core()
+    logic.set_scheduler(make_scheduler(policy))
+    logic.set_avoidance(avoidance)
+    logic.set_detection(detection)
+    logic.set_instrumentation(instrument)
+    logic.set_event_sink(events if events is not None else EventSink())
+    first_deadlock = None
+    deadlocked = None
+    cycle = None
+    components = None
+    blocked = None
+    peak_edges = 0
+    start = time.perf_counter()
+    for state_num in replay(logic, fp):
+        deadlock, processes = logic.detect()
+        if logic.get_wait_edge_count() > peak_edges:
+            peak_edges = logic.get_wait_edge_count()
+        if deadlock and first_deadlock is None:
+            first_deadlock = state_num
+            deadlocked = sorted(processes)
+            cycle = logic.get_deadlock_cycle()
+            components, blocked = logic.find_deadlocks()
+    logic.get_event_sink().flush()
+    elapsed = time.perf_counter() - start
+    total = logic.get_state_num()
+    connected = logic.get_connected_v()
+    return {"file": fp,
+            "processes": logic.get_processes(),
+            "resources": logic.get_resources(),
+            "steps": total,
+            "final_state": logic.get_state_num(),
+            "held": {r: p for r, p in enumerate(connected) if p is not None},
+            "waiting": logic.get_scheduler().waiting,
+            "deadlocked": first_deadlock is not None,
+            "first_deadlock_step": first_deadlock,
+            "deadlocked_processes": deadlocked,
+            "deadlock_cycle": cycle,
+            "deadlock_components": components,
+            "blocked_processes": blocked,
+            "peak_wait_edges": peak_edges,
+            "seconds": elapsed,
+            "steps_per_sec": total / elapsed if elapsed > 0 else 0.0}
+
+
+def print_summary(summary):
+    """
+    Print a run summary for people.
+    :param summary: dict returned by run_trace.
+    """
+    print("%s: %d processes, %d resources, %d steps." %
+          (summary["file"], summary["processes"], summary["resources"], summary["steps"]))
+    print("  Final state %d, %d resources held, %d requests waiting." %
+          (summary["final_state"], len(summary["held"]), summary["waiting"]))
+    if summary["deadlocked"]:
+        print("  Deadlock first at step %d, processes %s." %
+              (summary["first_deadlock_step"], ", ".join("p" + str(p) for p in summary["deadlocked_processes"])))
+        if summary["deadlock_cycle"] is not None:
+            print("  Cycle: " + " --> ".join("p" + str(p) for p in summary["deadlock_cycle"] + summary["deadlock_cycle"][:1]))
+        if summary["deadlock_components"]:
+            print("  Deadlocked sets: " + "; ".join(", ".join("p" + str(p) for p in component)
+                                                    for component in summary["deadlock_components"]))
+        if summary["blocked_processes"]:
+            print("  Blocked behind them: " + ", ".join("p" + str(p) for p in summary["blocked_processes"]))
+    else:
+        print("  No deadlock.")
+    print("  Peak wait-for graph size %d edges." % summary["peak_wait_edges"])
+    print("  %.3f s, %.0f steps/sec." % (summary["seconds"], summary["steps_per_sec"]))
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.headless TRACE [TRACE ...]
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Run resource manager traces without the GUI.")
+    parser.add_argument("traces", nargs="+", help="trace files to run")
+    parser.add_argument("--policy", default="fifo", choices=sorted(SCHEDULERS),
+                        help="grant scheduling policy; priority and aging use the priorities header line")
+    parser.add_argument("--avoid", action="store_true",
+                        help="avoid deadlock with the Banker's algorithm, needs claim lines in the trace")
+    parser.add_argument("--detect", default="graph", choices=DETECTIONS,
+                        help="deadlock detection: wait-for graph cycles, or the multi-instance matrix "
+                             "algorithm, which is exact when resources have several units")
+    parser.add_argument("--json", action="store_true", help="print one JSON summary per line")
+    parser.add_argument("--events", metavar="FILE",
+                        help="write every step, wait-for edge change and deadlock verdict as JSON lines, "
+                             "gzip-compressed if FILE ends in .gz")
+    parser.add_argument("--verbose", action="store_true", help="print every event on stdout")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="collect step and detection counters and timings, and dump them as JSON")
+    args = parser.parse_args(argv)
+
+    instrument = None
+    if args.profile:
+        from program3.helpers.instrument import Instrumentation
+        instrument = Instrumentation()
+    events = EventSink()
+    if args.events:
+        events = JsonLinesSink(args.events)
+    elif args.verbose:
+        events = PrintSink()
+    status = 0
+    for fp in args.traces:
+        try:
+            summary = run_trace(fp, args.policy, instrument, events, args.avoid, args.detect)
+        except (IOError, ValueError) as e:
+            print(e, file=sys.stderr)
+            status = 1
+            continue
+        summary["startup_seconds"] = STARTUP_TIME
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print_summary(summary)
+    events.close()
+    if instrument is not None:
+        instrument.dump(args.profile)
+    if not args.json:
+        print("Startup %.1f ms." % (STARTUP_TIME * 1000))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import numpy as np
+
+
+class Banker(object):
+    """
+    Banker's algorithm over Allocation, Need and Available kept as NumPy
+    arrays. Besides the matrices it keeps a safe sequence: an order in which
+    every process can finish, and the work vector before each one does. A
+    release never breaks the sequence and a grant of resource r to process p
+    only changes column r up to p, so most requests are checked against one
+    column instead of running the full safety check.
+    """
+    def __init__(self, units, claims, processes):
+        """
+        :param units: list of units per resource.
+        :param claims: dict of process -> list of maximum units per resource.
+        :param processes: number of processes.
+        """
+        resources = len(units)
+        self.units = np.array(units, dtype=np.int32)
+        self.available = self.units.copy()
+        self.maximum = np.zeros((processes, resources), dtype=np.int32)
+        for p, claim in claims.items():
+            if not 0 <= p < processes:
+                raise ValueError("Claim for process %d, but there are %d processes." % (p, processes))
+            if len(claim) != resources:
+                raise ValueError("Claim of process %d lists %d resources, not %d." % (p, len(claim), resources))
+            self.maximum[p] = claim
+        if (self.maximum > self.units).any():
+            p, r = np.argwhere(self.maximum > self.units)[0]
+            raise ValueError("Process %d claims more of resource %d than exists." % (p, r))
+        self.allocation = np.zeros((processes, resources), dtype=np.int32)
+        self.need = self.maximum.copy()
+        #  Units held per process. Processes holding nothing add nothing to the
+        #  work vector and can always finish last, so safety ignores them.
+        self.held = np.zeros(processes, dtype=np.int32)
+        #  Safe sequence, position of each process in it, and the work vector
+        #  available just before each position finishes.
+        self.order = np.arange(processes)
+        self.position = np.arange(processes)
+        self.work = np.tile(self.units, (processes, 1))
+        #  False once a change may have broken the sequence.
+        self.in_order = True
+        #  (process, resource) -> (processes that could not finish when the grant
+        #  was last found unsafe, change count then).
+        self.stuck = {}
+        #  Number of releases, and the count at each process's last one. Grants
+        #  never make an unsafe grant safe, so only releases are tracked.
+        self.changes = 0
+        self.changed = np.zeros(processes, dtype=np.int64)
+
+    def exceeds_claim(self, process, resource, pending=0):
+        """
+        :param process: process number.
+        :param resource: resource number.
+        :param pending: requests of process for resource already waiting.
+        :return: True if one more unit would take process past its claim.
+        """
+        return self.need[process, resource] - pending <= 0
+
+    def allocate(self, process, resource, count=1):
+        """
+        Give count units of resource to process, negative to take them back.
+        :param process: process number.
+        :param resource: resource number.
+        :param count: number of units.
+        """
+        self.allocation[process, resource] += count
+        self.need[process, resource] -= count
+        self.available[resource] -= count
+        self.held[process] += count
+        if count < 0:
+            self.changes += 1
+            self.changed[process] = self.changes
+        #  Everyone up to and including process has count units less to work with.
+        i = self.position[process]
+        self.work[:i + 1, resource] -= count
+        if count > 0 and self.in_order:
+            self.in_order = bool((self.need[self.order[:i], resource] <= self.work[:i, resource]).all())
+
+    def release(self, process, resource, count=1):
+        self.allocate(process, resource, -count)
+
+    def safe_order(self):
+        """
+        Safety check: repeatedly let every process whose need fits in the work
+        vector finish and return its allocation, all at once per round.
+        :return: (order, stuck) where order is an array of processes in an order
+        they can all finish in, or None if the state is unsafe, and stuck holds
+        the processes that could not finish.
+        """
+        active = np.flatnonzero(self.held > 0)
+        need = self.need[active]
+        allocation = self.allocation[active]
+        work = self.available.copy()
+        finished = []
+        while len(active):
+            can = (need <= work).all(axis=1)
+            if not can.any():
+                return None, active
+            work += allocation[can].sum(axis=0)
+            finished.append(active[can])
+            keep = ~can
+            active = active[keep]
+            need = need[keep]
+            allocation = allocation[keep]
+        finished.append(np.flatnonzero(self.held <= 0))
+        return np.concatenate(finished), active
+
+    def set_order(self, order):
+        """
+        Adopt a safe sequence and compute the work vector before each position.
+        :param order: array of processes from safe_order.
+        """
+        self.order = order
+        self.position[order] = np.arange(len(order))
+        returned = np.cumsum(self.allocation[order], axis=0)
+        self.work[0] = self.available
+        self.work[1:] = self.available + returned[:-1]
+        self.in_order = True
+
+    def is_safe(self):
+        return self.safe_order()[0] is not None
+
+    def still_stuck(self, stuck):
+        """
+        Whatever else finishes, the processes in stuck can at most get the
+        units they do not hold themselves. If none of them needs only that
+        much, none of them can finish and the state is unsafe.
+        :param stuck: array of processes.
+        :return: True if the state is known to be unsafe.
+        """
+        free = self.units - self.allocation[stuck].sum(axis=0)
+        return not (self.need[stuck] <= free).all(axis=1).any()
+
+    def grant_is_safe(self, process, resource):
+        """
+        Check whether granting one unit of resource to process leaves a safe
+        state. If the safe sequence survives the grant, only column resource
+        of the processes before process is looked at. Otherwise the full check
+        runs and its sequence is kept, as it is also safe before the grant.
+        A grant found unsafe before is first retried against the processes
+        that were stuck then.
+        :param process: process number.
+        :param resource: resource number.
+        :return: True if the grant is safe.
+        """
+        i = self.position[process]
+        if self.in_order and self.work[i, resource] > 0 and \
+                (self.need[self.order[:i], resource] < self.work[:i, resource]).all():
+            return True
+        entry = self.stuck.get((process, resource))
+        if entry is not None:
+            stuck, since = entry
+            #  None of the stuck processes has released anything since.
+            if self.changed[process] <= since and self.changed[stuck].max(initial=0) <= since:
+                return False
+        in_order = self.in_order
+        self.allocate(process, resource)
+        if entry is not None and self.still_stuck(stuck):
+            order = None
+        else:
+            order, stuck = self.safe_order()
+        self.release(process, resource)
+        if order is None:
+            self.in_order = in_order
+            self.stuck[(process, resource)] = (stuck, self.changes)
+            return False
+        self.stuck.pop((process, resource), None)
+        self.set_order(order)
+        return True
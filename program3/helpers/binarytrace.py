@@ -0,0 +1,142 @@
+import mmap
+import struct
+import sys
+from array import array
+
+from program3.helpers.trace import iter_steps, read_header
+
+#  File magic and format version.
+MAGIC = b'RMST'
+VERSION = 1
+#  Header: magic, version, processes, resources, number of steps.
+HEADER = struct.Struct('<4sIIIQ')
+#  Each step is two little-endian uint32 words: process with the request bit
+#  on top, then resource.
+RECORD_WORDS = 2
+RECORD_SIZE = 4 * RECORD_WORDS
+REQUEST_BIT = 1 << 31
+
+
+def is_binary_trace(fp):
+    """
+    :param fp: string file path.
+    :return: True if the file starts with the binary trace magic.
+    """
+    with open(fp, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def convert(text_fp, binary_fp, batch=1 << 16):
+    """
+    Convert a text trace into the binary trace format, streaming both files.
+    :param text_fp: string file path to the .data trace.
+    :param binary_fp: string file path to write.
+    :param batch: number of steps written per batch.
+    :return: number of steps written.
+    """
+    count = 0
+    with open(text_fp, 'r') as src, open(binary_fp, 'wb') as dst:
+        header = read_header(src, text_fp)
+        if not header.is_single_unit() or header.priorities is not None:
+            raise ValueError("%s: units, claim and priorities lines are not supported by the binary format"
+                             % text_fp)
+        processes, resources = header.processes, header.resources
+        dst.write(HEADER.pack(MAGIC, VERSION, processes, resources, 0))
+        words = array('I')
+        for p, re, r in iter_steps(src, text_fp, line_num=header.lines, processes=processes, resources=resources):
+            if p >= REQUEST_BIT or r > 0xffffffff:
+                raise ValueError("%s: step %d does not fit the binary format" % (text_fp, count + 1))
+            words.append(p | REQUEST_BIT if re else p)
+            words.append(r)
+            count += 1
+            if len(words) >= batch * RECORD_WORDS:
+                write_words(dst, words)
+                words = array('I')
+        write_words(dst, words)
+        #  Now the number of steps is known.
+        dst.seek(0)
+        dst.write(HEADER.pack(MAGIC, VERSION, processes, resources, count))
+    return count
+
+
+def write_words(f, words):
+    """
+    Write uint32 words little-endian.
+    :param f: open binary file.
+    :param words: array('I') of words.
+    """
+    if sys.byteorder != 'little':
+        words.byteswap()
+    words.tofile(f)
+
+
+class BinaryTrace(object):
+    """
+    Read-only, memory-mapped binary trace. Behaves like the list of
+    (process, request/release, resource) tuples in Core.steps, but decodes
+    each step only when it is indexed, so opening is O(1) in trace length.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.file = open(fp, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("%s: empty file is not a binary trace" % fp)
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ValueError("%s: truncated binary trace header" % fp)
+        magic, version, self.processes, self.resources, self.steps = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s: not a version %d binary trace" % (fp, VERSION))
+        if len(self.map) < HEADER.size + self.steps * RECORD_SIZE:
+            self.close()
+            raise ValueError("%s: truncated binary trace" % fp)
+        self.view = None
+        self.words = None
+        if sys.byteorder == 'little':
+            #  Zero-copy view of the records as native uint32 words.
+            end = HEADER.size + self.steps * RECORD_SIZE
+            self.view = memoryview(self.map)
+            self.words = self.view[HEADER.size:end].cast('I')
+
+    def __len__(self):
+        return self.steps
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.steps
+        if not 0 <= i < self.steps:
+            raise IndexError("step index out of range")
+        if self.words is not None:
+            p = self.words[2 * i]
+            r = self.words[2 * i + 1]
+        else:
+            p, r = struct.unpack_from('<II', self.map, HEADER.size + i * RECORD_SIZE)
+        return p & ~REQUEST_BIT, 1 if p & REQUEST_BIT else 0, r
+
+    def __iter__(self):
+        for i in range(self.steps):
+            yield self[i]
+
+    def close(self):
+        """
+        Unmap and close the file.
+        """
+        if getattr(self, 'words', None) is not None:
+            self.words.release()
+            self.view.release()
+            self.words = None
+            self.view = None
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,295 @@
+import heapq
+import random
+import time
+from array import array
+
+from program3.core import Core
+from program3.helpers.events import EventSink
+from program3.helpers.scheduler import make_scheduler
+from program3.helpers.script import ACQUIRE, COMPUTE, RELEASE
+
+#  Event kinds.
+RESUME = 0
+TIMEOUT = 1
+
+
+class GrantCollector(EventSink):
+    """
+    Collects the waiting requests a Core grants during a step, so the
+    simulation can wake the processes up once the step is over.
+    """
+    def __init__(self):
+        self.granted = []
+
+    def grant(self, state_num, process, resource):
+        self.granted.append((process, resource))
+
+
+def summarize(samples):
+    """
+    :param samples: sequence of times.
+    :return: dict of count, mean, p50, p90, p99 and max.
+    """
+    if not len(samples):
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {"count": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": ordered[last * 50 // 100],
+            "p90": ordered[last * 90 // 100],
+            "p99": ordered[last * 99 // 100],
+            "max": ordered[last]}
+
+
+class EventSimulation(object):
+    """
+    Discrete-event simulation of processes running timed scripts against a
+    Core. Simulated time advances from event to event on a heap of
+    (time, sequence, process, kind, token) entries, the sequence number
+    keeping ties in the order they were scheduled. Every acquire and release
+    is a step of the Core, so resource state, wait queues, the grant policy
+    and avoidance all behave exactly as when replaying a trace.
+
+    A process waits on an acquire until the Core grants it, or until its
+    timeout event fires first. A timed-out request is withdrawn and retried
+    after the backoff; when the retries run out the process gives up the
+    current run of its script and releases everything it holds. Timeout
+    events of waits that ended earlier are left on the heap and skipped when
+    they come up, by their token.
+    """
+    def __init__(self, header, scripts, seed=0, policy="fifo", avoidance=False):
+        """
+        :param header: helpers.trace.TraceHeader with the counts, units and claims.
+        :param scripts: list of helpers.script.ProcessScript.
+        :param seed: random seed for exponential durations.
+        :param policy: name of the grant scheduling policy.
+        :param avoidance: defer requests the Banker's algorithm finds unsafe.
+        """
+        self.logic = Core()
+        self.logic.set_header(header)
+        self.logic.set_scheduler(make_scheduler(policy))
+        self.logic.set_avoidance(avoidance)
+        self.sink = GrantCollector()
+        self.logic.set_event_sink(self.sink)
+        self.logic.steps = []
+        self.logic.init_state()
+        self.rnd = random.Random(seed)
+        processes = header.processes
+        resources = header.resources
+        self.actions = [None] * processes
+        self.repeat = [0] * processes
+        for script in scripts:
+            self.actions[script.process] = script.actions
+            self.repeat[script.process] = script.repeat
+        self.now = 0.0
+        self.queue = []
+        self.seq = 0
+        #  Where each process is: action index, run number and when the run began.
+        self.pc = [0] * processes
+        self.run_num = [0] * processes
+        self.run_start = [0.0] * processes
+        #  Resource waited for or -1, since when, retries used, and the token
+        #  of its live timeout event.
+        self.wait_resource = array('l', [-1]) * processes
+        self.wait_since = [0.0] * processes
+        self.attempts = [0] * processes
+        self.token = [0] * processes
+        #  Units held per resource, and the unit-time held up to last_change.
+        self.held_units = [0] * resources
+        self.busy = [0.0] * resources
+        self.last_change = [0.0] * resources
+        #  Statistics.
+        self.waits = array('d')
+        self.run_times = array('d')
+        self.events = 0
+        self.completed = 0
+        self.aborted = 0
+        self.timeouts = 0
+        self.retries = 0
+
+    def get_logic(self):
+        return self.logic
+
+    def get_time(self):
+        return self.now
+
+    def schedule(self, at, process, kind, token=0):
+        self.seq += 1
+        heapq.heappush(self.queue, (at, self.seq, process, kind, token))
+
+    def duration(self, spec):
+        """
+        :param spec: (mean, exponential) duration.
+        :return: time drawn for it.
+        """
+        mean, exponential = spec
+        if exponential and mean > 0:
+            return self.rnd.expovariate(1.0 / mean)
+        return mean
+
+    def held_changed(self, resource, change):
+        """
+        Account for the units of a resource held so far and apply a change.
+        """
+        self.busy[resource] += self.held_units[resource] * (self.now - self.last_change[resource])
+        self.last_change[resource] = self.now
+        self.held_units[resource] += change
+
+    def wake_granted(self):
+        """
+        Resume the processes whose waiting requests the last Core call granted.
+        """
+        for process, resource in self.sink.granted:
+            self.waits.append(self.now - self.wait_since[process])
+            self.held_changed(resource, 1)
+            self.wait_resource[process] = -1
+            self.token[process] += 1
+            self.attempts[process] = 0
+            self.pc[process] += 1
+            self.schedule(self.now, process, RESUME)
+        del self.sink.granted[:]
+
+    def release(self, process, resource):
+        self.logic.step_forward((process, 0, resource))
+        self.held_changed(resource, -1)
+        self.wake_granted()
+
+    def release_all(self, process):
+        """
+        Release every unit a process still holds, as when it ends or gives up.
+        """
+        for resource, count in sorted(self.logic.get_hold_edges().resources_of(process).items()):
+            for i in range(count):
+                self.release(process, resource)
+
+    def end_run(self, process, completed):
+        """
+        Finish the current run of a process's script and start the next one.
+        :param completed: True if the run got to the end, False if it gave up.
+        """
+        self.release_all(process)
+        if completed:
+            self.completed += 1
+            self.run_times.append(self.now - self.run_start[process])
+        else:
+            self.aborted += 1
+        self.run_num[process] += 1
+        self.pc[process] = 0
+        self.run_start[process] = self.now
+
+    def advance(self, process):
+        """
+        Run a process's script from where it is until it has to wait for time
+        to pass or for a resource.
+        """
+        actions = self.actions[process]
+        logic = self.logic
+        while self.run_num[process] < self.repeat[process]:
+            if self.pc[process] == len(actions):
+                self.end_run(process, True)
+                continue
+            action = actions[self.pc[process]]
+            kind = action[0]
+            if kind == COMPUTE:
+                self.pc[process] += 1
+                self.schedule(self.now + self.duration(action[1]), process, RESUME)
+                return
+            resource = action[1]
+            if kind == RELEASE:
+                if logic.get_hold_edges().count(resource, process) > 0:
+                    self.release(process, resource)
+                self.pc[process] += 1
+                continue
+            logic.step_forward((process, 1, resource))
+            if logic.get_request_edges().count(resource, process) > 0:
+                self.wait_resource[process] = resource
+                self.wait_since[process] = self.now
+                self.token[process] += 1
+                if action[2] is not None:
+                    self.schedule(self.now + self.duration(action[2]), process, TIMEOUT, self.token[process])
+                return
+            self.waits.append(0.0)
+            self.held_changed(resource, 1)
+            self.attempts[process] = 0
+            self.pc[process] += 1
+
+    def timeout(self, process, token):
+        """
+        Handle a timeout event, unless the wait it was set for already ended.
+        """
+        if token != self.token[process] or self.wait_resource[process] < 0:
+            return
+        resource = self.wait_resource[process]
+        self.logic.withdraw(process, resource)
+        self.wait_resource[process] = -1
+        self.timeouts += 1
+        self.wake_granted()
+        retries, backoff = self.actions[process][self.pc[process]][3:5]
+        if self.attempts[process] < retries:
+            self.attempts[process] += 1
+            self.retries += 1
+            self.schedule(self.now + self.duration(backoff), process, RESUME)
+            return
+        self.attempts[process] = 0
+        self.end_run(process, False)
+        self.schedule(self.now, process, RESUME)
+
+    def run(self, until=None):
+        """
+        Run until no events are left or simulated time passes until.
+        :param until: simulated time to stop at, None to run to the end.
+        :return: dict summarizing the run.
+        """
+        start = time.perf_counter()
+        for process, actions in enumerate(self.actions):
+            if actions and self.repeat[process] > 0:
+                self.schedule(0.0, process, RESUME)
+        queue = self.queue
+        pop = heapq.heappop
+        while queue:
+            if until is not None and queue[0][0] > until:
+                self.now = until
+                break
+            at, seq, process, kind, token = pop(queue)
+            self.now = at
+            self.events += 1
+            if kind == RESUME:
+                self.advance(process)
+            else:
+                self.timeout(process, token)
+        return self.report(time.perf_counter() - start)
+
+    def report(self, seconds):
+        """
+        :param seconds: wall clock time the run took.
+        :return: dict of throughput, latency and utilization.
+        """
+        for resource in range(len(self.busy)):
+            self.held_changed(resource, 0)
+        logic = self.logic
+        units = logic.get_units()
+        waiting = [p for p, r in enumerate(self.wait_resource) if r >= 0]
+        deadlocked, processes = logic.detect() if waiting else (False, None)
+        now = self.now
+        return {"processes": logic.get_processes(),
+                "resources": logic.get_resources(),
+                "sim_time": now,
+                "events": self.events,
+                "steps": logic.get_state_num(),
+                "seconds": seconds,
+                "events_per_sec": self.events / seconds if seconds > 0 else 0.0,
+                "runs_completed": self.completed,
+                "runs_aborted": self.aborted,
+                "throughput": self.completed / now if now > 0 else 0.0,
+                "timeouts": self.timeouts,
+                "retries": self.retries,
+                "wait": summarize(self.waits),
+                #  Waits still going at the end, up to the end time.
+                "wait_unfinished": summarize([now - self.wait_since[p] for p in waiting]),
+                "run_time": summarize(self.run_times),
+                "utilization": [self.busy[r] / (units[r] * now) if now > 0 else 0.0
+                                for r in range(len(self.busy))],
+                "waiting": waiting,
+                "deadlocked": bool(deadlocked),
+                "deadlocked_processes": sorted(processes) if deadlocked else None}
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+def find_deadlocked(work, allocation, request):
+    """
+    Multi-instance deadlock detection over Available, Allocation and Request.
+    Every round, all processes whose request fits in the work vector are
+    assumed to finish and return their allocation at once. Whoever is left
+    when a round frees nobody is deadlocked.
+    :param work: array of units free per resource.
+    :param allocation: processes x resources array of units held.
+    :param request: processes x resources array of units waited for.
+    :return: array of row numbers of the deadlocked processes.
+    """
+    rows = np.arange(len(request))
+    work = work.copy()
+    while len(rows):
+        can = (request <= work).all(axis=1)
+        if not can.any():
+            break
+        work += allocation[can].sum(axis=0)
+        keep = ~can
+        rows = rows[keep]
+        request = request[keep]
+        allocation = allocation[keep]
+    return rows
+
+
+def detect(units, hold_edges, request_edges):
+    """
+    Find the deadlocked processes of a Core state. Processes that wait for
+    nothing always finish, so they start out as returned units and only the
+    waiting processes get rows. Only resources someone waits for get columns,
+    as the others never hold anyone back. The matrices are filled one
+    resource at a time straight from the edge dicts.
+    :param units: list of units per resource.
+    :param hold_edges: helpers.edges.SparseEdges of units held.
+    :param request_edges: helpers.edges.SparseEdges of units waited for.
+    :return: sorted list of deadlocked processes.
+    """
+    if not request_edges.by_resource:
+        return []
+    contended = sorted(request_edges.by_resource)
+    req_p, req_c, req_n = [], [], []
+    hold_p, hold_c, hold_n = [], [], []
+    for c, resource in enumerate(contended):
+        row = request_edges.by_resource[resource]
+        req_p.extend(row)
+        req_c.extend([c] * len(row))
+        req_n.extend(row.values())
+        row = hold_edges.processes_of(resource)
+        hold_p.extend(row)
+        hold_c.extend([c] * len(row))
+        hold_n.extend(row.values())
+    waiting, req_row = np.unique(np.array(req_p, dtype=np.int64), return_inverse=True)
+    request = np.zeros((len(waiting), len(contended)), dtype=np.int64)
+    request[req_row, req_c] = req_n
+    allocation = np.zeros((len(waiting), len(contended)), dtype=np.int64)
+    if hold_p:
+        hold_p = np.array(hold_p, dtype=np.int64)
+        hold_row = np.searchsorted(waiting, hold_p).clip(max=len(waiting) - 1)
+        mine = waiting[hold_row] == hold_p
+        allocation[hold_row[mine], np.array(hold_c)[mine]] = np.array(hold_n)[mine]
+    work = np.array(units, dtype=np.int64)[contended] - allocation.sum(axis=0)
+    return waiting[find_deadlocked(work, allocation, request)].tolist()
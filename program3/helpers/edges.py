@@ -0,0 +1,122 @@
+class SparseEdges(object):
+    """
+    Sparse store of edge counts between resources and processes. Every edge is
+    kept both under its resource and under its process, so memory scales with
+    the number of live edges instead of resources x processes.
+    Indexing with [resource][process] reads like the old adjacency matrices.
+    """
+    def __init__(self, resources, processes):
+        self.resources = resources
+        self.processes = processes
+        #  resource -> {process: count}
+        self.by_resource = {}
+        #  process -> {resource: count}
+        self.by_process = {}
+        self.edges = 0
+
+    def add(self, resource, process, count=1):
+        """
+        Add count edges between resource and process.
+        :param resource: resource number.
+        :param process: process number.
+        :param count: number of edges to add, negative to remove.
+        """
+        row = self.by_resource.setdefault(resource, {})
+        value = row.get(process, 0) + count
+        if value:
+            if process not in row:
+                self.edges += 1
+            row[process] = value
+            self.by_process.setdefault(process, {})[resource] = value
+        elif process in row:
+            self.edges -= 1
+            del row[process]
+            del self.by_process[process][resource]
+            if not row:
+                del self.by_resource[resource]
+            if not self.by_process[process]:
+                del self.by_process[process]
+
+    def remove(self, resource, process, count=1):
+        """
+        Remove count edges between resource and process.
+        :param resource: resource number.
+        :param process: process number.
+        :param count: number of edges to remove.
+        """
+        self.add(resource, process, -count)
+
+    def copy(self):
+        """
+        :return: independent copy of the edges.
+        """
+        edges = SparseEdges(self.resources, self.processes)
+        edges.by_resource = {r: dict(row) for r, row in self.by_resource.items()}
+        edges.by_process = {p: dict(row) for p, row in self.by_process.items()}
+        edges.edges = self.edges
+        return edges
+
+    def count(self, resource, process):
+        return self.by_resource.get(resource, {}).get(process, 0)
+
+    def processes_of(self, resource):
+        """
+        :param resource: resource number.
+        :return: dict of process -> count for the resource's edges.
+        """
+        return self.by_resource.get(resource, {})
+
+    def resources_of(self, process):
+        """
+        :param process: process number.
+        :return: dict of resource -> count for the process's edges.
+        """
+        return self.by_process.get(process, {})
+
+    def edge_count(self):
+        return self.edges
+
+    def __iter__(self):
+        for resource in range(self.resources):
+            yield EdgeRow(self, resource)
+
+    def __len__(self):
+        return self.resources
+
+    def __getitem__(self, resource):
+        return EdgeRow(self, resource)
+
+
+class EdgeRow(object):
+    """
+    One resource row of a SparseEdges store, behaving like a list of counts
+    indexed by process number.
+    """
+    def __init__(self, edges, resource):
+        self.edges = edges
+        self.resource = resource
+
+    def __getitem__(self, process):
+        return self.edges.count(self.resource, process)
+
+    def __setitem__(self, process, value):
+        self.edges.add(self.resource, process, value - self.edges.count(self.resource, process))
+
+    def __len__(self):
+        return self.edges.processes
+
+    def __iter__(self):
+        row = self.edges.processes_of(self.resource)
+        for process in range(self.edges.processes):
+            yield row.get(process, 0)
+
+    def index(self, value):
+        """
+        Lowest process number whose count equals value. Only looks at live edges.
+        :param value: nonzero count to look for.
+        :return: process number.
+        """
+        found = [p for p, c in self.edges.processes_of(self.resource).items() if c == value]
+        if not found:
+            raise ValueError("%r is not in list" % value)
+        return min(found)
@@ -0,0 +1,208 @@
+import gzip
+import json
+
+#  Step outcomes.
+GRANTED = "request_granted"
+BLOCKED = "request_blocked"
+DEFERRED = "request_deferred"
+HANDOFF = "release_handoff"
+FREED = "release_freed"
+
+
+class EventSink(object):
+    """
+    Receives every step outcome, grant of a waiting request, wait-for edge
+    change and deadlock verdict of a Core run. This base sink drops
+    everything, which is the quiet mode.
+    """
+    def loaded(self, processes, resources, steps):
+        """
+        :param processes: number of processes.
+        :param resources: number of resources.
+        :param steps: number of steps, or None when streaming.
+        """
+        pass
+
+    def load_failed(self, fp):
+        pass
+
+    def step(self, state_num, process, re, resource, outcome, other):
+        """
+        :param state_num: state number the step leads to.
+        :param process: process making the step.
+        :param re: 1 for a request, 0 for a release.
+        :param resource: resource involved.
+        :param outcome: GRANTED, BLOCKED, DEFERRED, HANDOFF or FREED.
+        :param other: process waited for when blocked, new holder on handoff.
+        """
+        pass
+
+    def grant(self, state_num, process, resource):
+        """
+        A waiting request was granted.
+        :param state_num: state number the grant leads to.
+        :param process: process that waited.
+        :param resource: resource it now holds.
+        """
+        pass
+
+    def wait_edge(self, state_num, src, dest, added):
+        """
+        :param state_num: state number of the change.
+        :param src: waiting process.
+        :param dest: process waited for.
+        :param added: True if the edge appeared, False if it went away.
+        """
+        pass
+
+    def deadlock(self, state_num, deadlocked, cycle, processes=None):
+        """
+        :param state_num: state number checked.
+        :param deadlocked: verdict.
+        :param cycle: processes around the cycle, or None.
+        :param processes: deadlocked processes, if the detector finds them without a cycle.
+        """
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PrintSink(EventSink):
+    """
+    Prints events as readable lines on stdout. Core reports grants before
+    the step that caused them, so they are printed after it.
+    """
+    def __init__(self):
+        #  Grants of waiting requests not printed yet, as (process, resource).
+        self.granted = []
+
+    def loaded(self, processes, resources, steps):
+        print("\n%d processes and %d resources." % (processes, resources))
+        if steps is not None:
+            print("%d total steps in simulation.\n" % steps)
+
+    def load_failed(self, fp):
+        print("Cannot find the file at", fp)
+
+    def step(self, state_num, process, re, resource, outcome, other):
+        print("\nStepping forward to state %d." % state_num)
+        if re:
+            print("Process %d requests resource %d." % (process, resource))
+            if outcome == BLOCKED:
+                print("p{:d} --> p{:d}".format(process, other))
+            elif outcome == DEFERRED:
+                print("Granting resource %d now would be unsafe, request deferred." % resource)
+        else:
+            print("Process %d releases resource %d." % (process, resource))
+            if outcome == HANDOFF:
+                print("Process %d now has resource %d." % (other, resource))
+            else:
+                print("Resource %d is now available." % resource)
+        self.print_grants((other, resource) if outcome == HANDOFF else None)
+
+    def grant(self, state_num, process, resource):
+        self.granted.append((process, resource))
+
+    def print_grants(self, shown=None):
+        """
+        Print the grants since the last step.
+        :param shown: (process, resource) grant the step already printed, or None.
+        """
+        for process, resource in self.granted:
+            if (process, resource) != shown:
+                print("Process %d now has resource %d." % (process, resource))
+        self.granted = []
+
+    def deadlock(self, state_num, deadlocked, cycle, processes=None):
+        if deadlocked and cycle is None:
+            print("Deadlock! Processes " + ", ".join("p" + str(p) for p in processes))
+        elif deadlocked:
+            print("Deadlock! " + " --> ".join("p" + str(p) for p in cycle + cycle[:1]))
+        else:
+            print("No deadlock!")
+
+    def flush(self):
+        #  Grants outside a step, such as after a withdrawn request.
+        self.print_grants()
+
+
+class JsonLinesSink(EventSink):
+    """
+    Writes one JSON object per event to a file. Lines are buffered and written
+    in batches, and the file is gzip-compressed if asked or if its name ends
+    in .gz.
+    """
+    def __init__(self, fp, compress=None, batch=4096):
+        """
+        :param fp: string file path to write.
+        :param compress: gzip the output, defaults to fp ending in .gz.
+        :param batch: number of events buffered between writes.
+        """
+        if compress is None:
+            compress = fp.endswith('.gz')
+        self.file = gzip.open(fp, 'wt') if compress else open(fp, 'w')
+        self.batch = batch
+        self.buffer = []
+        self.dumps = json.JSONEncoder(separators=(',', ':')).encode
+
+    def write(self, event):
+        self.buffer.append(self.dumps(event))
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def loaded(self, processes, resources, steps):
+        self.write({"event": "loaded", "processes": processes, "resources": resources, "steps": steps})
+
+    def load_failed(self, fp):
+        self.write({"event": "load_failed", "file": fp})
+
+    def step(self, state_num, process, re, resource, outcome, other):
+        self.write({"event": "step", "state": state_num, "process": process,
+                    "op": "request" if re else "release", "resource": resource,
+                    "outcome": outcome, "other": other})
+
+    def grant(self, state_num, process, resource):
+        self.write({"event": "grant", "state": state_num, "process": process, "resource": resource})
+
+    def wait_edge(self, state_num, src, dest, added):
+        self.write({"event": "wait_edge", "state": state_num, "src": src, "dest": dest,
+                    "change": "add" if added else "remove"})
+
+    def deadlock(self, state_num, deadlocked, cycle, processes=None):
+        event = {"event": "deadlock", "state": state_num, "deadlocked": deadlocked, "cycle": cycle}
+        if processes is not None:
+            event["processes"] = processes
+        self.write(event)
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.file.write('\n'.join(self.buffer))
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def make_sink(mode, fp=None):
+    """
+    Build an event sink by mode name.
+    :param mode: "quiet", "print" or "jsonl".
+    :param fp: file path for "jsonl".
+    :return: EventSink.
+    """
+    if mode == "quiet":
+        return EventSink()
+    if mode == "print":
+        return PrintSink()
+    if mode == "jsonl":
+        if fp is None:
+            raise ValueError("The jsonl event sink needs a file path.")
+        return JsonLinesSink(fp)
+    raise ValueError("Unknown event sink: %s" % mode)
@@ -1,3 +1,4 @@
+from program3.helpers.intgraph import IntGraph
 from program3.helpers.vertex import Vertex
 
 
@@ -6,34 +7,47 @@ class Graph(object):
     Directed helpers for use as Wait-for helpers.
     Modified from:
     https://www.sanfoundry.com/python-program-find-directed-graph-contains-cycle-using-dfs/
+    Thin adapter over an IntGraph: vertices are handed out as Vertex views
+    made on demand, so nothing is stored per vertex here.
     """
-    def __init__(self):
-        self.vertices = {}
+    def __init__(self, backend=None):
+        """
+        :param backend: IntGraph to wrap, a new empty one if None.
+        """
+        self.backend = IntGraph() if backend is None else backend
+
+    def get_backend(self):
+        return self.backend
 
     def add_vertex(self, key):
-        vertex = Vertex(key)
-        self.vertices[key] = vertex
+        self.backend.add_vertex(key)
 
     def delete_vertex(self, key):
-        self.vertices.pop(key, None)
+        self.backend.delete_vertex(key)
 
     def get_vertex(self, key):
-        return self.vertices[key]
+        if key not in self.backend:
+            raise KeyError(key)
+        return Vertex(key, self.backend)
 
     def __contains__(self, key):
-        return key in self.vertices
+        return key in self.backend
 
     def add_edge(self, src_key, dest_key, weight=1):
-        self.vertices[src_key].add_neighbor(self.vertices[dest_key], weight)
+        self.backend.add_edge(src_key, dest_key, weight)
 
     def delete_edge(self, src_key, dest_key):
-        self.vertices[src_key].delete_neighbor(self.vertices[dest_key])
+        self.backend.delete_edge(src_key, dest_key)
 
     def does_edge_exist(self, src_key, dest_key):
-        return self.vertices[src_key].does_it_point_to(self.vertices[dest_key])
+        return self.backend.does_edge_exist(src_key, dest_key)
 
     def does_vertex_exit(self, key):
-        return self.vertices[key]
+        return self.get_vertex(key)
+
+    def __len__(self):
+        return len(self.backend)
 
     def __iter__(self):
-        return iter(self.vertices.values())
+        backend = self.backend
+        return (Vertex(key, backend) for key in backend)
@@ -0,0 +1,148 @@
+import json
+import time
+
+
+class Histogram(object):
+    """
+    Timing histogram with power-of-two nanosecond buckets.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def add(self, ns):
+        """
+        :param ns: duration in nanoseconds.
+        """
+        bucket = ns.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile.
+        :param q: percentile between 0 and 100.
+        :return: duration in nanoseconds.
+        """
+        if not self.count:
+            return 0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count,
+                "total_ns": self.total,
+                "mean_ns": self.mean(),
+                "min_ns": self.min or 0,
+                "p50_ns": self.percentile(50),
+                "p99_ns": self.percentile(99),
+                "max_ns": self.max,
+                "buckets": {str(1 << b): n for b, n in sorted(self.buckets.items())}}
+
+
+class Instrumentation(object):
+    """
+    Opt-in counters, timing histograms and wait-for graph size samples for a
+    Core run. Core only touches it when one is attached, so a run without
+    instrumentation pays a single None check per hot path.
+    """
+    def __init__(self, graph_sample_every=100):
+        """
+        :param graph_sample_every: sample the graph size every this many steps.
+        """
+        self.graph_sample_every = graph_sample_every
+        self.counters = {}
+        self.timings = {}
+        #  (state number, wait-for edges, graph vertices, waiting requests).
+        self.graph_samples = []
+        self.peak_wait_edges = 0
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, ns):
+        """
+        Count one event and add its duration to its histogram.
+        :param name: event name.
+        :param ns: duration in nanoseconds.
+        """
+        self.counters[name] = self.counters.get(name, 0) + 1
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.add(ns)
+
+    def record_step(self, kind, ns, logic):
+        """
+        Record one step and sample the graph size if it is due.
+        :param kind: step outcome, e.g. request_granted.
+        :param ns: duration in nanoseconds.
+        :param logic: the Core that stepped.
+        """
+        self.record(kind, ns)
+        edges = logic.wait_edges
+        if edges > self.peak_wait_edges:
+            self.peak_wait_edges = edges
+        if logic.state_num % self.graph_sample_every == 0:
+            self.graph_samples.append((logic.state_num, edges, len(logic.graph),
+                                       logic.scheduler.waiting))
+
+    def timed_iter(self, name, iterable):
+        """
+        Wrap an iterator, recording the time taken to produce each item.
+        :param name: event name.
+        :param iterable: iterator to wrap.
+        :return: generator of the same items.
+        """
+        clock = time.perf_counter_ns
+        it = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.record(name, clock() - start)
+            yield item
+
+    def get_counter(self, name):
+        return self.counters.get(name, 0)
+
+    def get_histogram(self, name):
+        return self.timings.get(name)
+
+    def get_graph_samples(self):
+        return self.graph_samples
+
+    def summary(self):
+        """
+        :return: dict of all counters, histograms and graph size samples.
+        """
+        return {"counters": dict(self.counters),
+                "timings": {name: h.to_dict() for name, h in self.timings.items()},
+                "peak_wait_edges": self.peak_wait_edges,
+                "graph_samples": self.graph_samples}
+
+    def dump(self, fp):
+        """
+        Write the summary as JSON.
+        :param fp: string file path.
+        """
+        with open(fp, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
@@ -0,0 +1,271 @@
+import hashlib
+import random
+from array import array
+
+from program3.core import Core
+from program3.helpers.des import GrantCollector
+from program3.helpers.scheduler import make_scheduler
+from program3.helpers.script import COMPUTE, RELEASE
+
+
+class Interleaving(object):
+    """
+    Runs per-process scripts on a Core one action at a time, in whatever
+    order the caller picks the processes. Only the order of acquires and
+    releases matters here: compute actions, durations and timeouts are
+    ignored and a waiting process simply waits until it is granted.
+
+    ready lists the processes that can take an action, with each process's
+    index in it kept in position, so a random pick and the removal of a
+    process that starts waiting are both O(1).
+    """
+    def __init__(self, header, scripts, policy="fifo", avoidance=False):
+        """
+        :param header: helpers.trace.TraceHeader with the counts, units and claims.
+        :param scripts: list of helpers.script.ProcessScript.
+        :param policy: name of the grant scheduling policy.
+        :param avoidance: defer requests the Banker's algorithm finds unsafe.
+        """
+        self.header = header
+        self.policy = policy
+        self.avoidance = avoidance
+        self.logic = Core()
+        self.logic.set_header(header)
+        self.logic.set_scheduler(make_scheduler(policy))
+        self.logic.set_avoidance(avoidance)
+        #  Wait-for cycles only mean deadlock when every resource has one unit.
+        if any(n != 1 for n in header.units):
+            self.logic.set_detection("matrix")
+        self.sink = GrantCollector()
+        self.logic.set_event_sink(self.sink)
+        self.logic.steps = []
+        processes = header.processes
+        self.actions = [()] * processes
+        self.repeat = [0] * processes
+        for script in scripts:
+            self.actions[script.process] = tuple(a[:2] for a in script.actions if a[0] != COMPUTE)
+            self.repeat[script.process] = script.repeat if self.actions[script.process] else 0
+        #  Steps taken, as (process, request/release, resource), when recording.
+        self.record = False
+        self.trace = []
+        self.start()
+
+    def get_logic(self):
+        return self.logic
+
+    def get_trace(self):
+        return self.trace
+
+    def set_record(self, record):
+        """
+        :param record: True to keep every step taken in get_trace, for writing
+        out the interleaving that led somewhere.
+        """
+        self.record = record
+
+    def start(self):
+        """
+        Go back to the initial state, with every process at its first action.
+        """
+        processes = self.header.processes
+        self.logic.reset()
+        self.logic.init_state()
+        del self.sink.granted[:]
+        self.pc = [0] * processes
+        self.run_num = [0] * processes
+        #  Resource each process waits for, or -1.
+        self.wait_resource = array('l', [-1]) * processes
+        self.ready = [p for p in range(processes) if self.repeat[p]]
+        self.position = array('l', [-1]) * processes
+        for i, p in enumerate(self.ready):
+            self.position[p] = i
+        self.trace = []
+
+    def add_ready(self, process):
+        self.position[process] = len(self.ready)
+        self.ready.append(process)
+
+    def remove_ready(self, process):
+        i = self.position[process]
+        last = self.ready.pop()
+        if last != process:
+            self.ready[i] = last
+            self.position[last] = i
+        self.position[process] = -1
+
+    def apply(self, process, re, resource):
+        self.logic.step_forward((process, re, resource))
+        if self.record:
+            self.trace.append((process, re, resource))
+
+    def wake_granted(self):
+        """
+        Move processes whose waiting requests were just granted past them.
+        Ending a run releases resources, which can grant more requests.
+        """
+        while self.sink.granted:
+            granted, self.sink.granted = self.sink.granted, []
+            for process, resource in granted:
+                self.wait_resource[process] = -1
+                self.add_ready(process)
+                self.next_action(process)
+
+    def next_action(self, process):
+        """
+        Move a process to its next action, ending the run of its script when
+        it gets to the end. Whatever it still holds then is released.
+        """
+        self.pc[process] += 1
+        if self.pc[process] < len(self.actions[process]):
+            return
+        for resource, count in sorted(self.logic.get_hold_edges().resources_of(process).items()):
+            for i in range(count):
+                self.apply(process, 0, resource)
+        self.pc[process] = 0
+        self.run_num[process] += 1
+        if self.run_num[process] >= self.repeat[process]:
+            self.remove_ready(process)
+        self.wake_granted()
+
+    def step(self, process):
+        """
+        Run the next action of a ready process.
+        :param process: process number, from ready.
+        :return: True if the process now waits.
+        """
+        kind, resource = self.actions[process][self.pc[process]]
+        if kind == RELEASE:
+            if self.logic.get_hold_edges().count(resource, process) > 0:
+                self.apply(process, 0, resource)
+            self.next_action(process)
+            self.wake_granted()
+            return False
+        self.apply(process, 1, resource)
+        if self.logic.get_request_edges().count(resource, process) > 0:
+            self.wait_resource[process] = resource
+            self.remove_ready(process)
+            return True
+        self.next_action(process)
+        return False
+
+    def snapshot(self):
+        """
+        Capture the state of the Core and of every process.
+        :return: snapshot for restore.
+        """
+        return (self.logic.snapshot(), list(self.pc), list(self.run_num), array('l', self.wait_resource),
+                list(self.ready), array('l', self.position), len(self.trace))
+
+    def restore(self, snap):
+        """
+        Return to a state captured by snapshot, which can be restored again.
+        :param snap: snapshot from snapshot().
+        """
+        logic, pc, run_num, wait_resource, ready, position, trace = snap
+        self.logic.restore(logic)
+        self.pc[:] = pc
+        self.run_num[:] = run_num
+        self.wait_resource[:] = wait_resource
+        self.ready[:] = ready
+        self.position[:] = position
+        del self.trace[trace:]
+
+    def state(self):
+        """
+        Canonical form of the current state: where each process is, what it
+        holds, and who waits for each resource in grant order. Interleavings
+        that reach the same state give the same tuple, whatever the order of
+        the ready list or the step number.
+        :return: tuple.
+        """
+        logic = self.logic
+        hold_edges = logic.get_hold_edges()
+        scheduler = logic.get_scheduler()
+        return (tuple(self.pc), tuple(self.run_num), tuple(self.wait_resource),
+                tuple(tuple(sorted(hold_edges.resources_of(p).items())) for p in range(self.header.processes)),
+                tuple((r, tuple(scheduler.order(r))) for r in sorted(scheduler.queues)),
+                tuple(sorted(logic.deferred)))
+
+    def is_finished(self):
+        return not self.ready and all(r < 0 for r in self.wait_resource)
+
+    def deadlock_key(self, processes):
+        """
+        Describe a deadlock found by the Core's detect so that the same
+        deadlock reached by different interleavings looks the same.
+        :param processes: processes detect returned.
+        :return: tuple of (process, resource it waits for), around the cycle
+        from its lowest process, or sorted when only the set is known.
+        """
+        cycle = self.logic.get_deadlock_cycle()
+        if cycle is None:
+            return tuple((p, self.wait_resource[p]) for p in sorted(processes))
+        low = cycle.index(min(cycle))
+        return tuple((p, self.wait_resource[p]) for p in cycle[low:] + cycle[:low])
+
+    def cycle_key(self, process):
+        """
+        Key of the wait-for cycle a process is on, in the form deadlock_key
+        gives, when every resource has one unit and so one holder.
+        :param process: process on a cycle.
+        :return: tuple of (process, resource it waits for).
+        """
+        holders = self.logic.get_connected_v()
+        cycle = [process]
+        holder = holders[self.wait_resource[process]]
+        while holder != process:
+            cycle.append(holder)
+            holder = holders[self.wait_resource[holder]]
+        low = cycle.index(min(cycle))
+        return tuple((p, self.wait_resource[p]) for p in cycle[low:] + cycle[:low])
+
+
+def format_deadlock(key):
+    """
+    :param key: key from Interleaving.deadlock_key.
+    :return: readable string such as "p0 -r1-> p1 -r0-> p0".
+    """
+    return " ".join("p%d -r%d->" % (p, r) for p, r in key) + " p%d" % key[0][0]
+
+
+def trial_seed(seed, trial):
+    """
+    Seed of one trial's random stream. Every trial gets its own stream derived
+    from the run seed and its number, so results do not depend on how trials
+    are split between workers.
+    :param seed: run seed.
+    :param trial: trial number.
+    :return: integer seed.
+    """
+    digest = hashlib.blake2b(("%d:%d" % (seed, trial)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def sample(interleaving, rnd):
+    """
+    Run one interleaving, picking a random ready process at every action,
+    until every script is done or a deadlock appears. A deadlock can only
+    appear when a request has to wait, so that is when detect is called.
+    :param interleaving: Interleaving to run, restarted first.
+    :param rnd: random.Random choosing the processes.
+    :return: ("deadlock", key), ("stuck", None) if processes wait forever
+    without a deadlock, or ("done", None).
+    """
+    interleaving.start()
+    logic = interleaving.get_logic()
+    ready = interleaving.ready
+    while ready:
+        if interleaving.step(ready[rnd.randrange(len(ready))]):
+            deadlocked, processes = logic.detect()
+            if deadlocked:
+                return "deadlock", interleaving.deadlock_key(processes)
+    if interleaving.is_finished():
+        return "done", None
+    return "stuck", None
+
+
+def sample_trial(interleaving, seed, trial):
+    """
+    :return: outcome of one trial, from sample.
+    """
+    return sample(interleaving, random.Random(trial_seed(seed, trial)))
@@ -0,0 +1,155 @@
+#  Shared out edges of every vertex that never had any.
+NO_EDGES = ()
+
+
+class IntGraph(object):
+    """
+    Directed weighted graph over integer process numbers, used as the wait-for
+    graph. There are no per-vertex objects: out holds, for every process
+    number, None if the process is not in the graph or a dict of
+    destination -> weight. Vertices without edges share NO_EDGES until they
+    get one. Vertices are remembered in insertion order so searches visit
+    them in a fixed order.
+    """
+    __slots__ = ("out", "order", "edges")
+
+    def __init__(self, size=0):
+        """
+        :param size: number of process numbers to make room for up front. The
+        graph grows past it as needed.
+        """
+        self.out = [None] * size
+        #  Vertex keys in insertion order, as a dict used as an ordered set.
+        self.order = {}
+        #  Number of distinct edges, whatever their weight.
+        self.edges = 0
+
+    def add_vertex(self, key):
+        """
+        Add a vertex. Adding a vertex that is already there leaves it and its
+        edges alone.
+        :param key: process number.
+        """
+        out = self.out
+        if key >= len(out):
+            out.extend([None] * (key + 1 - len(out)))
+        if out[key] is None:
+            out[key] = NO_EDGES
+            self.order[key] = None
+
+    def delete_vertex(self, key):
+        """
+        Remove a vertex together with its edges in both directions.
+        :param key: process number.
+        """
+        if key not in self:
+            return
+        self.edges -= len(self.out[key])
+        self.out[key] = None
+        del self.order[key]
+        for src in self.order:
+            row = self.out[src]
+            if row and row.pop(key, None) is not None:
+                self.edges -= 1
+
+    def __contains__(self, key):
+        return 0 <= key < len(self.out) and self.out[key] is not None
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def neighbors(self, key):
+        """
+        :param key: process number in the graph.
+        :return: destination -> weight mapping of the vertex's out edges.
+        """
+        return self.out[key]
+
+    def weight(self, src, dest):
+        """
+        :return: weight of the edge src -> dest, 0 if there is none.
+        """
+        if src not in self:
+            return 0
+        return self.out[src].get(dest, 0)
+
+    def add_edge(self, src, dest, weight=1):
+        """
+        Set the weight of the edge src -> dest. Both vertices must exist.
+        """
+        row = self.out[src]
+        if row is NO_EDGES:
+            row = self.out[src] = {}
+        if dest not in row:
+            self.edges += 1
+        row[dest] = weight
+
+    def delete_edge(self, src, dest):
+        del self.out[src][dest]
+        self.edges -= 1
+
+    def does_edge_exist(self, src, dest):
+        return dest in self.out[src]
+
+    def add(self, src, dest, count=1):
+        """
+        Add count to the weight of the edge src -> dest, adding the edge and
+        both vertices if they are missing.
+        :param src: source process.
+        :param dest: destination process.
+        :param count: weight to add.
+        :return: weight of the edge before the change.
+        """
+        out = self.out
+        if src >= len(out) or out[src] is None:
+            self.add_vertex(src)
+        if dest >= len(out) or out[dest] is None:
+            self.add_vertex(dest)
+        row = out[src]
+        if row is NO_EDGES:
+            row = out[src] = {}
+            old = 0
+        else:
+            old = row.get(dest, 0)
+        if not old:
+            self.edges += 1
+        row[dest] = old + count
+        return old
+
+    def remove(self, src, dest, count=1):
+        """
+        Take count off the weight of the edge src -> dest. The edge is removed
+        once its weight drops to zero.
+        :param src: source process.
+        :param dest: destination process.
+        :param count: weight to take off.
+        :return: weight of the edge before the change, 0 if there was no edge.
+        """
+        if src >= len(self.out) or not self.out[src]:
+            return 0
+        row = self.out[src]
+        old = row.get(dest, 0)
+        if old > count:
+            row[dest] = old - count
+        elif old:
+            del row[dest]
+            self.edges -= 1
+        return old
+
+    def edge_count(self):
+        return self.edges
+
+    def copy(self):
+        """
+        :return: independent copy of the graph, with the same vertex order.
+        """
+        graph = IntGraph(len(self.out))
+        for key in self.order:
+            row = self.out[key]
+            graph.out[key] = dict(row) if row else NO_EDGES
+        graph.order = dict(self.order)
+        graph.edges = self.edges
+        return graph
@@ -0,0 +1,78 @@
+import os
+import threading
+
+
+class TraceLoader(object):
+    """
+    Loads a trace file into a Core on a worker thread with Core.load_file.
+    The header comes in first, after which the steps read so far can be
+    stepped through while the rest of the file is still being parsed.
+    """
+    def __init__(self, logic, fp):
+        """
+        :param logic: Core to load into.
+        :param fp: string file path to the trace.
+        """
+        self.logic = logic
+        self.fp = fp
+        #  File size and bytes read so far, for progress.
+        self.size = 0
+        self.read = 0
+        self.header_ready = False
+        self.cancelled = False
+        #  IOError or TraceFormatError that stopped the load, if any.
+        self.error = None
+        self.thread = None
+
+    def get_fp(self):
+        return self.fp
+
+    def get_error(self):
+        return self.error
+
+    def is_header_ready(self):
+        return self.header_ready
+
+    def is_cancelled(self):
+        return self.cancelled
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def get_progress(self):
+        """
+        :return: share of the file read so far, from 0 to 1.
+        """
+        if not self.size:
+            return 0.0
+        return min(1.0, float(self.read) / self.size)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        """
+        Stop loading after the batch being parsed. The steps read so far stay
+        loaded.
+        """
+        self.cancelled = True
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        try:
+            self.size = os.path.getsize(self.fp)
+            loading = self.logic.load_file(self.fp)
+            for read in loading:
+                self.read = read
+                self.header_ready = True
+                if self.cancelled:
+                    loading.close()
+                    break
+        except IOError as e:
+            self.error = e
+            self.logic.get_event_sink().load_failed(self.fp)
+        except ValueError as e:
+            self.error = e
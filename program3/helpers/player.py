@@ -0,0 +1,149 @@
+import threading
+import time
+
+#  Play speeds in steps per second, 0 meaning as fast as possible.
+SPEEDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000, 0)
+
+
+class Player(object):
+    """
+    Runs a Core forward on a worker thread, so stepping is not tied to
+    drawing. The worker holds lock while it steps, a few milliseconds at a
+    time, and whoever draws takes the lock to read the state that is current
+    then. States stepped through in between are never drawn.
+    """
+    def __init__(self, logic):
+        """
+        :param logic: Core to run.
+        """
+        self.logic = logic
+        self.lock = threading.Lock()
+        self.speed = 10
+        self.thread = None
+        self.stopping = False
+        #  Why the last run ended: "paused", "end", "deadlock" or "target".
+        self.stopped_by = None
+        #  Bumped every time the worker moved the state, to know when to redraw.
+        self.version = 0
+        #  Longest time the worker keeps the lock at once, in seconds.
+        self.slice = 0.005
+
+    def get_speed(self):
+        return self.speed
+
+    def set_speed(self, speed):
+        """
+        :param speed: steps per second, 0 for as fast as possible. Takes
+        effect right away, also while playing.
+        """
+        self.speed = speed
+
+    def faster(self):
+        self.speed = SPEEDS[min(len(SPEEDS) - 1, SPEEDS.index(self.speed) + 1)] if self.speed in SPEEDS else 0
+
+    def slower(self):
+        self.speed = SPEEDS[max(0, SPEEDS.index(self.speed) - 1)] if self.speed in SPEEDS else SPEEDS[0]
+
+    def get_stopped_by(self):
+        return self.stopped_by
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def play(self):
+        """
+        Step forward at the set speed until the end of the trace.
+        """
+        self.start(None, False, True)
+
+    def run_until_deadlock(self):
+        """
+        Step forward as fast as possible until the system goes from not
+        deadlocked to deadlocked, or the trace ends.
+        """
+        self.start(None, True, False)
+
+    def run_to(self, state_num):
+        """
+        Move to a state. Earlier states are restored right away from the
+        nearest checkpoint, later ones are stepped to as fast as possible.
+        :param state_num: state number to move to.
+        """
+        self.pause()
+        if state_num <= self.logic.get_state_num():
+            with self.lock:
+                self.logic.seek(state_num)
+                self.version += 1
+            self.stopped_by = "target"
+            return
+        self.start(state_num, False, False)
+
+    def pause(self):
+        """
+        Stop the worker, waiting for it to finish the step it is on.
+        """
+        if self.thread is not None:
+            self.stopping = True
+            self.thread.join()
+            self.thread = None
+
+    def start(self, target, until_deadlock, paced):
+        self.pause()
+        self.stopping = False
+        self.stopped_by = None
+        self.thread = threading.Thread(target=self.run, args=(target, until_deadlock, paced))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, target, until_deadlock, paced):
+        """
+        Worker loop.
+        :param target: state number to stop at, None for the end of the trace.
+        :param until_deadlock: stop when a new deadlock appears.
+        :param paced: keep to the set speed instead of running flat out.
+        """
+        logic = self.logic
+        with self.lock:
+            deadlocked = until_deadlock and logic.detect()[0]
+        rate = None
+        reason = "paused"
+        while not self.stopping:
+            #  The trace may still be loading, so its end can move.
+            end = len(logic.get_steps())
+            if target is not None:
+                end = min(end, target)
+            if logic.get_state_num() >= end:
+                reason = "end" if target is None else "target"
+                break
+            due = end
+            if paced and self.speed:
+                #  Start counting again whenever the speed changes.
+                if self.speed != rate:
+                    rate = self.speed
+                    started = time.perf_counter()
+                    done = 0
+                due = int((time.perf_counter() - started) * rate) - done
+                if due <= 0:
+                    time.sleep(min(1.0 / rate, 0.01))
+                    continue
+            with self.lock:
+                deadline = time.perf_counter() + self.slice
+                taken = 0
+                while taken < due and logic.get_state_num() < end:
+                    logic.step_forward()
+                    taken += 1
+                    if until_deadlock:
+                        was = deadlocked
+                        deadlocked = logic.detect()[0]
+                        if deadlocked and not was:
+                            reason = "deadlock"
+                            self.stopping = True
+                            break
+                    if time.perf_counter() >= deadline:
+                        break
+                self.version += 1
+            if rate is not None:
+                done += taken
+            #  Give the drawing thread a chance at the lock.
+            time.sleep(0)
+        self.stopped_by = reason
@@ -0,0 +1,315 @@
+import copy
+import heapq
+from collections import deque
+
+
+class GrantScheduler(object):
+    """
+    Per-resource wait queues deciding which waiter gets a released resource.
+    Time is measured in simulation steps. Subclasses choose the queue order.
+    """
+    name = None
+
+    def __init__(self, starvation_steps=1000):
+        """
+        :param starvation_steps: waits longer than this many steps count as starved.
+        """
+        self.starvation_steps = starvation_steps
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all queues and statistics.
+        """
+        #  resource -> queue of waiting requests.
+        self.queues = {}
+        self.waiting = 0
+        self.grants = 0
+        self.total_wait = 0
+        self.max_wait = 0
+        self.starved = 0
+
+    def copy(self):
+        """
+        Copy the scheduler with its queues, for snapshots of the state. Queue
+        entries are tuples, so copying the queues themselves is enough.
+        :return: GrantScheduler of the same kind.
+        """
+        other = copy.copy(self)
+        other.queues = {resource: self.copy_queue(queue) for resource, queue in self.queues.items()}
+        return other
+
+    def set_priorities(self, priorities):
+        """
+        Take process priorities from the trace header. Policies that do not
+        use priorities ignore them.
+        :param priorities: list of process -> priority, lower first, or None.
+        """
+        pass
+
+    def enqueue(self, resource, process, step):
+        """
+        Queue a blocked request.
+        :param resource: resource number requested.
+        :param process: process number requesting.
+        :param step: step number at which the request blocked.
+        """
+        queue = self.queues.get(resource)
+        if queue is None:
+            queue = self.queues[resource] = self.new_queue()
+        self.push(queue, process, step)
+        self.waiting += 1
+
+    def grant(self, resource, step):
+        """
+        Pick the next waiter for a released resource and dequeue it.
+        :param resource: resource number released.
+        :param step: step number of the release.
+        :return: process number granted the resource, or None if nobody waits.
+        """
+        queue = self.queues.get(resource)
+        if not queue:
+            return None
+        process, since = self.pop(queue)
+        if not queue:
+            del self.queues[resource]
+        self.waiting -= 1
+        #  Statistics.
+        wait = step - since
+        self.grants += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        if wait > self.starvation_steps:
+            self.starved += 1
+        return process
+
+    def withdraw(self, resource, process):
+        """
+        Take a process's earliest waiting request for a resource out of the
+        queue, for a request that gave up waiting.
+        :param resource: resource number.
+        :param process: process number.
+        :return: True if a request was found and removed.
+        """
+        queue = self.queues.get(resource)
+        if not queue or not self.remove(queue, process):
+            return False
+        if not queue:
+            del self.queues[resource]
+        self.waiting -= 1
+        return True
+
+    def peek(self, resource):
+        """
+        :param resource: resource number.
+        :return: process number grant would pick next, or None if nobody waits.
+        """
+        queue = self.queues.get(resource)
+        if not queue:
+            return None
+        return self.first(queue)
+
+    def waiters(self, resource):
+        """
+        :param resource: resource number.
+        :return: number of requests waiting for the resource.
+        """
+        return len(self.queues.get(resource, ()))
+
+    def order(self, resource):
+        """
+        :param resource: resource number.
+        :return: list of processes waiting for the resource, in the order they
+        would be granted it.
+        """
+        queue = self.queues.get(resource)
+        if not queue:
+            return []
+        return self.queue_order(queue)
+
+    def get_stats(self, step):
+        """
+        Wait time and starvation statistics.
+        :param step: current step number, used to age requests still waiting.
+        :return: dict of statistics.
+        """
+        oldest = 0
+        still_starving = 0
+        for queue in self.queues.values():
+            for since in self.enqueue_steps(queue):
+                if step - since > oldest:
+                    oldest = step - since
+                if step - since > self.starvation_steps:
+                    still_starving += 1
+        return {"policy": self.name,
+                "grants": self.grants,
+                "mean_wait": self.total_wait / self.grants if self.grants else 0.0,
+                "max_wait": self.max_wait,
+                "starved": self.starved,
+                "waiting": self.waiting,
+                "oldest_wait": oldest,
+                "still_starving": still_starving}
+
+    def new_queue(self):
+        raise NotImplementedError
+
+    def copy_queue(self, queue):
+        raise NotImplementedError
+
+    def push(self, queue, process, step):
+        raise NotImplementedError
+
+    def pop(self, queue):
+        raise NotImplementedError
+
+    def first(self, queue):
+        raise NotImplementedError
+
+    def remove(self, queue, process):
+        raise NotImplementedError
+
+    def queue_order(self, queue):
+        raise NotImplementedError
+
+    def enqueue_steps(self, queue):
+        raise NotImplementedError
+
+
+class FifoScheduler(GrantScheduler):
+    """
+    Grants to the earliest waiter. O(1) per request and grant.
+    """
+    name = "fifo"
+
+    def new_queue(self):
+        return deque()
+
+    def copy_queue(self, queue):
+        return deque(queue)
+
+    def push(self, queue, process, step):
+        queue.append((process, step))
+
+    def pop(self, queue):
+        return queue.popleft()
+
+    def first(self, queue):
+        return queue[0][0]
+
+    def remove(self, queue, process):
+        for i, entry in enumerate(queue):
+            if entry[0] == process:
+                del queue[i]
+                return True
+        return False
+
+    def queue_order(self, queue):
+        return [process for process, since in queue]
+
+    def enqueue_steps(self, queue):
+        return [since for process, since in queue]
+
+
+class PriorityScheduler(GrantScheduler):
+    """
+    Grants to the waiter with the lowest priority value, earliest first on ties.
+    O(log n) per request and grant.
+    """
+    name = "priority"
+
+    def __init__(self, priorities=None, starvation_steps=1000):
+        """
+        :param priorities: dict or list of process -> priority, lower runs first.
+        Processes without an entry get priority 0.
+        :param starvation_steps: waits longer than this many steps count as starved.
+        """
+        self.priorities = priorities if priorities is not None else {}
+        self.seq = 0
+        super(PriorityScheduler, self).__init__(starvation_steps)
+
+    def set_priorities(self, priorities):
+        if priorities is not None:
+            self.priorities = priorities
+
+    def priority(self, process):
+        try:
+            return self.priorities[process]
+        except (KeyError, IndexError):
+            return 0
+
+    def key(self, process, step):
+        return self.priority(process)
+
+    def new_queue(self):
+        return []
+
+    def copy_queue(self, queue):
+        return list(queue)
+
+    def push(self, queue, process, step):
+        self.seq += 1
+        heapq.heappush(queue, (self.key(process, step), self.seq, process, step))
+
+    def pop(self, queue):
+        entry = heapq.heappop(queue)
+        return entry[2], entry[3]
+
+    def first(self, queue):
+        return queue[0][2]
+
+    def remove(self, queue, process):
+        found = [entry for entry in queue if entry[2] == process]
+        if not found:
+            return False
+        queue.remove(min(found))
+        heapq.heapify(queue)
+        return True
+
+    def queue_order(self, queue):
+        return [entry[2] for entry in sorted(queue)]
+
+    def enqueue_steps(self, queue):
+        return [entry[3] for entry in queue]
+
+
+class AgingScheduler(PriorityScheduler):
+    """
+    Priority scheduling where a waiter's effective priority improves by rate
+    per step waited: priority - rate * (now - since). Since now is shared by
+    all waiters, ordering by priority + rate * since gives the same result
+    with a static heap key. O(log n) per request and grant.
+    """
+    name = "aging"
+
+    def __init__(self, priorities=None, rate=0.01, starvation_steps=1000):
+        """
+        :param priorities: dict or list of process -> priority, lower runs first.
+        :param rate: priority gained per step of waiting.
+        :param starvation_steps: waits longer than this many steps count as starved.
+        """
+        self.rate = rate
+        super(AgingScheduler, self).__init__(priorities, starvation_steps)
+
+    def key(self, process, step):
+        return self.priority(process) + self.rate * step
+
+
+#  Scheduling policies selectable by name.
+SCHEDULERS = {
+    FifoScheduler.name: FifoScheduler,
+    PriorityScheduler.name: PriorityScheduler,
+    AgingScheduler.name: AgingScheduler,
+}
+
+
+def make_scheduler(name, **kwargs):
+    """
+    Build a grant scheduler by policy name.
+    :param name: one of SCHEDULERS.
+    :param kwargs: passed on to the scheduler.
+    :return: GrantScheduler instance.
+    """
+    if name not in SCHEDULERS:
+        raise ValueError("Unknown scheduling policy: %s" % name)
+    return SCHEDULERS[name](**kwargs)
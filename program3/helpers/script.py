@@ -0,0 +1,148 @@
+from program3.helpers.trace import TraceFormatError, read_header
+
+#  Script actions.
+COMPUTE = 0
+ACQUIRE = 1
+RELEASE = 2
+
+
+class ProcessScript(object):
+    """
+    What one process does in a timed simulation: a list of actions, run
+    repeat times over. Actions are tuples:
+        (COMPUTE, duration)
+        (ACQUIRE, resource, timeout, retries, backoff)
+        (RELEASE, resource)
+    Durations are (mean, exponential), a fixed time or one drawn from an
+    exponential distribution with that mean. timeout is None to wait forever.
+    """
+    def __init__(self, process):
+        self.process = process
+        self.actions = []
+        self.repeat = 1
+
+
+def parse_duration(fp, line_num, line, word):
+    """
+    Parse a duration such as "5" or "exp:5".
+    :param fp: file path, for error messages.
+    :param line_num: line number, for error messages.
+    :param line: the line text.
+    :param word: the duration word.
+    :return: (mean, exponential).
+    """
+    exponential = word.startswith("exp:")
+    try:
+        mean = float(word[4:] if exponential else word)
+    except ValueError:
+        raise TraceFormatError(fp, line_num, line, "bad duration")
+    if mean < 0:
+        raise TraceFormatError(fp, line_num, line, "negative duration")
+    return mean, exponential
+
+
+def parse_resource(fp, line_num, line, word, resources):
+    """
+    Parse a resource word such as "r1".
+    :param resources: number of resources.
+    :return: resource number.
+    """
+    if word[:1] != 'r' or not word[1:].isdigit() or int(word[1:]) >= resources:
+        raise TraceFormatError(fp, line_num, line, "expected a resource rN below %d" % resources)
+    return int(word[1:])
+
+
+def parse_wait_options(fp, line_num, line, parts):
+    """
+    Parse the "timeout T retries N backoff B" options of an acquire.
+    :param parts: the option words.
+    :return: (timeout, retries, backoff).
+    """
+    if len(parts) % 2:
+        raise TraceFormatError(fp, line_num, line, "expected 'timeout T', 'retries N' or 'backoff B' pairs")
+    options = {"timeout": None, "retries": 0, "backoff": (0.0, False)}
+    for name, value in zip(parts[::2], parts[1::2]):
+        if name == "retries":
+            if not value.isdigit():
+                raise TraceFormatError(fp, line_num, line, "bad retry count")
+            options[name] = int(value)
+        elif name in ("timeout", "backoff"):
+            options[name] = parse_duration(fp, line_num, line, value)
+        else:
+            raise TraceFormatError(fp, line_num, line, "unknown option %r" % name)
+    return options["timeout"], options["retries"], options["backoff"]
+
+
+def parse_action(fp, line_num, line, resources):
+    """
+    Parse a script line such as "p0 hold r1 exp:3 timeout 10 retries 2".
+    :param fp: file path, for error messages.
+    :param line_num: line number, for error messages.
+    :param line: the line text.
+    :param resources: number of resources.
+    :return: (process, verb, list of actions, or the repeat count for "repeat").
+    """
+    parts = line.split()
+    if len(parts) < 3 or parts[0][:1] != 'p' or not parts[0][1:].isdigit():
+        raise TraceFormatError(fp, line_num, line, "expected 'pN compute|acquire|release|hold|repeat ...'")
+    process, verb = int(parts[0][1:]), parts[1]
+    if verb == "repeat":
+        if len(parts) != 3 or not parts[2].isdigit():
+            raise TraceFormatError(fp, line_num, line, "expected 'pN repeat COUNT'")
+        return process, verb, int(parts[2])
+    if verb == "compute":
+        if len(parts) != 3:
+            raise TraceFormatError(fp, line_num, line, "expected 'pN compute DURATION'")
+        return process, verb, [(COMPUTE, parse_duration(fp, line_num, line, parts[2]))]
+    resource = parse_resource(fp, line_num, line, parts[2], resources)
+    if verb == "release":
+        if len(parts) != 3:
+            raise TraceFormatError(fp, line_num, line, "expected 'pN release rM'")
+        return process, verb, [(RELEASE, resource)]
+    if verb == "acquire":
+        wait = parse_wait_options(fp, line_num, line, parts[3:])
+        return process, verb, [(ACQUIRE, resource) + wait]
+    if verb == "hold":
+        if len(parts) < 4:
+            raise TraceFormatError(fp, line_num, line, "expected 'pN hold rM DURATION'")
+        wait = parse_wait_options(fp, line_num, line, parts[4:])
+        return process, verb, [(ACQUIRE, resource) + wait,
+                               (COMPUTE, parse_duration(fp, line_num, line, parts[3])),
+                               (RELEASE, resource)]
+    raise TraceFormatError(fp, line_num, line, "expected compute, acquire, release, hold or repeat")
+
+
+def read_script(fp):
+    """
+    Read a timed simulation script. It starts with a trace header, including
+    any units and claim lines, followed by one action per line:
+        p0 repeat 100
+        p0 compute exp:5
+        p0 acquire r0 timeout 10 retries 3 backoff exp:1
+        p0 hold r1 2
+        p0 release r0
+    Each process runs its own lines in order. hold rM D is short for acquiring
+    rM, computing for D and releasing rM.
+    :param fp: string file path to the script.
+    :return: (helpers.trace.TraceHeader, list of ProcessScript in process order).
+    """
+    with open(fp, 'r') as f:
+        header = read_header(f, fp)
+        scripts = {}
+        line_num = header.lines
+        for line in f:
+            line_num += 1
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            process, verb, value = parse_action(fp, line_num, line, header.resources)
+            if process >= header.processes:
+                raise TraceFormatError(fp, line_num, line, "process number beyond the header count")
+            script = scripts.get(process)
+            if script is None:
+                script = scripts[process] = ProcessScript(process)
+            if verb == "repeat":
+                script.repeat = value
+            else:
+                script.actions.extend(value)
+    return header, [scripts[p] for p in sorted(scripts)]
@@ -0,0 +1,381 @@
+import hashlib
+
+from program3.helpers.interleave import Interleaving
+from program3.helpers.script import RELEASE
+
+#  Outcomes of a search.
+DEADLOCK = "deadlock"
+STUCK = "stuck"
+
+#  Bytes of a state digest, and slots of the visited table looked at before
+#  a new digest is given up on.
+DIGEST_SIZE = 16
+PROBES = 32
+EMPTY = bytes(DIGEST_SIZE)
+
+
+class VisitedTable(object):
+    """
+    Set of state digests in one flat buffer of fixed-size slots, found by
+    linear probing, so memory is slots * DIGEST_SIZE bytes however full it
+    gets. The buffer can be shared between worker processes. Two workers
+    writing the same empty slot at once can only lose one of the digests,
+    which makes that state explored twice, never skipped.
+    """
+    def __init__(self, slots, buffer=None):
+        """
+        :param slots: number of digests the table holds.
+        :param buffer: zeroed buffer of slots * DIGEST_SIZE bytes to keep them
+        in, such as a multiprocessing.RawArray, or None for a new one.
+        """
+        self.slots = slots
+        self.table = memoryview(buffer if buffer is not None else bytearray(slots * DIGEST_SIZE)).cast('B')
+        #  Digests this process added, and whether any did not fit.
+        self.count = 0
+        self.saturated = False
+
+    def __len__(self):
+        return self.count
+
+    def add(self, digest):
+        """
+        :param digest: DIGEST_SIZE bytes.
+        :return: False if the digest was already in the table, True if it was
+        added or did not fit.
+        """
+        table = self.table
+        slot = int.from_bytes(digest[:8], "little") % self.slots
+        for i in range(min(PROBES, self.slots)):
+            start = slot * DIGEST_SIZE
+            entry = table[start:start + DIGEST_SIZE]
+            if entry == digest:
+                return False
+            if entry == EMPTY:
+                table[start:start + DIGEST_SIZE] = digest
+                self.count += 1
+                return True
+            slot = slot + 1 if slot + 1 < self.slots else 0
+        self.saturated = True
+        return True
+
+
+class Finding(object):
+    """
+    A reachable state where processes wait forever, and the schedule that
+    reaches it.
+    """
+    def __init__(self, outcome, key, path):
+        """
+        :param outcome: DEADLOCK, or STUCK if processes wait forever without
+        a deadlock the detector recognizes.
+        :param key: Interleaving.deadlock_key of the deadlock, or None.
+        :param path: list of processes, in the order they took their actions.
+        """
+        self.outcome = outcome
+        self.key = key
+        self.path = path
+
+
+class StateSpace(object):
+    """
+    Exhaustive search over every interleaving of per-process scripts, on an
+    Interleaving. The search is depth first, restoring a snapshot to take
+    each other branch. States are deduplicated by a 128-bit digest of
+    Interleaving.state kept in a VisitedTable. Once the table is full the
+    search carries on without recording new states, so it stays complete
+    and only repeats work.
+
+    Every action moves its process forward, so no state can be reached
+    again from itself and the search always ends. Processes deadlocked stay
+    deadlocked, so every reachable deadlock is also found in a state where
+    no process can act; those states are always checked, and detect also
+    runs after each request that has to wait to report deadlocks early.
+
+    With reduction, each state only explores a persistent set of processes:
+    it is closed under processes that may touch what the chosen actions
+    touch, in their future, and under the holders a waiting member needs.
+    Actions of processes outside the set are independent of those inside
+    it, so trying them first only gives equivalent orderings, and every
+    state where nobody can act is still reached. Reduction is off under
+    avoidance, where every grant depends on the whole allocation.
+    """
+    def __init__(self, header, scripts, policy="fifo", avoidance=False, reduction=True, max_states=1 << 22,
+                 buffer=None, stop=None):
+        """
+        :param header: helpers.trace.TraceHeader with the counts, units and claims.
+        :param scripts: list of helpers.script.ProcessScript.
+        :param policy: name of the grant scheduling policy.
+        :param avoidance: defer requests the Banker's algorithm finds unsafe.
+        :param reduction: use partial-order reduction.
+        :param max_states: slots of the visited table.
+        :param buffer: buffer of the visited table, to share it between workers.
+        :param stop: shared flag with a value attribute, such as a
+        multiprocessing.RawValue, that ends the search when set.
+        """
+        self.interleaving = Interleaving(header, scripts, policy, avoidance)
+        self.reduction = reduction and not avoidance
+        self.visited = VisitedTable(max_states, buffer)
+        self.stop = stop
+        #  Resources each process touches in a whole run, and from each action on.
+        actions = self.interleaving.actions
+        self.future_all = [frozenset(r for kind, r in a) for a in actions]
+        self.future_from = [[frozenset(r for kind, r in a[pc:]) for pc in range(len(a))] for a in actions]
+        #  Statistics.
+        self.states = 0
+        self.transitions = 0
+        self.revisits = 0
+        self.pruned = 0
+        self.terminal = 0
+
+    def get_interleaving(self):
+        return self.interleaving
+
+    def get_stats(self):
+        """
+        :return: dict of search statistics.
+        """
+        return {"states": self.states,
+                "transitions": self.transitions,
+                "revisits": self.revisits,
+                "pruned": self.pruned,
+                "terminal": self.terminal,
+                "visited": len(self.visited),
+                "saturated": self.visited.saturated}
+
+    def visit(self):
+        """
+        Record the current state.
+        :return: True if it was not visited before.
+        """
+        digest = hashlib.blake2b(repr(self.interleaving.state()).encode(), digest_size=DIGEST_SIZE).digest()
+        if not self.visited.add(digest):
+            self.revisits += 1
+            return False
+        self.states += 1
+        return True
+
+    def touches(self, process, resources):
+        """
+        :return: True if the process may still touch any of the resources,
+        through its actions left to run or the resources it holds.
+        """
+        interleaving = self.interleaving
+        pc = interleaving.pc[process]
+        if interleaving.run_num[process] + 1 < interleaving.repeat[process]:
+            future = self.future_all[process]
+        else:
+            future = self.future_from[process][pc]
+        if not resources.isdisjoint(future):
+            return True
+        held = interleaving.get_logic().get_hold_edges().resources_of(process)
+        return any(r in resources for r in held)
+
+    def footprint(self, process):
+        """
+        Resources the next action of a ready process may touch. Besides its
+        own resource, ending a run releases everything the process holds,
+        and each release can wake a waiter that ends its own run in turn.
+        :param process: ready process.
+        :return: set of resource numbers.
+        """
+        interleaving = self.interleaving
+        logic = interleaving.get_logic()
+        hold_edges = logic.get_hold_edges()
+        request_edges = logic.get_request_edges()
+        kind, resource = interleaving.actions[process][interleaving.pc[process]]
+        touched = {resource}
+        released = [resource] if kind == RELEASE else []
+        if interleaving.pc[process] == len(interleaving.actions[process]) - 1:
+            released = [resource] + list(hold_edges.resources_of(process))
+        seen = set()
+        while released:
+            r = released.pop()
+            if r in seen:
+                continue
+            seen.add(r)
+            touched.add(r)
+            for waiter in request_edges.processes_of(r):
+                if interleaving.pc[waiter] == len(interleaving.actions[waiter]) - 1:
+                    released.extend(hold_edges.resources_of(waiter))
+        return touched
+
+    def persistent(self, seed, limit):
+        """
+        Close a set of processes from seed: a ready member brings in every
+        process that may touch its next action's footprint, and a waiting
+        member brings in the holders of what it waits for.
+        :param seed: ready process to start from.
+        :param limit: give up once this many members are ready.
+        :return: sorted list of the ready members, or None if given up.
+        """
+        interleaving = self.interleaving
+        logic = interleaving.get_logic()
+        position = interleaving.position
+        wait_resource = interleaving.wait_resource
+        active = [p for p in range(len(position))
+                  if position[p] >= 0 or wait_resource[p] >= 0 or logic.get_hold_edges().resources_of(p)]
+        members = {seed}
+        work = [seed]
+        ready = 0
+        while work:
+            process = work.pop()
+            if position[process] >= 0:
+                ready += 1
+                if ready >= limit:
+                    return None
+                touched = self.footprint(process)
+                found = [p for p in active if p not in members and self.touches(p, touched)]
+            else:
+                found = [p for p in logic.holders(wait_resource[process]) if p not in members]
+            members.update(found)
+            work.extend(found)
+        return sorted(p for p in members if position[p] >= 0)
+
+    def choices(self):
+        """
+        :return: sorted list of the processes to try from the current state.
+        """
+        ready = sorted(self.interleaving.ready)
+        if not self.reduction or len(ready) < 2:
+            return ready
+        best = ready
+        for seed in ready:
+            found = self.persistent(seed, len(best))
+            if found is not None:
+                best = found
+                if len(best) == 1:
+                    break
+        self.pruned += len(ready) - len(best)
+        return best
+
+    def step(self, process):
+        """
+        Run the next action of a process.
+        :return: Finding if it left processes deadlocked, otherwise None.
+        """
+        interleaving = self.interleaving
+        self.transitions += 1
+        if interleaving.step(process):
+            deadlocked, processes = interleaving.get_logic().detect()
+            if deadlocked:
+                return Finding(DEADLOCK, interleaving.deadlock_key(processes), None)
+        return None
+
+    def check_terminal(self, path):
+        """
+        Check a state where no process can act. With one unit per resource
+        every deadlocked component is listed, not just the cycle detect
+        happens to report, so no deadlock is missed when reduction leaves
+        out the orders in which the others would have been found first.
+        :param path: schedule that reached the state.
+        :return: list of Finding, empty if every process finished.
+        """
+        interleaving = self.interleaving
+        logic = interleaving.get_logic()
+        self.terminal += 1
+        if interleaving.is_finished():
+            return []
+        if logic.get_detection() == "graph":
+            components, blocked = logic.find_deadlocks()
+            if components:
+                return [Finding(DEADLOCK, interleaving.cycle_key(min(c)), list(path)) for c in components]
+        else:
+            deadlocked, processes = logic.detect()
+            if deadlocked:
+                return [Finding(DEADLOCK, interleaving.deadlock_key(processes), list(path))]
+        return [Finding(STUCK, None, list(path))]
+
+    def replay(self, path):
+        """
+        Go back to the initial state and take the actions of path.
+        :param path: list of processes.
+        """
+        interleaving = self.interleaving
+        interleaving.start()
+        for process in path:
+            interleaving.step(process)
+
+    def search(self, prefix=(), find_all=False):
+        """
+        Explore every state reachable from the one prefix leads to.
+        :param prefix: list of processes to take first, leading to a state
+        frontier already recorded, or empty to start from the initial state.
+        :param find_all: keep going after a finding, to list every deadlock.
+        :return: list of Finding, with their paths from the initial state.
+        """
+        interleaving = self.interleaving
+        self.replay(prefix)
+        path = list(prefix)
+        base = len(path)
+        findings = []
+        if not prefix and not self.visit():
+            return findings
+        choices = self.choices()
+        if not choices:
+            findings.extend(self.check_terminal(path))
+            return findings
+        #  Entries of (snapshot or None when there is one choice, choices, next index).
+        stack = [(interleaving.snapshot() if len(choices) > 1 else None, choices, 0)]
+        while stack:
+            if self.stop is not None and self.stop.value:
+                break
+            snap, choices, i = stack[-1]
+            if i == len(choices):
+                stack.pop()
+                continue
+            if i > 0:
+                interleaving.restore(snap)
+            stack[-1] = (snap, choices, i + 1)
+            del path[base + len(stack) - 1:]
+            path.append(choices[i])
+            finding = self.step(choices[i])
+            if finding is not None:
+                finding.path = list(path)
+                findings.append(finding)
+                if not find_all:
+                    return findings
+            #  Processes outside a deadlock can still run into others.
+            if not self.visit():
+                continue
+            following = self.choices()
+            if following:
+                stack.append((interleaving.snapshot() if len(following) > 1 else None, following, 0))
+                continue
+            findings.extend(self.check_terminal(path))
+            if findings and not find_all:
+                return findings
+        return findings
+
+    def frontier(self, size, find_all=False):
+        """
+        Explore breadth first until there are at least size states left to
+        explore, to split them between workers.
+        :param size: number of states wanted.
+        :param find_all: keep going after a finding.
+        :return: (list of paths to the states left to explore, list of Finding).
+        """
+        paths = [[]]
+        findings = []
+        self.replay([])
+        if not self.visit():
+            return [], findings
+        while paths and len(paths) < size:
+            following = []
+            for path in paths:
+                self.replay(path)
+                choices = self.choices()
+                if not choices:
+                    findings.extend(self.check_terminal(path))
+                    continue
+                for process in choices:
+                    self.replay(path)
+                    finding = self.step(process)
+                    if finding is not None:
+                        finding.path = path + [process]
+                        findings.append(finding)
+                    if self.visit():
+                        following.append(path + [process])
+                if findings and not find_all:
+                    return [], findings
+            paths = following
+        return paths, findings
@@ -0,0 +1,190 @@
+class TraceFormatError(ValueError):
+    """
+    Raised for a malformed line in a trace file.
+    """
+    def __init__(self, fp, line_num, line, reason):
+        self.fp = fp
+        self.line_num = line_num
+        self.line = line
+        self.reason = reason
+        super(TraceFormatError, self).__init__("%s:%d: %s: %r" % (fp, line_num, reason, line))
+
+
+def parse_count(fp, line_num, line, word):
+    """
+    Parse a header line such as "3 processes".
+    :param fp: file path, for error messages.
+    :param line_num: line number, for error messages.
+    :param line: the line text.
+    :param word: the word expected after the count.
+    :return: the count.
+    """
+    parts = line.split()
+    if len(parts) < 2 or not parts[1].startswith(word):
+        raise TraceFormatError(fp, line_num, line, "expected '<count> %s'" % word)
+    try:
+        return int(parts[0])
+    except ValueError:
+        raise TraceFormatError(fp, line_num, line, "bad %s count" % word)
+
+
+def parse_step(fp, line_num, line, processes=None, resources=None):
+    """
+    Parse a step line such as "p0 requests r1".
+    :param fp: file path, for error messages.
+    :param line_num: line number, for error messages.
+    :param line: the line text.
+    :param processes: number of processes, or None to not check the range.
+    :param resources: number of resources, or None to not check the range.
+    :return: (x,y,z) x = process num, y = 1 for request / 0 for release, z = resource num.
+    """
+    parts = line.split()
+    if len(parts) != 3:
+        raise TraceFormatError(fp, line_num, line, "expected 'pN requests|releases rM'")
+    if parts[1] == 'requests':
+        re = 1
+    elif parts[1] == 'releases':
+        re = 0
+    else:
+        raise TraceFormatError(fp, line_num, line, "expected 'requests' or 'releases'")
+    if parts[0][:1] != 'p' or parts[2][:1] != 'r':
+        raise TraceFormatError(fp, line_num, line, "expected 'pN requests|releases rM'")
+    if not parts[0][1:].isdigit() or not parts[2][1:].isdigit():
+        raise TraceFormatError(fp, line_num, line, "bad process or resource number")
+    process, resource = int(parts[0][1:]), int(parts[2][1:])
+    if processes is not None and process >= processes:
+        raise TraceFormatError(fp, line_num, line, "expected a process pN below %d" % processes)
+    if resources is not None and resource >= resources:
+        raise TraceFormatError(fp, line_num, line, "expected a resource rN below %d" % resources)
+    return process, re, resource
+
+
+class TraceHeader(object):
+    """
+    Counts and optional unit, claim and priorities lines from the start of
+    a trace:
+        3 processes
+        2 resources
+        units 2 1
+        claim p0 1 1
+        priorities 2 0 1
+    units lists the units of each resource, 1 each if left out. Each claim
+    line gives the most units of each resource a process may hold at once.
+    priorities gives each process's priority for the priority and aging
+    grant policies, lower first; without it they grant in arrival order.
+    """
+    def __init__(self, processes, resources):
+        self.processes = processes
+        self.resources = resources
+        self.units = [1] * resources
+        #  process -> list of maximum units per resource.
+        self.claims = {}
+        #  Priority of each process, or None.
+        self.priorities = None
+        #  Number of lines read, to number the step lines after it.
+        self.lines = 2
+
+    def is_single_unit(self):
+        return not self.claims and all(n == 1 for n in self.units)
+
+
+def parse_numbers(fp, line_num, line, parts, count, per="resource"):
+    """
+    Parse the numbers of a units, claim or priorities line.
+    :param fp: file path, for error messages.
+    :param line_num: line number, for error messages.
+    :param line: the line text.
+    :param parts: the words holding the numbers.
+    :param count: number of numbers expected.
+    :param per: what each number is for, for error messages.
+    :return: list of numbers.
+    """
+    if len(parts) != count:
+        raise TraceFormatError(fp, line_num, line, "expected %d numbers, one per %s" % (count, per))
+    try:
+        numbers = [int(n) for n in parts]
+    except ValueError:
+        raise TraceFormatError(fp, line_num, line, "bad number")
+    if min(numbers or [0]) < 0:
+        raise TraceFormatError(fp, line_num, line, "negative number")
+    return numbers
+
+
+def read_header(f, fp):
+    """
+    Read the process and resource counts from the start of an open trace,
+    followed by any units, claim and priorities lines.
+    :param f: open text file positioned at the start.
+    :param fp: file path, for error messages.
+    :return: TraceHeader.
+    """
+    processes = parse_count(fp, 1, f.readline().strip(), 'process')
+    resources = parse_count(fp, 2, f.readline().strip(), 'resource')
+    header = TraceHeader(processes, resources)
+    while True:
+        start = f.tell()
+        line = f.readline().strip()
+        parts = line.split()
+        if not parts or parts[0] not in ('units', 'claim', 'priorities'):
+            #  First step line, leave it for iter_steps.
+            f.seek(start)
+            return header
+        header.lines += 1
+        if parts[0] == 'units':
+            units = parse_numbers(fp, header.lines, line, parts[1:], resources)
+            if 0 in units:
+                raise TraceFormatError(fp, header.lines, line, "a resource needs at least one unit")
+            header.units = units
+        elif parts[0] == 'priorities':
+            header.priorities = parse_numbers(fp, header.lines, line, parts[1:], processes, "process")
+        else:
+            if len(parts) < 2 or parts[1][:1] != 'p' or not parts[1][1:].isdigit():
+                raise TraceFormatError(fp, header.lines, line, "expected 'claim pN' and one number per resource")
+            header.claims[int(parts[1][1:])] = parse_numbers(fp, header.lines, line, parts[2:], resources)
+
+
+def iter_steps(f, fp, chunk_size=1 << 20, line_num=2, processes=None, resources=None):
+    """
+    Lazily parse the steps of an open trace positioned after the header. Lines
+    are read in batches of about chunk_size bytes, so memory use does not grow
+    with the length of the trace. Blank lines are skipped.
+    :param f: open text file positioned after the header.
+    :param fp: file path, for error messages.
+    :param chunk_size: approximate number of bytes read per batch.
+    :param line_num: number of lines before the first step, i.e. header.lines.
+    :param processes: number of processes, to reject steps outside the header.
+    :param resources: number of resources, to reject steps outside the header.
+    :return: generator of (process, request/release, resource) tuples.
+    """
+    while True:
+        lines = f.readlines(chunk_size)
+        if not lines:
+            return
+        for line in lines:
+            line_num += 1
+            if line.strip():
+                yield parse_step(fp, line_num, line.strip(), processes, resources)
+
+
+def write_trace(fp, header, steps):
+    """
+    Write a text trace that read_header and iter_steps read back as given.
+    :param fp: string file path to write.
+    :param header: TraceHeader; units, claim and priorities lines are written
+    when needed.
+    :param steps: iterable of (process, request/release, resource) tuples.
+    :return: number of steps written.
+    """
+    count = 0
+    with open(fp, 'w') as f:
+        f.write("%d processes\n%d resources\n" % (header.processes, header.resources))
+        if any(n != 1 for n in header.units):
+            f.write("units %s\n" % " ".join(str(n) for n in header.units))
+        for process in sorted(header.claims):
+            f.write("claim p%d %s\n" % (process, " ".join(str(n) for n in header.claims[process])))
+        if header.priorities is not None:
+            f.write("priorities %s\n" % " ".join(str(n) for n in header.priorities))
+        for p, re, r in steps:
+            f.write("p%d %s r%d\n" % (p, "requests" if re else "releases", r))
+            count += 1
+    return count
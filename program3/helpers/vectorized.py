@@ -0,0 +1,217 @@
+from collections import deque
+
+import numpy as np
+
+from program3.helpers.binarytrace import HEADER, REQUEST_BIT, BinaryTrace
+
+
+class ReplayAnalysis(object):
+    """
+    Whole-trace results of a vectorized replay. Step numbers are state numbers,
+    so the first step of the trace is 1, like Core.get_state_num after it.
+    """
+    def __init__(self, steps, resources):
+        self.steps = steps
+        self.resources = resources
+        #  First step at which a request blocked and a wait edge appeared.
+        self.first_wait_step = None
+        #  Per resource: requests made and requests that had to wait.
+        self.requests = np.zeros(resources, dtype=np.int64)
+        self.contention = np.zeros(resources, dtype=np.int64)
+        #  Per step: requests waiting and resources held after the step.
+        self.waiting = np.zeros(steps, dtype=np.int64)
+        self.held = np.zeros(steps, dtype=np.int64)
+        #  Hold intervals, one entry per change of a resource's holder. End is
+        #  the step the holder lost the resource, or -1 if still held.
+        self.hold_resource = np.zeros(0, dtype=np.int64)
+        self.hold_process = np.zeros(0, dtype=np.int64)
+        self.hold_start = np.zeros(0, dtype=np.int64)
+        self.hold_end = np.zeros(0, dtype=np.int64)
+        #  Resources that needed the scalar path.
+        self.fallback = []
+
+    def get_holds(self):
+        """
+        :return: list of (resource, process, start, end) hold intervals.
+        """
+        return list(zip(self.hold_resource.tolist(), self.hold_process.tolist(),
+                        self.hold_start.tolist(), self.hold_end.tolist()))
+
+
+def trace_arrays(steps):
+    """
+    Turn the steps of a trace into integer arrays.
+    :param steps: list of (process, request/release, resource) tuples, or a
+    BinaryTrace, which is decoded straight from its memory map.
+    :return: (process, op, resource) int64 arrays, op is 1 for a request.
+    """
+    if isinstance(steps, BinaryTrace):
+        words = np.frombuffer(steps.map, dtype='<u4', count=2 * len(steps), offset=HEADER.size)
+        p = (words[0::2] & (REQUEST_BIT - 1)).astype(np.int64)
+        op = (words[0::2] >> 31).astype(np.int64)
+        r = words[1::2].astype(np.int64)
+        #  Drop the view so the trace can still be unmapped.
+        del words
+        return p, op, r
+    if not len(steps):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    arr = np.asarray(steps, dtype=np.int64).reshape(-1, 3)
+    return arr[:, 0].copy(), arr[:, 1].copy(), arr[:, 2].copy()
+
+
+def analyze(p, op, r, resources=None):
+    """
+    Replay a whole trace with array operations, under the FIFO grant policy.
+
+    Each resource only changes on its own steps, so the steps are grouped by
+    resource and the number of holders plus waiters is a running sum within
+    each group. A request blocks if that count was positive, a release hands
+    off if it stays positive, and with FIFO the k-th grant of a resource goes
+    to its k-th request. Resources released while free break that model, since
+    Core then counts more than one available unit, and are replayed one step
+    at a time instead.
+    :param p: process number per step.
+    :param op: 1 for a request, 0 for a release, per step.
+    :param r: resource number per step.
+    :param resources: number of resources, defaults to the largest used + 1.
+    :return: ReplayAnalysis.
+    """
+    p = np.asarray(p, dtype=np.int64)
+    op = np.asarray(op, dtype=np.int64)
+    r = np.asarray(r, dtype=np.int64)
+    n = len(r)
+    if resources is None:
+        resources = int(r.max()) + 1 if n else 0
+    result = ReplayAnalysis(n, resources)
+    if not n:
+        return result
+    result.requests = np.bincount(r[op != 0], minlength=resources)
+
+    #  Group the steps by resource, keeping time order within each group.
+    order = np.argsort(r, kind='stable')
+    rs = r[order]
+    ops = op[order]
+    ps = p[order]
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    new_group[1:] = rs[1:] != rs[:-1]
+    starts = np.flatnonzero(new_group)
+    group = np.cumsum(new_group) - 1
+
+    #  Holders plus waiters of the resource before and after each step.
+    delta = np.where(ops != 0, 1, -1)
+    total = np.cumsum(delta)
+    n_after = total - (total - delta)[starts][group]
+    n_before = n_after - delta
+
+    bad = (np.minimum.reduceat(n_after, starts) < 0)[group]
+    is_req = (ops != 0) & ~bad
+    is_rel = (ops == 0) & ~bad
+    blocked = is_req & (n_before > 0)
+    handoff = is_rel & (n_after > 0)
+    acquired = is_req & (n_before == 0)
+    freed = is_rel & (n_after == 0)
+    granted = acquired | handoff
+
+    #  Pair the k-th grant of each resource with its k-th request.
+    grants = np.flatnonzero(granted)
+    reqs = np.flatnonzero(is_req)
+    grants_before = (np.cumsum(granted) - granted)[starts]
+    reqs_before = (np.cumsum(is_req) - is_req)[starts]
+    grant_group = group[grants]
+    rank = np.arange(len(grants)) - grants_before[grant_group]
+    holder = reqs[reqs_before[grant_group] + rank]
+
+    #  A hold ends at the next release of the same resource.
+    positions = np.where(ops == 0, np.arange(n), n)
+    next_release = np.append(np.minimum.accumulate(positions[::-1])[::-1][1:], n)[grants]
+    ends = np.minimum(next_release, n - 1)
+    closed = (next_release < n) & (rs[ends] == rs[grants])
+
+    hold_resource = [rs[grants]]
+    hold_process = [ps[holder]]
+    hold_start = [order[grants] + 1]
+    hold_end = [np.where(closed, order[ends] + 1, -1)]
+
+    waiting_delta = np.zeros(n, dtype=np.int64)
+    waiting_delta[order[blocked]] = 1
+    waiting_delta[order[handoff]] = -1
+    held_delta = np.zeros(n, dtype=np.int64)
+    held_delta[order[acquired]] = 1
+    held_delta[order[freed]] = -1
+    result.contention = np.bincount(rs[blocked], minlength=resources)
+    blocked_steps = [order[blocked]]
+
+    #  Scalar path for the resources the model does not cover.
+    for g in np.unique(group[bad]).tolist():
+        start = starts[g]
+        end = starts[g + 1] if g + 1 < len(starts) else n
+        resource = int(rs[start])
+        result.fallback.append(resource)
+        holds, blocked_at = replay_resource(order[start:end], ps[start:end], ops[start:end],
+                                            waiting_delta, held_delta)
+        result.contention[resource] += len(blocked_at)
+        blocked_steps.append(np.asarray(blocked_at, dtype=np.int64))
+        if holds:
+            holds = np.asarray(holds, dtype=np.int64)
+            hold_resource.append(np.full(len(holds), resource, dtype=np.int64))
+            hold_process.append(holds[:, 0])
+            hold_start.append(holds[:, 1])
+            hold_end.append(holds[:, 2])
+
+    blocked_steps = np.concatenate(blocked_steps)
+    if len(blocked_steps):
+        result.first_wait_step = int(blocked_steps.min()) + 1
+    result.waiting = np.cumsum(waiting_delta)
+    result.held = np.cumsum(held_delta)
+    hold_resource = np.concatenate(hold_resource)
+    hold_start = np.concatenate(hold_start)
+    index = np.lexsort((hold_start, hold_resource))
+    result.hold_resource = hold_resource[index]
+    result.hold_process = np.concatenate(hold_process)[index]
+    result.hold_start = hold_start[index]
+    result.hold_end = np.concatenate(hold_end)[index]
+    return result
+
+
+def replay_resource(times, processes, ops, waiting_delta, held_delta):
+    """
+    Replay the steps of one resource exactly like Core.step_forward with the
+    FIFO grant policy.
+    :param times: step index of each of the resource's steps, in order.
+    :param processes: process number of each step.
+    :param ops: 1 for a request, 0 for a release, per step.
+    :param waiting_delta: per-step change in waiting requests, updated in place.
+    :param held_delta: per-step change in held resources, updated in place.
+    :return: (holds, blocked) where holds is a list of [process, start, end]
+    and blocked lists the step indexes of requests that waited.
+    """
+    available = 1
+    holder = None
+    queue = deque()
+    holds = []
+    blocked = []
+    for t, process, re in zip(times.tolist(), processes.tolist(), ops.tolist()):
+        new_holder = None
+        if re:
+            if available <= 0:
+                queue.append(process)
+                blocked.append(t)
+                waiting_delta[t] += 1
+                continue
+            available -= 1
+            new_holder = process
+        elif queue:
+            new_holder = queue.popleft()
+            waiting_delta[t] -= 1
+        else:
+            available += 1
+        #  The holder changed: close the open hold and start the new one.
+        if holds and holds[-1][2] == -1:
+            holds[-1][2] = t + 1
+        if new_holder is not None:
+            holds.append([new_holder, t + 1, -1])
+        held_delta[t] += (new_holder is not None) - (holder is not None)
+        holder = new_holder
+    return holds, blocked
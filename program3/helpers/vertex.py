@@ -3,25 +3,43 @@ class Vertex(object):
     Vertex object with key and value pairs.
     Modified from:
     https://www.sanfoundry.com/python-program-find-directed-graph-contains-cycle-using-dfs/
+    A view of one process in an IntGraph. Views of the same process compare
+    and hash equal, and neighbors are handed out as views as well.
     """
-    def __init__(self, key):
+    __slots__ = ("key", "graph")
+
+    def __init__(self, key, graph):
+        """
+        :param key: process number.
+        :param graph: IntGraph the process is in.
+        """
         self.key = key
-        self.points_to = {}
+        self.graph = graph
+
+    def __eq__(self, other):
+        return isinstance(other, Vertex) and self.key == other.key and self.graph is other.graph
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
 
     def get_key(self):
         return self.key
 
     def add_neighbor(self, dest, weight):
-        self.points_to[dest] = weight
+        self.graph.add_edge(self.key, dest.key, weight)
 
     def delete_neighbor(self, dest):
-        del self.points_to[dest]
+        self.graph.delete_edge(self.key, dest.key)
 
     def get_neighbors(self):
-        return self.points_to.keys()
+        graph = self.graph
+        return [Vertex(key, graph) for key in graph.neighbors(self.key)]
 
     def get_weight(self, dest):
-        return self.points_to[dest]
+        return self.graph.neighbors(self.key)[dest.key]
 
     def does_it_point_to(self, dest):
-        return dest in self.points_to
+        return self.graph.does_edge_exist(self.key, dest.key)
@@ -0,0 +1,345 @@
+import bisect
+import random
+import sys
+from array import array
+from collections import deque
+from itertools import accumulate, islice
+
+
+class Workload(object):
+    """
+    Seeded source of synthetic trace steps. steps() yields
+    (process, 1 for request / 0 for release, resource) tuples without end,
+    tracking who holds and waits for each resource the way the FIFO grant
+    policy hands them out, so processes only ever release resources they
+    hold. The same seed always gives the same steps, and memory only depends
+    on the number of processes and resources, not on how many steps are taken.
+    """
+    name = None
+
+    def __init__(self, processes, resources, seed=0, release=0.5):
+        """
+        :param processes: number of processes.
+        :param resources: number of resources.
+        :param seed: random seed.
+        :param release: chance that a process holding resources releases one
+        instead of requesting another.
+        """
+        if processes < 1 or resources < 1:
+            raise ValueError("A workload needs at least one process and one resource.")
+        self.processes = processes
+        self.resources = resources
+        self.seed = seed
+        self.release_share = release
+        self.rnd = random.Random(seed)
+        #  Process holding each resource, -1 if free.
+        self.holder = array('l', [-1]) * resources
+        #  resource -> deque of waiting processes, for resources with waiters.
+        self.queues = {}
+        #  Resources held by each process, in no particular order.
+        self.held = [[] for i in range(processes)]
+        #  Number of requests each process is waiting on.
+        self.waits = array('l', [0]) * processes
+        #  Processes that can take a step, and the index of each in ready or -1.
+        self.ready = list(range(processes))
+        self.position = array('l', range(processes))
+
+    def header(self):
+        return "%d processes\n%d resources\n" % (self.processes, self.resources)
+
+    def can_step(self, process):
+        """
+        :return: True if the process can take a step: it is not waiting, or
+        it holds something it can release.
+        """
+        return not self.waits[process] or bool(self.held[process])
+
+    def refresh(self, process):
+        """
+        Add the process to or take it out of ready after its state changed.
+        """
+        i = self.position[process]
+        if self.can_step(process):
+            if i < 0:
+                self.position[process] = len(self.ready)
+                self.ready.append(process)
+        elif i >= 0:
+            last = self.ready.pop()
+            if last != process:
+                self.ready[i] = last
+                self.position[last] = i
+            self.position[process] = -1
+
+    def request(self, process, resource):
+        """
+        Track a request.
+        :return: True if it was granted, False if the process now waits.
+        """
+        if self.holder[resource] < 0:
+            self.holder[resource] = process
+            self.held[process].append(resource)
+            return True
+        self.queues.setdefault(resource, deque()).append(process)
+        self.waits[process] += 1
+        self.refresh(process)
+        return False
+
+    def release(self, process, resource):
+        """
+        Track a release of a resource the process holds, already taken out of
+        its held list, handing the resource to its first waiter.
+        :return: process granted the resource, or -1 if it is now free.
+        """
+        if not self.held[process]:
+            self.refresh(process)
+        queue = self.queues.get(resource)
+        if not queue:
+            self.holder[resource] = -1
+            return -1
+        waiter = queue.popleft()
+        if not queue:
+            del self.queues[resource]
+        self.waits[waiter] -= 1
+        self.holder[resource] = waiter
+        self.held[waiter].append(resource)
+        self.refresh(waiter)
+        return waiter
+
+    def pop_held(self, process):
+        """
+        Take a random resource out of a process's held list.
+        :return: resource number.
+        """
+        held = self.held[process]
+        i = self.rnd.randrange(len(held))
+        held[i], held[-1] = held[-1], held[i]
+        return held.pop()
+
+    def pick_resource(self):
+        return self.rnd.randrange(self.resources)
+
+    def steps(self):
+        """
+        Random processes request random resources, or release one they hold.
+        A waiting process requests nothing more but can still release what it
+        holds, so deadlocks come and go and the steps never run out. A process
+        that picks a resource it already holds releases one instead, so every
+        pick is a step even when releases are never chosen.
+        :return: generator of steps.
+        """
+        rnd = self.rnd
+        release = self.release_share
+        held = self.held
+        holder = self.holder
+        waits = self.waits
+        ready = self.ready
+        while ready:
+            p = ready[rnd.randrange(len(ready))]
+            if held[p] and (waits[p] or rnd.random() < release):
+                r = self.pop_held(p)
+                self.release(p, r)
+                yield p, 0, r
+                continue
+            r = self.pick_resource()
+            #  Nothing to request if the process already holds it.
+            if holder[r] == p:
+                r = self.pop_held(p)
+                self.release(p, r)
+                yield p, 0, r
+                continue
+            self.request(p, r)
+            yield p, 1, r
+
+
+class UniformWorkload(Workload):
+    """
+    Every resource is equally likely to be requested.
+    """
+    name = "uniform"
+
+
+class ZipfWorkload(Workload):
+    """
+    Resource popularity follows Zipf's law: resource k is requested in
+    proportion to 1 / (k + 1) ** skew, so r0 is the hottest and a few
+    resources take most of the requests.
+    """
+    name = "zipf"
+
+    def __init__(self, processes, resources, seed=0, release=0.5, skew=1.0):
+        """
+        :param skew: Zipf exponent, 0 for uniform; larger is more skewed.
+        """
+        super(ZipfWorkload, self).__init__(processes, resources, seed, release)
+        self.skew = skew
+        self.cumulative = array('d', accumulate(1.0 / (k + 1) ** skew for k in range(resources)))
+
+    def pick_resource(self):
+        cumulative = self.cumulative
+        return min(bisect.bisect(cumulative, self.rnd.random() * cumulative[-1]), self.resources - 1)
+
+
+class HotspotWorkload(Workload):
+    """
+    A share of the requests goes to a hot set of the first 5% of the
+    resources and the rest to any resource, so a few resources see long
+    queues while the others stay quiet.
+    """
+    name = "hotspot"
+
+    def __init__(self, processes, resources, seed=0, release=0.5, contention=0.8):
+        """
+        :param contention: share of requests that go to the hot resources.
+        """
+        super(HotspotWorkload, self).__init__(processes, resources, seed, release)
+        self.contention = contention
+        self.hot = max(1, resources // 20)
+
+    def pick_resource(self):
+        if self.rnd.random() < self.contention:
+            return self.rnd.randrange(self.hot)
+        return self.rnd.randrange(self.resources)
+
+
+class OrderedWorkload(Workload):
+    """
+    Processes follow a global lock order: a process only requests resources
+    numbered above every resource it holds, and stops stepping while it
+    waits. Wait chains then always climb to higher resources and can never
+    close into a cycle, so the trace is free of deadlock.
+    """
+    name = "ordered"
+
+    def can_step(self, process):
+        return not self.waits[process]
+
+    def steps(self):
+        """
+        :return: generator of steps.
+        """
+        rnd = self.rnd
+        resources = self.resources
+        release = self.release_share
+        held = self.held
+        ready = self.ready
+        while ready:
+            p = ready[rnd.randrange(len(ready))]
+            top = max(held[p]) if held[p] else -1
+            if held[p] and (top == resources - 1 or rnd.random() < release):
+                r = self.pop_held(p)
+                self.release(p, r)
+                yield p, 0, r
+                continue
+            r = rnd.randrange(top + 1, resources)
+            self.request(p, r)
+            yield p, 1, r
+
+
+class ChainWorkload(Workload):
+    """
+    Adversarial rounds of long wait chains. Each round, length processes
+    take one resource each, then wait on their neighbour from the far end
+    back to the start, so every new wait-for edge extends a chain that has
+    to be searched to its end. Some rounds close the chain into a cycle.
+    The chain is then unwound and the next round moves on to the next
+    processes and resources.
+    """
+    name = "chain"
+
+    def __init__(self, processes, resources, seed=0, release=0.5, length=1000, close=0.5):
+        """
+        :param length: processes in each chain, at most the number of processes
+        and of resources.
+        :param close: chance that a round closes its chain into a deadlock.
+        """
+        super(ChainWorkload, self).__init__(processes, resources, seed, release)
+        self.length = max(1, min(length, processes, resources))
+        self.close = close
+
+    def steps(self):
+        """
+        :return: generator of steps.
+        """
+        rnd = self.rnd
+        length = self.length
+        start = 0
+        while True:
+            chain = [((start + i) % self.processes, (start + i) % self.resources) for i in range(length)]
+            for p, r in chain:
+                self.request(p, r)
+                yield p, 1, r
+            #  Each new edge i -> i + 1 joins the chain already built behind it.
+            for i in range(length - 2, -1, -1):
+                p, r = chain[i][0], chain[i + 1][1]
+                self.request(p, r)
+                yield p, 1, r
+            if length > 1 and rnd.random() < self.close:
+                p, r = chain[-1][0], chain[0][1]
+                self.request(p, r)
+                yield p, 1, r
+            #  Releasing the first resources hands them down the chain, then
+            #  nobody waits and everything can go.
+            for p, r in chain:
+                self.held[p].remove(r)
+                self.release(p, r)
+                yield p, 0, r
+            for p, r in chain:
+                while self.held[p]:
+                    r = self.held[p].pop()
+                    self.release(p, r)
+                    yield p, 0, r
+            start += length
+
+
+#  Workload models selectable by name.
+WORKLOADS = {
+    UniformWorkload.name: UniformWorkload,
+    ZipfWorkload.name: ZipfWorkload,
+    HotspotWorkload.name: HotspotWorkload,
+    OrderedWorkload.name: OrderedWorkload,
+    ChainWorkload.name: ChainWorkload,
+}
+
+
+def make_workload(name, processes, resources, seed=0, **kwargs):
+    """
+    Build a workload by model name.
+    :param name: one of WORKLOADS.
+    :param processes: number of processes.
+    :param resources: number of resources.
+    :param seed: random seed.
+    :param kwargs: passed on to the workload.
+    :return: Workload instance.
+    """
+    if name not in WORKLOADS:
+        raise ValueError("Unknown workload model: %s" % name)
+    return WORKLOADS[name](processes, resources, seed, **kwargs)
+
+
+def write_workload(fp, workload, steps, batch=1 << 16):
+    """
+    Write steps of a workload as a text trace, streaming them to the file in
+    batches so traces of any length fit in memory.
+    :param fp: string file path to write, or "-" for standard output.
+    :param workload: Workload to take the steps from.
+    :param steps: number of steps to write.
+    :param batch: number of steps formatted and written at once.
+    :return: number of steps written.
+    """
+    f = sys.stdout if fp == "-" else open(fp, 'w')
+    try:
+        f.write(workload.header())
+        source = workload.steps()
+        count = 0
+        while count < steps:
+            chunk = islice(source, min(batch, steps - count))
+            lines = ["p%d requests r%d\n" % (p, r) if re else "p%d releases r%d\n" % (p, r)
+                     for p, re, r in chunk]
+            if not lines:
+                break
+            f.write("".join(lines))
+            count += len(lines)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return count
@@ -0,0 +1,273 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from statistics import NormalDist
+
+from program3.helpers.interleave import Interleaving, format_deadlock, sample, sample_trial, trial_seed
+from program3.helpers.scheduler import SCHEDULERS
+from program3.helpers.script import read_script
+from program3.helpers.trace import write_trace
+
+#  Interleavings of each worker process, by (script, policy, avoidance), so
+#  a script is only read once per worker.
+INTERLEAVINGS = {}
+
+
+def get_interleaving(fp, policy, avoidance):
+    key = (fp, policy, avoidance)
+    if key not in INTERLEAVINGS:
+        header, scripts = read_script(fp)
+        INTERLEAVINGS[key] = Interleaving(header, scripts, policy, avoidance)
+    return INTERLEAVINGS[key]
+
+
+def sample_batch(fp, seed, first, count, policy="fifo", avoidance=False):
+    """
+    Run a batch of trials in a worker.
+    :param fp: string file path to the script.
+    :param seed: run seed.
+    :param first: number of the first trial in the batch.
+    :param count: number of trials.
+    :param policy: name of the grant scheduling policy.
+    :param avoidance: defer requests the Banker's algorithm finds unsafe.
+    :return: dict of outcome counts, deadlock counts by key, the first trial
+    of each deadlock, and the number of steps taken.
+    """
+    interleaving = get_interleaving(fp, policy, avoidance)
+    logic = interleaving.get_logic()
+    outcomes = Counter()
+    deadlocks = Counter()
+    first_trial = {}
+    steps = 0
+    for trial in range(first, first + count):
+        outcome, key = sample_trial(interleaving, seed, trial)
+        outcomes[outcome] += 1
+        steps += logic.get_state_num()
+        if key is not None:
+            deadlocks[key] += 1
+            first_trial.setdefault(key, trial)
+    return {"outcomes": outcomes, "deadlocks": deadlocks, "first_trial": first_trial, "steps": steps}
+
+
+def wilson(successes, trials, z):
+    """
+    Wilson score interval for a binomial proportion, which stays sensible
+    when the proportion is close to 0 or 1.
+    :param successes: number of successes.
+    :param trials: number of trials.
+    :param z: standard normal quantile of the confidence level.
+    :return: (low, high).
+    """
+    if not trials:
+        return 0.0, 1.0
+    p = float(successes) / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4.0 * trials * trials)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def batches(trials, batch):
+    """
+    :return: generator of (first trial, count) covering trials in order.
+    """
+    for first in range(0, trials, batch):
+        yield first, min(batch, trials - first)
+
+
+def run_batches(fp, seed, trials, batch, policy, avoidance, workers):
+    """
+    Run the batches on a pool of worker processes, a few ahead of the one
+    being waited for, and hand the results back in batch order so that when
+    to stop does not depend on which worker finished first.
+    :return: generator of batch result dicts. Closing it drops the batches
+    not yet started.
+    """
+    if workers == 1:
+        for first, count in batches(trials, batch):
+            yield sample_batch(fp, seed, first, count, policy, avoidance)
+        return
+    workers = workers or os.cpu_count() or 1
+    pending = batches(trials, batch)
+    running = {}
+    done = {}
+    next_index = 0
+    submitted = 0
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            while len(running) < 2 * workers:
+                first, count = next(pending, (None, None))
+                if first is None:
+                    break
+                running[pool.submit(sample_batch, fp, seed, first, count, policy, avoidance)] = submitted
+                submitted += 1
+            if next_index in done:
+                yield done.pop(next_index)
+                next_index += 1
+                continue
+            if not running:
+                return
+            finished, unused = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done[running.pop(future)] = future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def estimate(fp, trials=10000, seed=0, workers=None, policy="fifo", avoidance=False,
+             precision=None, confidence=0.95, batch=200, min_trials=100):
+    """
+    Estimate the chance that a random interleaving of the scripts deadlocks.
+    Every trial picks a random ready process at each action from its own
+    seeded stream, so a run can be repeated exactly with any number of
+    workers.
+    :param fp: string file path to the script.
+    :param trials: most trials to run.
+    :param seed: run seed.
+    :param workers: number of worker processes, defaults to the CPU count.
+    :param policy: name of the grant scheduling policy.
+    :param avoidance: defer requests the Banker's algorithm finds unsafe.
+    :param precision: stop once the confidence interval is at most this
+    far either side of the estimate, None to run every trial.
+    :param confidence: confidence level of the interval.
+    :param batch: trials per batch handed to a worker.
+    :param min_trials: trials to run before stopping early.
+    :return: report dict.
+    """
+    read_script(fp)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+    outcomes = Counter()
+    deadlocks = Counter()
+    first_trial = {}
+    steps = 0
+    stopped_early = False
+    start = time.perf_counter()
+    results = run_batches(fp, seed, trials, batch, policy, avoidance, workers)
+    try:
+        for result in results:
+            outcomes.update(result["outcomes"])
+            deadlocks.update(result["deadlocks"])
+            for key, trial in result["first_trial"].items():
+                first_trial[key] = min(trial, first_trial.get(key, trial))
+            steps += result["steps"]
+            done = sum(outcomes.values())
+            low, high = wilson(outcomes["deadlock"], done, z)
+            if precision is not None and done >= min_trials and done < trials and \
+                    (high - low) / 2.0 <= precision:
+                stopped_early = True
+                break
+    finally:
+        results.close()
+    seconds = time.perf_counter() - start
+    done = sum(outcomes.values())
+    low, high = wilson(outcomes["deadlock"], done, z)
+    return {"file": fp,
+            "seed": seed,
+            "trials": done,
+            "deadlocks": outcomes["deadlock"],
+            "stuck": outcomes["stuck"],
+            "probability": float(outcomes["deadlock"]) / done if done else 0.0,
+            "ci_low": low,
+            "ci_high": high,
+            "confidence": confidence,
+            "stopped_early": stopped_early,
+            "cycles": [{"cycle": format_deadlock(key), "key": key, "count": count,
+                        "share": float(count) / outcomes["deadlock"], "first_trial": first_trial[key]}
+                       for key, count in sorted(deadlocks.items(), key=lambda item: (-item[1], item[0]))],
+            "steps": steps,
+            "seconds": seconds,
+            "trials_per_sec": done / seconds if seconds > 0 else 0.0}
+
+
+def write_example(fp, seed, trial, target, policy="fifo", avoidance=False):
+    """
+    Replay one trial and write the steps it took as a trace, which reproduces
+    its outcome when run with the same policy and avoidance setting.
+    :param fp: string file path to the script.
+    :param seed: run seed.
+    :param trial: trial number.
+    :param target: string file path of the trace to write.
+    :return: number of steps written.
+    """
+    header, scripts = read_script(fp)
+    interleaving = Interleaving(header, scripts, policy, avoidance)
+    interleaving.set_record(True)
+    sample(interleaving, random.Random(trial_seed(seed, trial)))
+    return write_trace(target, header, interleaving.get_trace())
+
+
+def print_report(report, top):
+    """
+    Print an estimate for people.
+    :param report: dict returned by estimate.
+    :param top: number of deadlocks to list.
+    """
+    print("%s: %d interleavings, %d deadlocked, %d stuck without deadlock." %
+          (report["file"], report["trials"], report["deadlocks"], report["stuck"]))
+    print("  Deadlock probability %.4f, %.0f%% interval %.4f - %.4f%s." %
+          (report["probability"], report["confidence"] * 100, report["ci_low"], report["ci_high"],
+           ", stopped early" if report["stopped_early"] else ""))
+    for cycle in report["cycles"][:top]:
+        print("  %6d (%5.1f%%)  %s  first in trial %d" %
+              (cycle["count"], cycle["share"] * 100, cycle["cycle"], cycle["first_trial"]))
+    if len(report["cycles"]) > top:
+        print("  ... and %d more." % (len(report["cycles"]) - top))
+    print("  %d steps, %.3f s, %.0f interleavings/sec." %
+          (report["steps"], report["seconds"], report["trials_per_sec"]))
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.montecarlo SCRIPT
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Estimate how often random interleavings of process "
+                                                 "scripts deadlock.")
+    parser.add_argument("script", help="script file, as for program3.simulate")
+    parser.add_argument("--trials", type=int, default=10000, help="most interleavings to sample")
+    parser.add_argument("--precision", type=float,
+                        help="stop once the interval is at most this far either side of the estimate")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the interval")
+    parser.add_argument("--seed", type=int, default=0, help="run seed; the same seed gives the same results")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default CPU count")
+    parser.add_argument("--batch", type=int, default=200, help="interleavings per batch handed to a worker")
+    parser.add_argument("--policy", default="fifo", choices=sorted(SCHEDULERS),
+                        help="grant scheduling policy; priority and aging use the priorities header line")
+    parser.add_argument("--avoid", action="store_true",
+                        help="avoid deadlock with the Banker's algorithm, needs claim lines in the script")
+    parser.add_argument("--top", type=int, default=5, help="number of most frequent deadlocks to list")
+    parser.add_argument("--example", metavar="FILE",
+                        help="write a trace of the first interleaving that reached the most frequent deadlock")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+    if not 0 < args.confidence < 1:
+        parser.error("--confidence must be between 0 and 1")
+
+    try:
+        report = estimate(args.script, args.trials, args.seed, args.workers, args.policy, args.avoid,
+                          args.precision, args.confidence, max(1, args.batch))
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report, args.top)
+    if args.example and report["cycles"]:
+        count = write_example(args.script, args.seed, report["cycles"][0]["first_trial"], args.example,
+                              args.policy, args.avoid)
+        if not args.json:
+            print("Wrote %d steps reaching %s to %s." % (count, report["cycles"][0]["cycle"], args.example))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
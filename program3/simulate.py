@@ -0,0 +1,94 @@
+import argparse
+import json
+import sys
+
+from program3.helpers.des import EventSimulation
+from program3.helpers.scheduler import SCHEDULERS
+from program3.helpers.script import read_script
+
+#  Number of resources listed by utilization in the summary.
+BUSIEST = 5
+
+
+def run_script(fp, seed=0, policy="fifo", avoidance=False, until=None):
+    """
+    Run a timed simulation script.
+    :param fp: string file path to the script.
+    :param seed: random seed for exponential durations.
+    :param policy: name of the grant scheduling policy.
+    :param avoidance: defer requests the Banker's algorithm finds unsafe.
+    :param until: simulated time to stop at, None to run until nothing is left to do.
+    :return: dict summarizing the run.
+    """
+    header, scripts = read_script(fp)
+    summary = EventSimulation(header, scripts, seed, policy, avoidance).run(until)
+    summary["file"] = fp
+    return summary
+
+
+def print_summary(summary):
+    """
+    Print a simulation summary for people.
+    :param summary: dict returned by run_script.
+    """
+    print("%s: %d processes, %d resources, simulated to time %.3f." %
+          (summary["file"], summary["processes"], summary["resources"], summary["sim_time"]))
+    print("  %d runs completed, %d gave up, %.4f runs per time unit." %
+          (summary["runs_completed"], summary["runs_aborted"], summary["throughput"]))
+    print("  %d timeouts, %d retries." % (summary["timeouts"], summary["retries"]))
+    for name, label in (("wait", "Acquire wait"), ("run_time", "Run time")):
+        stats = summary[name]
+        print("  %s: mean %.3f, p50 %.3f, p99 %.3f, max %.3f over %d." %
+              (label, stats["mean"], stats["p50"], stats["p99"], stats["max"], stats["count"]))
+    unfinished = summary["wait_unfinished"]
+    if unfinished["count"]:
+        print("  Unfinished acquire wait: mean %.3f, max %.3f over %d, up to the end." %
+              (unfinished["mean"], unfinished["max"], unfinished["count"]))
+    utilization = summary["utilization"]
+    busiest = sorted(range(len(utilization)), key=lambda r: -utilization[r])[:BUSIEST]
+    print("  Utilization: mean %.1f%%, busiest %s." %
+          (100.0 * sum(utilization) / len(utilization),
+           ", ".join("r%d %.1f%%" % (r, utilization[r] * 100) for r in busiest)))
+    if summary["deadlocked"]:
+        print("  Deadlock at the end, processes %s." %
+              ", ".join("p" + str(p) for p in summary["deadlocked_processes"]))
+    elif summary["waiting"]:
+        print("  Still waiting at the end: " + ", ".join("p" + str(p) for p in summary["waiting"]))
+    print("  %d events, %d steps, %.3f s, %.0f events/sec." %
+          (summary["events"], summary["steps"], summary["seconds"], summary["events_per_sec"]))
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.simulate SCRIPT [SCRIPT ...]
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Run timed process scripts as a discrete-event simulation.")
+    parser.add_argument("scripts", nargs="+", help="script files to run")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for exponential durations")
+    parser.add_argument("--policy", default="fifo", choices=sorted(SCHEDULERS),
+                        help="grant scheduling policy; priority and aging use the priorities header line")
+    parser.add_argument("--avoid", action="store_true",
+                        help="avoid deadlock with the Banker's algorithm, needs claim lines in the script")
+    parser.add_argument("--until", type=float, help="simulated time to stop at")
+    parser.add_argument("--json", action="store_true", help="print one JSON summary per line")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for fp in args.scripts:
+        try:
+            summary = run_script(fp, args.seed, args.policy, args.avoid, args.until)
+        except (IOError, ValueError) as e:
+            print(e, file=sys.stderr)
+            status = 1
+            continue
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print_summary(summary)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,15 @@
 import pygame
 import math
+import os
+from collections import OrderedDict
 from pygame.locals import *
 
 from program3.helpers.button import Button
+from program3.helpers.loader import TraceLoader
+from program3.helpers.player import Player
 
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, simpledialog
 
 
 class SimWindow(object):
@@ -23,6 +27,8 @@ class SimWindow(object):
         pygame.init()
         pygame.display.set_caption('Resource Manager Sim')
         self.logic = logic
+        #  Keep checkpoints so stepping back and seeking stay fast.
+        self.logic.set_checkpoint_interval(1000)
 
         #  Sizes and positions
         self.width = 1100
@@ -39,6 +45,9 @@ class SimWindow(object):
         self.dark_green = (74, 165, 74)
         self.light_grey = (232, 232, 232)
         self.red = (255, 0, 0)
+        self.orange = (255, 165, 0)
+        #  One color per deadlocked component, reused if there are more.
+        self.deadlock_colors = [(255, 0, 0), (214, 39, 140), (178, 34, 34), (255, 99, 71)]
         self.dark_grey = (130, 130, 130)
 
         #  Fonts
@@ -46,64 +55,193 @@ class SimWindow(object):
         self.font_menu = pygame.font.Font('program3/assets/AsapCondensed-Regular.ttf', 24)
         self.font_menu_b = pygame.font.Font('program3/assets/AsapCondensed-Bold.ttf', 30)
 
+        #  Frame pacing: the loop never runs faster than fps, and sleeps until
+        #  the next event when nothing is left to draw.
+        self.fps = 60
+        self.clock = pygame.time.Clock()
+        #  Screen regions drawn since the last display update.
+        self.dirty = []
+
+        #  Rendered text and node surfaces, least recently used dropped first.
+        self.text_cache = OrderedDict()
+        self.node_cache = OrderedDict()
+        self.cache_size = 512
+
         #  Screen and other logistics...
         self.screen = pygame.display.set_mode((self.width, self.height))
-        self.screen.fill(self.white)
         self.screen_rect = self.screen.get_rect()
+        self.graph_rect = pygame.Rect(0, 0, self.width - self.menu_width, self.height)
+        self.status_rect = pygame.Rect(self.width - self.menu_width + 1, 0, self.menu_width - 1, 280)
+        self.controls_rect = pygame.Rect(self.width - self.menu_width + 1, 540, self.menu_width - 1, 60)
+        #  Changed parts of the graph are drawn here first, as clipping thick
+        #  lines on the screen would shift their pixels.
+        self.graph_layer = pygame.Surface(self.graph_rect.size)
 
         #  Menu Stuff
         self.menu = pygame.Surface((self.menu_width, self.height))
         self.menu.fill(self.light_grey)
-        self.screen.blit(self.menu, (self.width - self.menu_width, 0))
-        pygame.draw.line(self.screen, self.dark_grey, (800, 0), (800, 600), 1)
-
-        #  Initial text.
-        self.status_text1 = self.font_menu.render("Load file to start simulation.", False, self.black)
-        self.screen.blit(self.status_text1, (820, 60))
-        self.status_text2 = self.font_menu.render(" ", False, self.black)
-        self.screen.blit(self.status_text2, (820, 85))
 
         #  Store location of each process and resource in x,y plane.
         self.location_r = []
         self.location_p = []
+        #  Nodes per row, world distance between nodes and first node of each kind.
+        self.columns = 1
+        self.spacing = 133
+        self.origin_r = (0, 0)
+        self.origin_p = (0, 0)
+        self.world = (self.width - self.menu_width, self.height)
+
+        #  View of the graph: zoom, and the world point at the top left corner.
+        self.zoom = 1.0
+        self.min_zoom = 0.5
+        self.max_zoom = 4.0
+        self.view = [0.0, 0.0]
+        self.view_changed = False
+        self.dragging = False
+        #  Screen geometry of arrows by edge, good until the view moves.
+        self.arrows = {}
+        self.arrows_view = None
+        self.arrows_size = 1 << 16
+        #  Nodes closer together than block_size pixels are merged into blocks,
+        #  and nodes smaller than label_size pixels are drawn without labels.
+        self.block_size = 8
+        self.label_size = 24
+
+        #  Arrows and highlighted processes on screen, to redraw only what changed.
+        self.drawn_edges = set()
+        self.drawn_marks = {}
+        #  Lines of the status panel and play state text on screen.
+        self.drawn_status = None
+        self.drawn_controls = None
+
+        #  Steps the core on a worker thread when playing. The loop draws the
+        #  latest state once per frame, whenever version moved on.
+        self.player = Player(logic)
+        self.drawn_version = self.player.version
+        #  Trace being loaded in the background, and whether its header is in.
+        self.loader = None
+        self.load_started = False
 
         #  Initialize the surface with processes and resources.
-        self.button_load = Button((850, 500, 200, 50), self.dark_grey, self.load, text="Load")
-        self.button_next = Button((850, 300, 200, 50), self.dark_grey, self.step_forward, text="Step Forward")
-        self.button_reset = Button((850, 400, 200, 50), self.dark_grey, self.reset, text="Reset")
+        self.button_back = Button((850, 290, 95, 40), self.dark_grey, self.step_backward, text="Step Back")
+        self.button_next = Button((955, 290, 95, 40), self.dark_grey, self.step_forward, text="Step Forward")
+        self.button_play = Button((850, 340, 95, 40), self.dark_grey, self.play, text="Play/Pause")
+        self.button_deadlock = Button((955, 340, 95, 40), self.dark_grey, self.run_until_deadlock,
+                                      text="To Deadlock")
+        self.button_slower = Button((850, 390, 95, 40), self.dark_grey, self.player.slower, text="Slower")
+        self.button_faster = Button((955, 390, 95, 40), self.dark_grey, self.player.faster, text="Faster")
+        self.button_goto = Button((850, 440, 200, 40), self.dark_grey, self.go_to_step, text="Go To Step")
+        self.button_reset = Button((850, 490, 95, 40), self.dark_grey, self.reset, text="Reset")
+        self.button_load = Button((955, 490, 95, 40), self.dark_grey, self.load, text="Load")
+        #  Takes the place of Load while a trace is loading.
+        self.button_cancel = Button((955, 490, 95, 40), self.dark_grey, self.cancel_load, text="Cancel")
+        self.buttons = [self.button_back, self.button_next, self.button_play, self.button_deadlock,
+                        self.button_slower, self.button_faster, self.button_goto, self.button_reset,
+                        self.button_load]
 
-        #  Update display.
-        pygame.display.update()
+        self.render_main()
+        self.render_status([("Load file to start simulation.", self.font_menu, self.black, (820, 60))])
 
-        self.button_load.update(self.screen)
-        self.button_next.update(self.screen)
-        self.button_reset.update(self.screen)
+        #  Update display.
+        self.flip()
 
     def load(self):
         """
         Load file and initialize game state.
         """
 
-        #  Reset location r and p in case of new load.
-        self.location_r = []
-        self.location_p = []
-
         #  Load and initialize new state.
+        self.player.pause()
         file_path = filedialog.askopenfilename()
 
+        #  Parse in the background, the state is set up once the header is in.
+        self.cancel_load()
         self.logic.reset()
-        self.logic.read_file(file_path)
-        self.logic.init_state()
-
-        #  Render core GUI pieces.
-        self.render_main()
+        self.loader = TraceLoader(self.logic, file_path)
+        self.load_started = False
+        self.swap_button(self.button_load, self.button_cancel)
+        self.render_status([("Loading " + os.path.basename(file_path) + "...", self.font_menu, self.black,
+                             (820, 60))])
+        self.loader.start()
+
+    def cancel_load(self):
+        """
+        Stop loading, keeping the steps read so far.
+        """
+        if self.loader is not None:
+            self.loader.cancel()
+            self.poll_loader()
 
-        self.status_text1 = self.font_menu.render("Step forward to start.", False, self.black)
-        self.screen.blit(self.status_text1, (820, 60))
-        self.status_text2 = self.font_menu.render(" ", False, self.black)
-        self.screen.blit(self.status_text2, (820, 85))
+    def poll_loader(self):
+        """
+        Follow the trace loading in the background: start the simulation once
+        its header is in, and report how loading ended.
+        """
+        loader = self.loader
+        if loader is None:
+            return
+        if loader.is_header_ready() and not self.load_started:
+            self.load_started = True
+            self.logic.init_state()
+            self.render_main()
+            self.render_status([("Step forward to start.", self.font_menu, self.black, (820, 60))])
+        if loader.is_running():
+            return
+        self.loader = None
+        self.swap_button(self.button_cancel, self.button_load)
+        self.render_controls()
+        steps = str(len(self.logic.get_steps()))
+        if loader.get_error() is not None:
+            lines = [("Could not load " + os.path.basename(loader.get_fp()) + ":", self.font_menu, self.red, (820, 60))]
+            y = 85
+            for text in self.wrap(self.font_menu, self.describe_error(loader.get_error()), self.menu_width - 40):
+                lines.append((text, self.font_menu, self.black, (820, y)))
+                y += 25
+            if loader.is_header_ready():
+                lines.append(("Loaded " + steps + " steps before it.", self.font_menu, self.black, (820, y + 10)))
+            self.render_status(lines)
+        elif loader.is_cancelled():
+            self.render_status([("Loading cancelled.", self.font_menu, self.black, (820, 60)),
+                                ("Loaded " + steps + " steps.", self.font_menu, self.black, (820, 85))])
+        elif self.logic.get_state_num() > 0:
+            #  Show the final step count.
+            self.render_state()
+
+    def describe_error(self, error):
+        """
+        :param error: IOError or helpers.trace.TraceFormatError.
+        :return: short text fitting the status panel.
+        """
+        if getattr(error, "line_num", None) is not None:
+            return "Line " + str(error.line_num) + ": " + error.reason
+        return getattr(error, "strerror", None) or str(error)
 
-        pygame.display.update()
+    def wrap(self, font, text, width):
+        """
+        Break text into lines that fit a width.
+        :param font: pygame font object to be used.
+        :param text: string text to break.
+        :param width: width in pixels.
+        :return: list of lines.
+        """
+        lines = []
+        for word in text.split():
+            if lines and font.size(lines[-1] + " " + word)[0] <= width:
+                lines[-1] += " " + word
+            else:
+                lines.append(word)
+        return lines
+
+    def swap_button(self, old, new):
+        """
+        Put a button in the place of another.
+        :param old: Button shown now.
+        :param new: Button to show instead.
+        """
+        if old in self.buttons:
+            self.buttons[self.buttons.index(old)] = new
+            new.update(self.screen)
+            self.dirty.append(new.rect)
 
     def reset(self):
         """
@@ -111,18 +249,15 @@ class SimWindow(object):
         """
 
         #  Reset core logic back to beginning.
+        self.player.pause()
+        if self.loader is not None and not self.load_started:
+            return
         self.logic.reset()
         self.logic.init_state()
 
         #  Render core GUI pieces.
         self.render_main()
-
-        self.status_text1 = self.font_menu.render("Step forward to start.", False, self.black)
-        self.screen.blit(self.status_text1, (820, 60))
-        self.status_text2 = self.font_menu.render(" ", False, self.black)
-        self.screen.blit(self.status_text2, (820, 85))
-
-        pygame.display.update()
+        self.render_status([("Step forward to start.", self.font_menu, self.black, (820, 60))])
 
     def loop(self):
         """
@@ -131,49 +266,376 @@ class SimWindow(object):
 
         running = True
         while running:
+            #  Sleep until something happens if the screen is up to date.
+            events = pygame.event.get()
+            if not events and not self.dirty and not self.player.is_running() and self.loader is None \
+                    and self.player.version == self.drawn_version:
+                events = [pygame.event.wait()]
             #  For loop through the event queue.
-            for event in pygame.event.get():
+            for event in events:
                 #  Check if button was clicked.
-                self.button_load.check_event(event)
-                self.button_next.check_event(event)
-                self.button_reset.check_event(event)
+                for button in self.buttons:
+                    button.check_event(event)
                 #  KEYDOWN is a constant from pygame.locals
                 if event.type == KEYDOWN:
                     #  If the ESC key has be pressed, exit.
                     if event.key == K_ESCAPE:
                         running = False
-                    elif event.key == K_SPACE:
+                    elif event.key == K_SPACE or event.key == K_RIGHT:
                         self.step_forward()
+                    elif event.key == K_LEFT:
+                        self.step_backward()
+                    elif event.key == K_p:
+                        self.play()
+                    elif event.key == K_d:
+                        self.run_until_deadlock()
+                    elif event.key == K_g:
+                        self.go_to_step()
+                    elif event.key == K_LEFTBRACKET:
+                        self.player.slower()
+                    elif event.key == K_RIGHTBRACKET:
+                        self.player.faster()
+                    elif event.key in (K_EQUALS, K_PLUS, K_KP_PLUS):
+                        self.zoom_at(1.25, self.graph_rect.center)
+                    elif event.key in (K_MINUS, K_KP_MINUS):
+                        self.zoom_at(0.8, self.graph_rect.center)
+                    elif event.key == K_HOME:
+                        self.fit_view()
+                #  Drag the graph to pan and scroll to zoom.
+                elif event.type == MOUSEBUTTONDOWN and event.button == 1:
+                    self.dragging = self.graph_rect.collidepoint(event.pos)
+                elif event.type == MOUSEBUTTONUP and event.button == 1:
+                    self.dragging = False
+                elif event.type == MOUSEMOTION and self.dragging:
+                    self.pan(*event.rel)
+                elif event.type == MOUSEWHEEL:
+                    pos = pygame.mouse.get_pos()
+                    if self.graph_rect.collidepoint(pos):
+                        self.zoom_at(1.25 ** event.y, pos)
                 #  If the window was closed, exit.
                 elif event.type == QUIT:
                     running = False
-            #  Draw current state.
-            pygame.display.update()
+                #  Redraw everything if the window was uncovered.
+                elif event.type == VIDEOEXPOSE:
+                    self.dirty.append(self.screen_rect)
+            self.poll_loader()
+            #  Draw the latest state the player got to, skipping the ones in between.
+            if self.player.version != self.drawn_version:
+                with self.player.lock:
+                    state = self.sample_state()
+                self.draw_state(*state)
+            self.render_controls()
+            #  Draw what changed, at most fps times a second.
+            if self.view_changed:
+                self.view_changed = False
+                self.redraw_graph(self.graph_rect)
+            self.flip()
+            self.clock.tick(self.fps)
+        self.player.pause()
+        self.cancel_load()
+
+    def flip(self):
+        """
+        Push the dirty regions of the screen to the display.
+        """
+        if self.dirty:
+            pygame.display.update(self.dirty)
+            self.dirty = []
 
     def render_main(self):
         """
-        Main GUI render helper function.
+        Main GUI render helper function. Redraws the whole window.
         """
 
         #  Reset/clear the canvas.
         self.screen.fill(self.white)
-        self.menu.fill(self.light_grey)
         self.screen.blit(self.menu, (self.width - self.menu_width, 0))
         pygame.draw.line(self.screen, self.dark_grey, (800, 0), (800, 600), 1)
 
-        self.draw_resource_process()
+        self.layout()
+        self.drawn_edges = set()
+        self.drawn_marks = {}
+        self.drawn_status = None
+        self.redraw_graph(self.graph_rect)
+        self.view_changed = False
+
+        for button in self.buttons:
+            button.update(self.screen)
+        self.drawn_controls = None
+        self.render_controls()
+        self.dirty.append(self.screen_rect)
+
+    def layout(self):
+        """
+        Place the resources in rows at the top and the processes in rows below
+        them, all in one row for small traces and in a roughly square grid for
+        large ones, then fit the view to the whole graph. Locations are node
+        centers in world coordinates, which are pixels at zoom 1.
+        """
+        num_r = self.logic.get_resources()
+        num_p = self.logic.get_processes()
+        most = max(num_r, num_p, 1)
+        self.columns = most if most <= 6 else max(6, int(math.ceil(math.sqrt(2 * most))))
+        rows_r = max(1, -(-num_r // self.columns))
+        rows_p = max(1, -(-num_p // self.columns))
+        self.origin_r = self.row_origin(num_r, 90)
+        self.origin_p = self.row_origin(num_p, 90 + (rows_r - 1) * self.spacing + 410)
+        self.location_r = [self.grid_point(self.origin_r, i) for i in range(num_r)]
+        self.location_p = [self.grid_point(self.origin_p, i) for i in range(num_p)]
+        self.world = (self.columns * self.spacing, self.origin_p[1] + (rows_p - 1) * self.spacing + 100)
+        self.arrows_view = None
+        self.fit_view()
+
+    def row_origin(self, count, y):
+        """
+        :param count: number of nodes in the block.
+        :param y: world y of the first row.
+        :return: world (x,y) of the first node, so the block is centered.
+        """
+        used = min(self.columns, count)
+        return (self.spacing / 2.0 + (self.columns - used) * self.spacing / 2.0, y)
+
+    def grid_point(self, origin, i):
+        """
+        :param origin: world (x,y) of the first node of the block.
+        :param i: node number.
+        :return: world (x,y) of node i.
+        """
+        return (origin[0] + (i % self.columns) * self.spacing, origin[1] + (i // self.columns) * self.spacing)
+
+    def fit_view(self):
+        """
+        Zoom and center the view so the whole graph fits, never zooming in
+        past 1.
+        """
+        width, height = self.world
+        self.zoom = min(1.0, float(self.graph_rect.width) / width, float(self.graph_rect.height) / height)
+        self.min_zoom = self.zoom / 2
+        self.view = [(width - self.graph_rect.width / self.zoom) / 2,
+                     (height - self.graph_rect.height / self.zoom) / 2]
+        self.view_changed = True
+
+    def pan(self, dx, dy):
+        """
+        Move the view along with the mouse.
+        :param dx: pixels moved to the right.
+        :param dy: pixels moved down.
+        """
+        self.view[0] -= dx / self.zoom
+        self.view[1] -= dy / self.zoom
+        self.view_changed = True
+
+    def zoom_at(self, factor, pos):
+        """
+        Zoom in or out keeping the world point under pos in place.
+        :param factor: zoom multiplier, above 1 to zoom in.
+        :param pos: screen (x,y) to zoom around.
+        """
+        x, y = self.to_world(pos)
+        self.zoom = min(self.max_zoom, max(self.min_zoom, self.zoom * factor))
+        self.view = [x - (pos[0] - self.graph_rect.x) / self.zoom,
+                     y - (pos[1] - self.graph_rect.y) / self.zoom]
+        self.view_changed = True
+
+    def to_screen(self, point):
+        """
+        :param point: world (x,y).
+        :return: screen (x,y) in whole pixels.
+        """
+        return (int(round((point[0] - self.view[0]) * self.zoom)) + self.graph_rect.x,
+                int(round((point[1] - self.view[1]) * self.zoom)) + self.graph_rect.y)
+
+    def to_world(self, pos):
+        """
+        :param pos: screen (x,y).
+        :return: world (x,y).
+        """
+        return (self.view[0] + (pos[0] - self.graph_rect.x) / self.zoom,
+                self.view[1] + (pos[1] - self.graph_rect.y) / self.zoom)
+
+    def aggregated(self):
+        """
+        :return: True if nodes are too close together on screen to draw one by
+        one, and are drawn as blocks instead.
+        """
+        return self.spacing * self.zoom < self.block_size
 
-        self.button_load.update(self.screen)
-        self.button_next.update(self.screen)
-        self.button_reset.update(self.screen)
+    def cells_in(self, count, origin, area, pad):
+        """
+        Grid cells of a block of nodes that lie in an area of the screen, found
+        from the grid itself instead of by looking at every node.
+        :param count: number of nodes in the block.
+        :param origin: world (x,y) of the first node of the block.
+        :param area: pygame Rect on screen.
+        :param pad: world distance around a node center that still counts.
+        :return: (first row, last row, first column, last column), empty
+        ranges if nothing is in the area.
+        """
+        left, top = self.to_world(area.topleft)
+        right, bottom = self.to_world(area.bottomright)
+        rows = -(-count // self.columns)
+        c0 = max(0, int(math.ceil((left - pad - origin[0]) / self.spacing)))
+        c1 = min(self.columns - 1, int(math.floor((right + pad - origin[0]) / self.spacing)))
+        r0 = max(0, int(math.ceil((top - pad - origin[1]) / self.spacing)))
+        r1 = min(rows - 1, int(math.floor((bottom + pad - origin[1]) / self.spacing)))
+        return r0, r1, c0, c1
+
+    def nodes_in(self, count, origin, area):
+        """
+        :param count: number of nodes in the block.
+        :param origin: world (x,y) of the first node of the block.
+        :param area: pygame Rect on screen.
+        :return: list of the nodes that may overlap the area.
+        """
+        r0, r1, c0, c1 = self.cells_in(count, origin, area, self.shape_size / 2.0 + 1 / self.zoom)
+        nodes = []
+        for row in range(r0, r1 + 1):
+            nodes.extend(range(row * self.columns + c0, min(count, row * self.columns + c1 + 1)))
+        return nodes
 
-    def draw_arrow(self, start, end, edge_type):
+    def cached(self, cache, key, make):
+        """
+        Look up a surface, making it if it is missing. The least recently used
+        surfaces are dropped once the cache is full.
+        :param cache: OrderedDict of key -> surface.
+        :param key: cache key.
+        :param make: function returning the surface.
+        :return: pygame surface.
         """
-        Draw an arrow from start to end.
+        surface = cache.get(key)
+        if surface is None:
+            surface = cache[key] = make()
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return surface
+
+    def text_surface(self, font, text, text_color):
+        """
+        Rendered text, cached by font, text and color.
+        :param font: pygame font object to be used.
+        :param text: string text to be rendered.
+        :param text_color: color text should be rendered.
+        :return: pygame surface.
+        """
+        return self.cached(self.text_cache, (font, text, text_color),
+                           lambda: font.render(text, False, text_color))
+
+    def node_surface(self, label, color, text_color, circle, size=None):
+        """
+        A process or resource node with its label, cached. Nodes smaller than
+        label_size are drawn without a label.
+        :param label: string label, e.g. "P0".
+        :param color: fill color.
+        :param text_color: label color.
+        :param circle: True for a process circle, False for a resource square.
+        :param size: width and height in pixels, shape_size by default.
+        :return: pygame surface of size x size.
+        """
+        size = size or self.shape_size
+        if size < self.label_size:
+            label = None
+        return self.cached(self.node_cache, (label, color, text_color, circle, size),
+                           lambda: self.make_node(label, color, text_color, circle, size))
+
+    def make_node(self, label, color, text_color, circle, size):
+        if label is not None and size != self.shape_size:
+            #  Scale the full size node so labels keep their place.
+            node = self.node_surface(label, color, text_color, circle)
+            return pygame.transform.smoothscale(node, (size, size))
+        surface = pygame.Surface((size, size), pygame.SRCALPHA)
+        if circle:
+            pygame.draw.circle(surface, color, (size // 2, size // 2), size // 2)
+            if label is not None:
+                surface.blit(self.text_surface(self.font_pr, label, text_color), (size // 2 - 15, size // 2 - 22))
+        else:
+            surface.fill(color)
+            if label is not None:
+                surface.blit(self.text_surface(self.font_pr, label, text_color), (15, 10))
+        return surface
+
+    def node_rect(self, location):
+        """
+        :param location: world (x,y) of a node center.
+        :return: screen rect of the node.
+        """
+        size = max(1, int(round(self.shape_size * self.zoom)))
+        x, y = self.to_screen(location)
+        return pygame.Rect(x - size // 2, y - size // 2, size, size)
+
+    def process_rect(self, process):
+        return self.node_rect(self.location_p[process])
+
+    def resource_rect(self, resource):
+        return self.node_rect(self.location_r[resource])
+
+    def edge_points(self, edge):
+        """
+        :param edge: ("HOLD" or "REQUEST", resource, process).
+        :return: screen (start, end) of the arrow.
+        """
+        edge_type, resource, process = edge
+        px, py = self.location_p[process]
+        rx, ry = self.location_r[resource]
+        if edge_type == "HOLD":
+            return self.to_screen((px, py - 30)), self.to_screen((rx, ry + 50))
+        return self.to_screen((rx, ry + 40)), self.to_screen((px, py - 45))
+
+    def arrow_head(self):
+        return max(4.0, 20 * self.zoom)
+
+    def arrow(self, edge):
+        """
+        Screen geometry of an edge's arrow, cached until the view moves.
+        :param edge: ("HOLD" or "REQUEST", resource, process).
+        :return: (rect covering the arrow, start, end, head polygon).
+        """
+        view = (self.zoom, self.view[0], self.view[1])
+        if view != self.arrows_view or len(self.arrows) > self.arrows_size:
+            self.arrows = {}
+            self.arrows_view = view
+        arrow = self.arrows.get(edge)
+        if arrow is None:
+            start, end = self.edge_points(edge)
+            rect = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]),
+                               abs(start[0] - end[0]) + 1, abs(start[1] - end[1]) + 1)
+            reach = int(2 * self.arrow_head()) + 4
+            arrow = self.arrows[edge] = (rect.inflate(reach, reach), start, end, self.head_points(start, end))
+        return arrow
+
+    def edge_rect(self, edge):
+        """
+        :param edge: ("HOLD" or "REQUEST", resource, process).
+        :return: rect covering the arrow and its head.
+        """
+        return self.arrow(edge)[0]
+
+    def head_points(self, start, end):
+        """
+        :param start: (x,y) tuple representing start of the arrow.
+        :param end: (x,y) tuple representing end of the arrow (where it points).
+        :return: corners of the arrow head, scaled to the zoom.
+        """
+        head = self.arrow_head()
+        rotation = math.degrees(math.atan2(start[1] - end[1], end[0] - start[0])) + 90
+        return ((end[0] + head * math.sin(math.radians(rotation)),
+                 end[1] + head * math.cos(math.radians(rotation))),
+                (end[0] + head * math.sin(math.radians(rotation - 120)),
+                 end[1] + head * math.cos(math.radians(rotation - 120))),
+                (end[0] + head * math.sin(math.radians(rotation + 120)),
+                 end[1] + head * math.cos(math.radians(rotation + 120))))
+
+    def draw_arrow(self, start, end, edge_type, surface=None, head=None):
+        """
+        Draw an arrow from start to end, scaled to the zoom.
         :param start: (x,y) tuple representing start of the arrow.
         :param end: (x,y) tuple representing end of the arrow (where it points).
         :param edge_type: string type of edge that determines color.
+        :param surface: pygame surface to draw on, the screen by default.
+        :param head: arrow head from head_points, worked out if not given.
         """
+        surface = surface or self.screen
 
         #  Check for the color of the arrow.
         edge_color = self.black
@@ -184,66 +646,108 @@ class SimWindow(object):
         elif edge_type == "DEADLOCK":
             edge_color = self.red
 
-        #  Draw arrow with a little bit of math.
-        pygame.draw.line(self.screen, edge_color, start, end, 3)
-        rotation = math.degrees(math.atan2(start[1] - end[1], end[0] - start[0])) + 90
-        pygame.draw.polygon(self.screen, edge_color, (
-            (end[0] + 20 * math.sin(math.radians(rotation)),
-             end[1] + 20 * math.cos(math.radians(rotation))),
-            (end[0] + 20 * math.sin(math.radians(rotation - 120)),
-             end[1] + 20 * math.cos(math.radians(rotation - 120))),
-            (end[0] + 20 * math.sin(math.radians(rotation + 120)),
-             end[1] + 20 * math.cos(math.radians(rotation + 120)))))
+        pygame.draw.line(surface, edge_color, start, end, max(1, int(round(3 * self.zoom))))
+        pygame.draw.polygon(surface, edge_color, head or self.head_points(start, end))
 
-    def draw_resource_process(self):
+    def draw_resource_process(self, area, edges=(), marks=None, surface=None):
         """
-        Render the resources and processes on the screen.
+        Render the resources, processes and arrows that overlap an area of the
+        graph. Arrows go over the nodes and highlighted processes over both.
+        Only nodes in the area are looked at, and only the live edges given.
+        :param area: pygame Rect to draw in.
+        :param edges: iterable of ("HOLD" or "REQUEST", resource, process).
+        :param marks: dict of process -> highlight color.
+        :param surface: pygame surface to draw on, the screen by default.
         """
+        marks = marks or {}
+        surface = surface or self.screen
+        if self.aggregated():
+            self.draw_blocks(area, edges, marks, surface)
+            return
+        size = max(1, int(round(self.shape_size * self.zoom)))
+        for i in self.nodes_in(len(self.location_r), self.origin_r, area):
+            rect = self.resource_rect(i)
+            if rect.colliderect(area):
+                surface.blit(self.node_surface("R" + str(i), self.resource_color, self.dark_blue, False, size), rect)
+        for i in self.nodes_in(len(self.location_p), self.origin_p, area):
+            rect = self.process_rect(i)
+            if i not in marks and rect.colliderect(area):
+                surface.blit(self.node_surface("P" + str(i), self.process_color, self.dark_green, True, size), rect)
+        #  Same order as a full redraw, so crossing arrows overlap the same way.
+        for edge in sorted(edges, key=lambda e: (e[1], e[2], e[0])):
+            rect, start, end, head = self.arrow(edge)
+            if rect.colliderect(area):
+                self.draw_arrow(start, end, edge[0], surface, head)
+        for process, color in marks.items():
+            rect = self.process_rect(process)
+            if rect.colliderect(area):
+                surface.blit(self.node_surface("p" + str(process), color, self.black, True, size), rect)
+
+    def block_of(self, i, k):
+        """
+        :param i: node number.
+        :param k: block side in grid cells.
+        :return: (row, column) of the block holding node i.
+        """
+        return (i // self.columns // k, i % self.columns // k)
 
-        #  Number of resources and processes.
-        num_r = self.logic.get_resources()
-        num_p = self.logic.get_processes()
-
-        #  Padding adjustments.
-        r_xpad = 15
-        r_ypad = 10
-        p_xpad = -15
-        p_ypad = -22
-
-        #  Draw resources.
-        for i in range(1, num_r + 1):
-
-            #  Store location for future use.
-            self.location_r.append((int(i * ((self.width - self.menu_width) / (num_r + 1)) - (self.shape_size / 2)),
-                                    self.shape_size))
-
-            #  Draw rectangle.
-            pygame.draw.rect(
-                self.screen,
-                self.resource_color,
-                (self.location_r[i - 1][0],
-                 self.shape_size, self.shape_size,
-                 self.shape_size))
-
-            #  Render on the screen with padding.
-            self.render_text(self.font_pr, "R" + str(i - 1),
-                             (self.location_r[i - 1][0] + r_xpad, self.location_r[i - 1][1] + r_ypad), self.dark_blue)
-
-        #  Draw processes.
-        for i in range(1, num_p + 1):
-
-            #  Store location for future use.
-            self.location_p.append((int(i * ((self.width - self.menu_width) / (num_p + 1))), 500))
-
-            #  Draw circle.
-            pygame.draw.circle(
-                self.screen,
-                self.process_color,
-                self.location_p[i - 1], int(self.shape_size / 2))
-
-            #  Render on the screen with padding.
-            self.render_text(self.font_pr, "P" + str(i - 1),
-                             (self.location_p[i - 1][0] + p_xpad, self.location_p[i - 1][1] + p_ypad), self.dark_green)
+    def block_rect(self, origin, block, k):
+        """
+        :param origin: world (x,y) of the first node of the node block.
+        :param block: (row, column) of the block.
+        :param k: block side in grid cells.
+        :return: screen rect of the block.
+        """
+        half = self.spacing / 2.0
+        left, top = self.to_screen((origin[0] + block[1] * k * self.spacing - half,
+                                    origin[1] + block[0] * k * self.spacing - half))
+        right, bottom = self.to_screen((origin[0] + (block[1] + 1) * k * self.spacing - half,
+                                        origin[1] + (block[0] + 1) * k * self.spacing - half))
+        return pygame.Rect(left, top, max(1, right - left - 1), max(1, bottom - top - 1))
+
+    def draw_blocks(self, area, edges, marks, surface):
+        """
+        Zoomed out view: nodes are merged into square blocks of k x k grid
+        cells, and all edges between the same two blocks into one line, so the
+        work depends on the blocks on screen and not on the number of nodes.
+        :param area: pygame Rect to draw in.
+        :param edges: iterable of ("HOLD" or "REQUEST", resource, process).
+        :param marks: dict of process -> highlight color.
+        :param surface: pygame surface to draw on.
+        """
+        k = int(math.ceil(self.block_size / (self.spacing * self.zoom)))
+        for count, origin, color in ((len(self.location_r), self.origin_r, self.resource_color),
+                                     (len(self.location_p), self.origin_p, self.process_color)):
+            r0, r1, c0, c1 = self.cells_in(count, origin, area, self.spacing / 2.0)
+            for row in range(r0 // k, r1 // k + 1):
+                for column in range(c0 // k, c1 // k + 1):
+                    if row * k * self.columns + column * k < count:
+                        surface.fill(color, self.block_rect(origin, (row, column), k).clip(area))
+
+        #  One line per pair of blocks and edge type.
+        lines = set()
+        for edge_type, resource, process in edges:
+            lines.add((edge_type, self.block_of(resource, k), self.block_of(process, k)))
+        for edge_type, block_r, block_p in sorted(lines):
+            start = self.block_rect(self.origin_r, block_r, k).center
+            end = self.block_rect(self.origin_p, block_p, k).center
+            color = self.process_color if edge_type == "HOLD" else self.resource_color
+            pygame.draw.line(surface, color, start, end, 1)
+
+        for process, color in marks.items():
+            surface.fill(color, self.block_rect(self.origin_p, self.block_of(process, k), k).clip(area))
+
+    def redraw_graph(self, area):
+        """
+        Redraw an area of the graph as it was last rendered. Everything
+        touching the area is drawn whole on the graph layer, and only the area
+        is copied to the screen, as clipping thick lines would shift them.
+        :param area: pygame Rect inside graph_rect.
+        """
+        self.graph_layer.fill(self.white, area)
+        self.draw_resource_process(area, self.drawn_edges, self.drawn_marks, self.graph_layer)
+        self.screen.blit(self.graph_layer, area, area)
+        self.dirty.append(area)
 
     def render_text(self, font, text, xy_location, text_color):
         """
@@ -253,98 +757,190 @@ class SimWindow(object):
         :param xy_location: (x,y) tuple location on canvas.
         :param text_color: color text should be rendered.
         """
-        text = font.render(text, False, text_color)
-        self.screen.blit(text, xy_location)
+        self.screen.blit(self.text_surface(font, text, text_color), xy_location)
+
+    def render_status(self, lines):
+        """
+        Redraw the status panel if its text changed.
+        :param lines: list of (text, font, color, (x,y)) tuples.
+        """
+        if lines == self.drawn_status:
+            return
+        self.drawn_status = lines
+        self.screen.fill(self.light_grey, self.status_rect)
+        for text, font, text_color, xy_location in lines:
+            self.render_text(font, text, xy_location, text_color)
+        self.dirty.append(self.status_rect)
+
+    def render_controls(self):
+        """
+        Redraw the play state and speed under the buttons if they changed, or
+        the loading progress while a trace loads.
+        """
+        bar = None
+        if self.loader is not None:
+            progress = self.loader.get_progress()
+            text = "Loading " + str(int(progress * 100)) + "%, " + str(len(self.logic.get_steps())) + " steps"
+            bar = int(progress * (self.menu_width - 40))
+        else:
+            speed = self.player.get_speed()
+            speed = "max speed" if speed == 0 else str(speed) + " steps/s"
+            if self.player.is_running():
+                state = "Playing"
+            else:
+                state = {"deadlock": "Deadlocked", "end": "Trace done", "target": "At step"}.get(
+                    self.player.get_stopped_by(), "Paused")
+            text = state + ", " + speed
+        if (text, bar) == self.drawn_controls:
+            return
+        self.drawn_controls = (text, bar)
+        self.screen.fill(self.light_grey, self.controls_rect)
+        self.render_text(self.font_menu, text, (820, 545), self.black)
+        if bar is not None:
+            pygame.draw.rect(self.screen, self.dark_grey, (820, 580, self.menu_width - 40, 8), 1)
+            self.screen.fill(self.dark_grey, (820, 580, bar, 8))
+        self.dirty.append(self.controls_rect)
+
+    def render_graph(self, edges, marks):
+        """
+        Redraw only the parts of the graph that changed since the last call:
+        the areas under arrows that appeared or went away and under processes
+        whose highlight changed.
+        :param edges: set of ("HOLD" or "REQUEST", resource, process).
+        :param marks: dict of process -> highlight color.
+        """
+        if self.aggregated():
+            #  Blocks and their lines are cheap, so any change redraws them all.
+            changed = [self.graph_rect] if edges != self.drawn_edges or marks != self.drawn_marks else []
+        else:
+            changed = [self.edge_rect(edge) for edge in edges ^ self.drawn_edges]
+            for process in set(marks) | set(self.drawn_marks):
+                if marks.get(process) != self.drawn_marks.get(process):
+                    changed.append(self.process_rect(process))
+            changed = [rect for rect in changed if rect.colliderect(self.graph_rect)]
+        self.drawn_edges = edges
+        self.drawn_marks = marks
+        if not changed:
+            return
+        self.redraw_graph(changed[0].unionall(changed[1:]).clip(self.graph_rect))
 
     def step_forward(self):
         """
         Step forward the core logic, then render that action.
         """
 
-        #  Render the core GUI.
-        self.render_main()
         #  Step forward logic.
+        self.player.pause()
         self.logic.step_forward()
+        self.render_state()
+
+    def step_backward(self):
+        """
+        Step the core logic back one state, then render that state.
+        """
+        self.player.pause()
+        if self.logic.get_state_num() == 0:
+            return
+        #  Restores the nearest checkpoint and replays up to the previous state.
+        self.logic.step_backward()
+        self.render_state()
+
+    def play(self):
+        """
+        Start playing at the set speed, or pause if playing.
+        """
+        if self.player.is_running():
+            self.player.pause()
+        else:
+            self.player.play()
+
+    def run_until_deadlock(self):
+        """
+        Run as fast as possible until the next deadlock.
+        """
+        self.player.run_until_deadlock()
+
+    def go_to_step(self):
+        """
+        Ask for a step number and move there.
+        """
+        self.player.pause()
+        state_num = simpledialog.askinteger("Go To Step", "Step number:", minvalue=0,
+                                            maxvalue=len(self.logic.get_steps()))
+        if state_num is not None:
+            self.player.run_to(state_num)
+
+    def render_state(self):
+        """
+        Render the current state of the core logic.
+        """
+        self.draw_state(*self.sample_state())
+
+    def sample_state(self):
+        """
+        Read everything drawn of the current state. While playing, the caller
+        holds the player's lock for this part only.
+        :return: (status lines, edges, marks) for draw_state.
+        """
+        self.drawn_version = self.player.version
+
         #  Run deadlock detection.
-        deadlocked_t = self.logic.deadlock_detection()
+        deadlocked_t = self.logic.detect()
 
         #  Get variables from logic.
         l_str = self.logic.get_state_string()
         num_p = self.logic.get_processes()
         num_r = self.logic.get_resources()
-
-        #  State title.
-        self.status_text3 = self.font_menu_b.render("STATE", False, self.black)
-        self.screen.blit(self.status_text3, (820, 20))
-
-        #  Step text.
-        self.status_text1 = \
-            self.font_menu.render("Step " + str(self.logic.get_state_num()) + " of " + str(len(self.logic.get_steps())),
-                                  False, self.black)
-        self.screen.blit(self.status_text1, (820, 60))
-
-        #  Num processes and resources.
-        self.status_text2 = \
-            self.font_menu.render("Processes: " + str(num_p) + "  Resources: " + str(num_r), False, self.black)
-        self.screen.blit(self.status_text2, (820, 85))
-
-        #  Step title.
-        self.status_text3 = self.font_menu_b.render("STEP " + str(self.logic.get_state_num()), False, self.black)
-        self.screen.blit(self.status_text3, (820, 120))
-
-        #  Step forward text.
-        self.status_text1 = self.font_menu.render(l_str[0], False, self.black)
-        self.screen.blit(self.status_text1, (820, 160))
-
-        #  Process request/release text.
-        self.status_text2 = self.font_menu.render(l_str[1], False, self.black)
-        self.screen.blit(self.status_text2, (820, 185))
-
-        #  Padding adjustments.
-        p_padh = -30
-        p_padr = -45
-        r_padyh = 80
-        r_padyr = 70
-        r_padx = 30
-
-        #  Get the adjacency matrices.
-        holders = self.logic.get_hold_edges()
-        requesters = self.logic.get_request_edges()
-
-        #  Run through hold and request edges then render arrows.
-        for resource in range(num_r):
-            for process in range(num_p):
-                if holders[resource][process]:
-                    print("Resource %d being held by process %d." % (resource, process))
-                    self.draw_arrow((self.location_p[process][0], self.location_p[process][1] + p_padh),
-                                    (self.location_r[resource][0] + r_padx, self.location_r[resource][1] + r_padyh),
-                                    "HOLD")
-                if requesters[resource][process]:
-                    print("Resource %d being requested by process %d." % (resource, process))
-                    self.draw_arrow((self.location_r[resource][0] + r_padx, self.location_r[resource][1] + r_padyr),
-                                    (self.location_p[process][0], self.location_p[process][1] + p_padr), "REQUEST")
+        state_num = self.logic.get_state_num()
+
+        lines = [("STATE", self.font_menu_b, self.black, (820, 20)),
+                 ("Step " + str(state_num) + " of " + str(len(self.logic.get_steps())),
+                  self.font_menu, self.black, (820, 60)),
+                 ("Processes: " + str(num_p) + "  Resources: " + str(num_r), self.font_menu, self.black, (820, 85)),
+                 ("STEP " + str(state_num), self.font_menu_b, self.black, (820, 120)),
+                 (l_str[0], self.font_menu, self.black, (820, 160)),
+                 (l_str[1], self.font_menu, self.black, (820, 185))]
+
+        #  Live hold and request edges.
+        edges = set()
+        for resource, row in self.logic.get_hold_edges().by_resource.items():
+            edges.update(("HOLD", resource, process) for process, count in row.items() if count)
+        for resource, row in self.logic.get_request_edges().by_resource.items():
+            edges.update(("REQUEST", resource, process) for process, count in row.items() if count)
 
         #  Check if we are deadlocked at this state.
+        marks = {}
         if deadlocked_t[0]:
             #  We are deadlocked and set text state.
-            self.status_text3 = self.font_menu_b.render("STATUS: DEADLOCKED", False, self.red)
-            self.screen.blit(self.status_text3, (820, 235))
-
-            #  Padding adjustments.
-            p_xpad = -15
-            p_ypad = -22
-
-            #  Highlight each deadlocked process and make them red.
-            for vertex in deadlocked_t[1]:
-                pygame.draw.circle(
-                    self.screen,
-                    self.red,
-                    self.location_p[vertex], int(self.shape_size / 2))
-                self.render_text(self.font_pr, "p" + str(vertex),
-                                 (self.location_p[vertex][0] + p_xpad, self.location_p[vertex][1] + p_ypad),
-                                 self.black)
+            lines.append(("STATUS: DEADLOCKED", self.font_menu_b, self.red, (820, 235)))
+
+            #  Highlight every deadlocked component in its own color, and
+            #  the processes blocked behind them in orange.
+            if self.logic.get_detection() == "scc":
+                components = self.logic.get_deadlock_components()
+                blocked = self.logic.get_deadlock_blocked()
+            else:
+                components, blocked = self.logic.find_deadlocks()
+            if not components:
+                #  Multi-unit deadlocks without a single-unit cycle.
+                components = [deadlocked_t[1]]
+            for vertex in blocked:
+                marks[vertex] = self.orange
+            for i, component in enumerate(components):
+                for vertex in component:
+                    marks[vertex] = self.deadlock_colors[i % len(self.deadlock_colors)]
 
         else:
             #  We are not deadlocked and set text state.
-            self.status_text3 = self.font_menu_b.render("STATUS: OK", False, self.process_color)
-            self.screen.blit(self.status_text3, (820, 235))
+            lines.append(("STATUS: OK", self.font_menu_b, self.process_color, (820, 235)))
+        return lines, edges, marks
+
+    def draw_state(self, lines, edges, marks):
+        """
+        Draw a state read by sample_state.
+        :param lines: list of (text, font, color, (x,y)) status lines.
+        :param edges: set of ("HOLD" or "REQUEST", resource, process).
+        :param marks: dict of process -> highlight color.
+        """
+        self.render_graph(edges, marks)
+        self.render_status(lines)
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from program3.headless import run_trace
+from program3.helpers.scheduler import SCHEDULERS
+
+#  File name patterns picked up from directories.
+TRACE_PATTERNS = ("*.data", "*.rmst")
+
+
+def find_traces(paths):
+    """
+    Expand files and directories into a sorted list of trace files.
+    :param paths: list of file or directory paths.
+    :return: list of trace file paths.
+    """
+    traces = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in TRACE_PATTERNS:
+                traces.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            traces.append(path)
+    return sorted(set(traces))
+
+
+def sweep_one(fp, policy):
+    """
+    Run one trace in a worker, turning any failure into a result.
+    :param fp: string file path to the trace.
+    :param policy: name of the grant scheduling policy.
+    :return: summary dict from run_trace, or a dict with an error.
+    """
+    try:
+        summary = run_trace(fp, policy)
+        summary["error"] = None
+        return summary
+    except Exception as e:
+        return failed(fp, "%s: %s" % (type(e).__name__, e))
+
+
+def failed(fp, error):
+    """
+    :param fp: string file path to the trace.
+    :param error: description of the failure.
+    :return: result dict for a trace that could not be run.
+    """
+    return {"file": fp, "error": error}
+
+
+def run_pool(traces, policy, workers, on_result):
+    """
+    Run traces on a pool of worker processes, reporting each result as it
+    finishes. Only as many traces as there are workers are handed out at a
+    time, so when a worker dies the traces it could have been running are
+    known and the rest have not been started.
+    :param traces: list of trace file paths.
+    :param policy: name of the grant scheduling policy.
+    :param workers: number of worker processes.
+    :param on_result: called with each result dict.
+    :return: (list of traces running when a worker died, list of traces not
+    started).
+    """
+    crashed = []
+    running = {}
+    next_trace = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while not crashed and (running or next_trace < len(traces)):
+            while len(running) < workers and next_trace < len(traces):
+                try:
+                    running[pool.submit(sweep_one, traces[next_trace], policy)] = traces[next_trace]
+                except BrokenProcessPool:
+                    #  Blame the trace that could not be handed out if nothing else can be.
+                    if not running:
+                        crashed.append(traces[next_trace])
+                        next_trace += 1
+                    break
+                next_trace += 1
+            if not running:
+                break
+            finished, unused = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                fp = running.pop(future)
+                try:
+                    on_result(future.result())
+                except BrokenProcessPool:
+                    crashed.append(fp)
+    #  The pool has shut down, so the rest have either finished or gone down with it.
+    for future, fp in running.items():
+        if isinstance(future.exception(), BrokenProcessPool):
+            crashed.append(fp)
+        else:
+            on_result(future.result())
+    return crashed, traces[next_trace:]
+
+
+def sweep(traces, policy="fifo", workers=None, on_result=None):
+    """
+    Run independent traces in parallel and merge the results. A worker that
+    dies takes the pool down with it, so the traces that were running then
+    are retried one per pool to find and isolate the one that crashed, and
+    the traces not yet started go on in a fresh pool.
+    :param traces: list of trace file paths.
+    :param policy: name of the grant scheduling policy.
+    :param workers: number of worker processes, defaults to the CPU count.
+    :param on_result: optional callback for each result as it arrives.
+    :return: merged report dict.
+    """
+    results = []
+
+    def collect(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    pending = list(traces)
+    while pending:
+        crashed, pending = run_pool(pending, policy, workers, collect)
+        for fp in crashed:
+            for lost in run_pool([fp], policy, 1, collect)[0]:
+                collect(failed(lost, "worker process died"))
+    return merge(results, time.perf_counter() - start)
+
+
+def merge(results, seconds):
+    """
+    Merge per-trace results into one report.
+    :param results: list of result dicts.
+    :param seconds: wall time of the sweep.
+    :return: report dict.
+    """
+    ok = [r for r in results if r["error"] is None]
+    steps = sum(r["steps"] for r in ok)
+    return {"traces": len(results),
+            "succeeded": len(ok),
+            "failed": len(results) - len(ok),
+            "deadlocked": sum(1 for r in ok if r["deadlocked"]),
+            "total_steps": steps,
+            "seconds": seconds,
+            "steps_per_sec": steps / seconds if seconds > 0 else 0.0,
+            "peak_wait_edges": max([r["peak_wait_edges"] for r in ok] or [0]),
+            "results": sorted(results, key=lambda r: r["file"])}
+
+
+def print_result(result):
+    """
+    Print one line for a finished trace.
+    :param result: result dict.
+    """
+    if result["error"] is not None:
+        print("FAIL  %s: %s" % (result["file"], result["error"]))
+    elif result["deadlocked"]:
+        print("DEAD  %s: step %d, %d steps, %.0f steps/sec, peak %d wait edges" %
+              (result["file"], result["first_deadlock_step"], result["steps"],
+               result["steps_per_sec"], result["peak_wait_edges"]))
+    else:
+        print("OK    %s: %d steps, %.0f steps/sec, peak %d wait edges" %
+              (result["file"], result["steps"], result["steps_per_sec"], result["peak_wait_edges"]))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m program3.sweep PATH [PATH ...]
+    :param argv: list of arguments, defaults to sys.argv[1:].
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(description="Run many traces in parallel and merge the results.")
+    parser.add_argument("paths", nargs="+", help="trace files or directories of traces")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default CPU count")
+    parser.add_argument("--policy", default="fifo", choices=sorted(SCHEDULERS),
+                        help="grant scheduling policy; priority and aging use the priorities header line")
+    parser.add_argument("--report", help="write the merged report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    traces = find_traces(args.paths)
+    if not traces:
+        print("No traces found.", file=sys.stderr)
+        return 1
+    report = sweep(traces, args.policy, args.workers, print_result)
+    print("%d traces, %d deadlocked, %d failed, %d steps in %.2f s (%.0f steps/sec)." %
+          (report["traces"], report["deadlocked"], report["failed"], report["total_steps"],
+           report["seconds"], report["steps_per_sec"]))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import os
+import unittest
+
+from program3.core import Core
+from program3.helpers.events import EventSink, PrintSink
+
+INPUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "inputs")
+
+
+def run_to_end(fp):
+    """
+    :param fp: string file path to a trace in inputs.
+    :return: Core stepped to the end of the trace.
+    """
+    logic = Core()
+    logic.set_event_sink(EventSink())
+    logic.read_file(os.path.join(INPUTS, fp))
+    logic.init_state()
+    while logic.get_state_num() < len(logic.get_steps()):
+        logic.step_forward()
+    return logic
+
+
+class DeadlockDetectionTest(unittest.TestCase):
+    def test_reported_path(self):
+        #  Vertices are searched in the order processes first met an edge.
+        logic = run_to_end("test1.data")
+        self.assertEqual(logic.deadlock_detection(), (True, [0, 1, 4, 3]))
+        self.assertEqual(logic.get_deadlock_cycle(), [0, 1, 4, 3])
+
+
+class DetectionSwitchTest(unittest.TestCase):
+    """
+    Switching detection engines between detects gives the graph engine's
+    own answer back, with a cycle for the sinks to print.
+    """
+    def check_switch(self, engine):
+        logic = run_to_end("test1.data")
+        logic.set_event_sink(PrintSink())
+        first = logic.detect()
+        logic.set_detection(engine)
+        self.assertTrue(logic.detect()[0])
+        logic.set_detection("graph")
+        self.assertEqual(logic.detect(), first)
+        self.assertIsNotNone(logic.get_deadlock_cycle())
+
+    def test_switch_from_matrix(self):
+        self.check_switch("matrix")
+
+    def test_switch_from_scc(self):
+        self.check_switch("scc")
+
+
+if __name__ == "__main__":
+    unittest.main()
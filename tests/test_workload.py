@@ -0,0 +1,17 @@
+import subprocess
+import sys
+import unittest
+
+
+class WorkloadTest(unittest.TestCase):
+    def test_no_release_terminates(self):
+        #  The only process keeps picking the resource it already holds.
+        out = subprocess.run([sys.executable, "-m", "program3.generate", "-", "--processes", "1",
+                              "--resources", "1", "--release", "0", "--steps", "5"],
+                             capture_output=True, text=True, timeout=30)
+        self.assertEqual(out.returncode, 0)
+        self.assertEqual(len(out.stdout.splitlines()), 2 + 5)
+
+
+if __name__ == "__main__":
+    unittest.main()